@@ -0,0 +1,287 @@
+"""
+Autopilot that plays Snake on its own, for attract mode and as a baseline bot
+"""
+
+import heapq
+import weakref
+from collections import deque
+from snake_engine import OBSTACLE_CELL, GOOMBA_CELL, HUNTING_OBSTACLES, Direction
+
+DIRECTIONS = (Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT)
+
+def hamiltonian_direction(width, height):
+    """ Direction function of a cycle through every cell, None if the board has none
+
+    With an even width the columns are walked down and up in turn below the
+    top row, which is the way back. Odd widths use the same cycle turned on
+    its side, and boards with both sides odd have no cycle at all.
+    """
+    if width % 2 == 0 and height >= 2:
+        def direction(x, y):
+            if y == 0:
+                return Direction.LEFT if x > 0 else Direction.DOWN
+            if x % 2 == 0:
+                return Direction.DOWN if y < height - 1 else Direction.RIGHT
+            return Direction.UP if y > 1 or x == width - 1 else Direction.RIGHT
+        return direction
+    if height % 2 == 0 and width >= 2:
+        transposed = hamiltonian_direction(height, width)
+        swap = {Direction.UP: Direction.LEFT, Direction.DOWN: Direction.RIGHT,
+                Direction.LEFT: Direction.UP, Direction.RIGHT: Direction.DOWN}
+        return lambda x, y: swap[transposed(y, x)]
+    return None
+
+class Autopilot:
+    """ Drives the snake of an engine, call next_direction() before every step
+
+    The snake takes the shortest path (A*) to the food if it can still reach
+    its own tail after eating it. Otherwise it follows a Hamiltonian cycle of
+    the board, or moves to wherever it has the most room.
+
+    A planned path is kept until it is used up. Between ticks only the cells
+    of the obstacles and Goombas are checked against it, and if one has
+    moved onto it, only the stretch around that cell is planned again. A
+    tick that just follows the path costs a few set lookups however long
+    the snake is.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.free_cells = None  # Board the path was planned on, reset() swaps it
+        self.path = deque()  # Cells to visit after the head, ending on the food
+        self.path_cells = set()
+        self.target = None
+        self.cycle = hamiltonian_direction(engine.width, engine.height)
+        self.plans = 0  # Full plans and repairs, to see how well the cache works
+        self.repairs = 0
+
+    def clear_path(self):
+        self.path.clear()
+        self.path_cells.clear()
+        self.target = None
+
+    def set_path(self, path, target):
+        self.path = deque(path)
+        self.path_cells = set(path)
+        self.target = target
+
+    def blocked(self, cell):
+        """ Check if an obstacle or a Goomba is on cell """
+        free_cells = self.engine.free_cells
+        return free_cells.has(cell, OBSTACLE_CELL) or free_cells.has(cell, GOOMBA_CELL)
+
+    def danger(self):
+        """ Cells the obstacles will be on after the next tick
+
+        Obstacles move after the snake, so those are the cells the head must
+        not step into. Their moves only depend on their own counters and
+        directions, so each one is moved and put back to see where it goes.
+        Hunting obstacles steer by where the head will be, so every cell
+        they could step to counts.
+        """
+        cells = set()
+        for obstacle in self.engine.obstacles:
+            if (self.engine.hunting and obstacle.type in HUNTING_OBSTACLES and
+                    obstacle.move_counter + 1 >= obstacle.move_delay):
+                x, y = obstacle.position
+                cells.update(((x, y), (x, y - 1), (x, y + 1), (x - 1, y), (x + 1, y)))
+                continue
+            saved = (obstacle.position, obstacle.direction, obstacle.move_counter)
+            obstacle.move()
+            cells.add(obstacle.position)
+            obstacle.position, obstacle.direction, obstacle.move_counter = saved
+        return cells
+
+    def behind(self):
+        """ Cell right behind the head, the snake can't turn around into it """
+        head_x, head_y = self.engine.snake.body[0]
+        dx, dy = self.engine.snake.direction.value
+        return (head_x - dx, head_y - dy)
+
+    def body_life(self):
+        """ How many more moves each snake cell stays covered """
+        snake = self.engine.snake
+        length = len(snake.body) + (1 if snake.grow else 0)
+        return {cell: length - i for i, cell in enumerate(snake.body)}
+
+    def find_path(self, start, goals, life, danger, start_time=0, avoid=None):
+        """ A* from start to any of goals, returns the cells after start or None
+
+        A cell covered by the snake counts as free once the tail has left it
+        by the time the head gets there, and danger cells are avoided on the
+        first move. The heuristic is the distance to the nearest goal when
+        there are few of them, else zero (plain BFS order).
+        """
+        free_cells = self.engine.free_cells
+        goals = set(goals)
+        if len(goals) <= 4:
+            def heuristic(cell):
+                return min(abs(cell[0] - gx) + abs(cell[1] - gy) for gx, gy in goals)
+        else:
+            def heuristic(cell):
+                return 0
+        came_from = {start: None}
+        heap = [(heuristic(start), start_time, start)]
+        while heap:
+            f, time, cell = heapq.heappop(heap)
+            if cell in goals and cell != start:
+                path = []
+                while cell != start:
+                    path.append(cell)
+                    cell = came_from[cell]
+                path.reverse()
+                return path
+            x, y = cell
+            for dx, dy in ((0, -1), (0, 1), (-1, 0), (1, 0)):
+                neighbour = (x + dx, y + dy)
+                if neighbour in came_from or not free_cells.inside(neighbour):
+                    continue
+                if self.blocked(neighbour) or life.get(neighbour, 0) > time + 1:
+                    continue
+                if time == 0 and (neighbour in danger or neighbour == avoid):
+                    continue
+                came_from[neighbour] = cell
+                heapq.heappush(heap, (time + 1 + heuristic(neighbour), time + 1, neighbour))
+        return None
+
+    def room(self, start, blocked, goal, limit):
+        """ Flood fill from start, returns (goal reached, cells reached) stopping at limit cells """
+        free_cells = self.engine.free_cells
+        seen = {start}
+        queue = deque([start])
+        while queue and len(seen) <= limit:
+            x, y = queue.popleft()
+            for dx, dy in ((0, -1), (0, 1), (-1, 0), (1, 0)):
+                neighbour = (x + dx, y + dy)
+                if neighbour == goal:
+                    return True, len(seen)
+                if neighbour in seen or neighbour in blocked or not free_cells.inside(neighbour):
+                    continue
+                if self.blocked(neighbour):
+                    continue
+                seen.add(neighbour)
+                queue.append(neighbour)
+        return len(seen) > limit, len(seen)
+
+    def safe_after(self, path):
+        """ Check if the snake can still reach its tail after following path and eating """
+        body = self.engine.snake.body
+        length = len(body) + 1  # It grows when it eats at the end of the path
+        new_body = list(reversed(path[-length:]))
+        if len(new_body) < length:
+            new_body.extend(list(body)[:length - len(new_body)])
+        tail = new_body[-1]
+        reached, size = self.room(new_body[0], set(new_body), tail, length)
+        return reached
+
+    def plan(self, danger):
+        """ Plan a new path to the food, returns whether a safe one was found """
+        self.plans += 1
+        self.clear_path()
+        food = self.engine.food.position
+        if food is None:
+            return False
+        head = self.engine.snake.body[0]
+        path = self.find_path(head, (food,), self.body_life(), danger, avoid=self.behind())
+        if path is None or not self.safe_after(path):
+            return False
+        self.set_path(path, food)
+        return True
+
+    def repair(self, index, danger):
+        """ Replace the stretch of the path around the blocked cell at index """
+        self.repairs += 1
+        path = list(self.path)
+        head = self.engine.snake.body[0]
+        before = path[index - 1] if index > 0 else head
+        after = [cell for cell in path[index + 1:] if not self.blocked(cell)]
+        if not after:
+            return False
+        life = self.body_life()
+        if index == 0:
+            detour = self.find_path(before, after, life, danger, avoid=self.behind())
+        else:
+            detour = self.find_path(before, after, life, (), start_time=index)
+        if detour is None:
+            return False
+        rejoin = path.index(detour[-1])
+        new_path = path[:index] + detour + path[rejoin + 1:]
+        if len(set(new_path)) != len(new_path):
+            return False
+        # A shorter detour gets to the rest of the path earlier, the tail must still be gone by then
+        if any(life.get(cell, 0) > time + 1 for time, cell in enumerate(new_path)) or not self.safe_after(new_path):
+            return False
+        self.set_path(new_path, self.target)
+        return True
+
+    def fallback(self, danger):
+        """ Direction to take when there is no safe path to the food """
+        engine = self.engine
+        body = engine.snake.body
+        head_x, head_y = body[0]
+        behind = self.behind()
+        life = self.body_life()
+
+        def safe(cell):
+            return (engine.free_cells.inside(cell) and cell != behind and cell not in danger and
+                    not self.blocked(cell) and life.get(cell, 0) <= 1)
+
+        # Keep the tail in reach, then follow the cycle if it allows, else go where there is most room
+        cycle = self.cycle(head_x, head_y) if self.cycle is not None else None
+        best = None
+        tail = body[-1]
+        occupied = {cell for cell, moves in life.items() if moves > 1}
+        for direction in DIRECTIONS:
+            dx, dy = direction.value
+            cell = (head_x + dx, head_y + dy)
+            if not safe(cell):
+                continue
+            reached, size = self.room(cell, occupied, tail, len(body))
+            score = (reached, direction == cycle, size)
+            if best is None or score > best[0]:
+                best = (score, direction)
+        return best[1] if best else None
+
+    def next_direction(self):
+        """ Direction for the next step, None when every move is fatal """
+        engine = self.engine
+        if engine.game_over:
+            return None
+        if engine.free_cells is not self.free_cells:
+            # New session or restored snapshot, nothing planned is valid
+            self.free_cells = engine.free_cells
+            self.clear_path()
+        head = engine.snake.body[0]
+
+        # Drop the part of the path that has been walked
+        while self.path and self.path[0] == head:
+            self.path_cells.discard(self.path.popleft())
+        if self.path:
+            next_x, next_y = self.path[0]
+            if abs(next_x - head[0]) + abs(next_y - head[1]) != 1 or self.target != engine.food.position:
+                self.clear_path()
+
+        danger = self.danger()
+        if self.path:
+            # Only obstacles and Goombas can have blocked the path, there are few of them
+            blocked = [entity.position for entity in engine.obstacles + engine.goombas
+                       if entity.position in self.path_cells]
+            if self.path[0] in danger:
+                blocked.append(self.path[0])
+            if blocked:
+                index = min(self.path.index(cell) for cell in blocked)
+                if not self.repair(index, danger):
+                    self.clear_path()
+
+        if not self.path and not self.plan(danger):
+            return self.fallback(danger)
+        next_x, next_y = self.path[0]
+        return Direction((next_x - head[0], next_y - head[1]))
+
+_autopilots = weakref.WeakKeyDictionary()
+
+def autopilot_policy(engine):
+    """ Policy function for snake_rollout, with one Autopilot per engine """
+    autopilot = _autopilots.get(engine)
+    if autopilot is None:
+        autopilot = _autopilots[engine] = Autopilot(engine)
+    return autopilot.next_direction()
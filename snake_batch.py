@@ -0,0 +1,401 @@
+"""
+Vectorized batch of Snake games stepped in lockstep with NumPy
+"""
+
+import numpy as np
+from snake_engine import (
+    GRID_WIDTH, GRID_HEIGHT, MARIO, ZELDA, STITCH, HELLO_KITTY, RETRO,
+    OBSTACLE_THEMES, RUPEE_COLORS
+)
+
+# Actions are direction indices in this order, -1 keeps the current direction
+UP, DOWN, LEFT, RIGHT = 0, 1, 2, 3
+DIRECTION_DX = np.array([0, 0, -1, 1], dtype=np.int32)
+DIRECTION_DY = np.array([-1, 1, 0, 0], dtype=np.int32)
+OPPOSITE = np.array([DOWN, UP, RIGHT, LEFT], dtype=np.int8)
+
+# Food types and their points, same as Food in snake_engine
+FOOD_TYPES = ("coin", "mushroom", "bow", "hellokitty")
+FOOD_POINTS = np.array([1, 2, 1, 1], dtype=np.int32)
+
+# Obstacle types per theme with their move delay, rupees get a random color
+OBSTACLE_TYPES = {STITCH: ("palm", 3), HELLO_KITTY: ("kuromi", 2), ZELDA: ("rupee", 4)}
+
+OBSTACLE_SPAWN_RATE = 50
+GOOMBA_MOVE_SPEED = 15
+GOOMBA_ANIMATION_SPEED = 10
+
+class BatchSnakeEnv:
+    """ N independent games of one theme, stored as arrays and stepped together
+
+    Cells are flat indices (y * width + x). Each snake body is a ring buffer
+    in `body`, with the head at `head_ptr` and `length` segments behind it.
+    `covered` counts everything on a cell (snake, food, obstacles, Goombas)
+    and is what spawning looks at, like FreeCells in the engine.
+    """
+    def __init__(self, num_games, theme_name=RETRO, width=GRID_WIDTH, height=GRID_HEIGHT,
+                 max_goombas=64, autoreset=True, seed=None):
+        self.num_games = num_games
+        self.theme_name = theme_name
+        self.width = width
+        self.height = height
+        self.num_cells = width * height
+        self.autoreset = autoreset
+        self.rng = np.random.default_rng(seed)
+        self.rows = np.arange(num_games)
+
+        n, cells = num_games, self.num_cells
+        self.body = np.zeros((n, cells), dtype=np.int32)
+        self.head_ptr = np.zeros(n, dtype=np.int32)
+        self.length = np.zeros(n, dtype=np.int32)
+        self.direction = np.zeros(n, dtype=np.int8)
+        self.grow = np.zeros(n, dtype=bool)
+        self.snake_count = np.zeros((n, cells), dtype=np.uint8)
+        self.covered = np.zeros((n, cells), dtype=np.uint8)
+
+        self.food = np.zeros(n, dtype=np.int32)
+        self.food_type = np.zeros(n, dtype=np.int8)
+
+        # Obstacles, at most 6 alive plus one being spawned (-1 = empty slot)
+        slots = 7
+        self.obstacle_pos = np.full((n, slots), -1, dtype=np.int32)
+        self.obstacle_dir = np.zeros((n, slots), dtype=np.int8)
+        self.obstacle_counter = np.zeros((n, slots), dtype=np.int32)
+        self.obstacle_color = np.zeros((n, slots), dtype=np.int8)
+        self.obstacle_age = np.zeros((n, slots), dtype=np.int64)  # Spawn order, oldest is removed first
+        self.obstacle_spawn_counter = np.zeros(n, dtype=np.int32)
+        if theme_name in OBSTACLE_TYPES:
+            self.obstacle_type, self.obstacle_delay = OBSTACLE_TYPES[theme_name]
+        else:
+            self.obstacle_type, self.obstacle_delay = None, 0
+
+        # Goombas never despawn, so slot order is spawn order
+        self.goomba_pos = np.full((n, max_goombas), -1, dtype=np.int32)
+        self.goomba_dir = np.zeros((n, max_goombas), dtype=np.int8)
+        self.goomba_counter = np.zeros((n, max_goombas), dtype=np.int32)
+        self.goomba_anim_counter = np.zeros((n, max_goombas), dtype=np.int32)
+        self.goomba_anim_frame = np.zeros((n, max_goombas), dtype=np.int8)
+        self.goomba_can_move = np.zeros(n, dtype=bool)
+        self.goomba_count_grid = np.zeros((n, cells), dtype=np.uint8)
+        self.num_goombas = np.zeros(n, dtype=np.int32)
+
+        self.score = np.zeros(n, dtype=np.int32)
+        self.food_collected = np.zeros(n, dtype=np.int32)
+        self.ticks = np.zeros(n, dtype=np.int64)
+        self.done = np.zeros(n, dtype=bool)
+        self.won = np.zeros(n, dtype=bool)
+        self.spawn_sequence = 0
+
+        self.reset()
+
+    def reset(self, mask=None):
+        """ Reset the games selected by mask (all games when None) """
+        rows = self.rows if mask is None else self.rows[mask]
+        if len(rows) == 0:
+            return
+
+        self.snake_count[rows] = 0
+        self.covered[rows] = 0
+        self.goomba_count_grid[rows] = 0
+
+        start = (self.height // 2) * self.width + self.width // 2
+        self.body[rows, 0] = start
+        self.head_ptr[rows] = 0
+        self.length[rows] = 1
+        self.direction[rows] = RIGHT
+        self.grow[rows] = False
+        self.snake_count[rows, start] = 1
+        self.covered[rows, start] = 1
+
+        self.obstacle_pos[rows] = -1
+        self.obstacle_spawn_counter[rows] = 0
+        self.goomba_pos[rows] = -1
+        self.goomba_can_move[rows] = False
+        self.num_goombas[rows] = 0
+
+        self.score[rows] = 0
+        self.food_collected[rows] = 0
+        self.ticks[rows] = 0
+        self.done[rows] = False
+        self.won[rows] = False
+        self._spawn_food(rows)
+
+    def heads(self):
+        """ Flat cell index of every snake head """
+        return self.body[self.rows, self.head_ptr]
+
+    def step(self, actions):
+        """ Advance every running game one tick
+
+        actions holds one direction index per game (-1 keeps the direction).
+        Returns (rewards, dones): points gained this tick and which games
+        ended. With autoreset the ended games are restarted afterwards.
+        """
+        actions = np.asarray(actions, dtype=np.int8)
+        alive = ~self.done
+        rows = self.rows[alive]
+
+        # Change direction, a 180 degree turn is ignored like Snake.change_direction
+        turn = alive & (actions >= 0) & (actions != OPPOSITE[self.direction])
+        self.direction[turn] = actions[turn]
+
+        score_before = self.score.copy()
+        self.ticks[rows] += 1
+        self._move_snakes(rows)
+        self._move_obstacles(rows)
+        self._spawn_obstacles(rows)
+        dead = self._check_collisions(rows)
+        self.done[rows[dead]] = True
+        self._eat_food(rows[~dead])
+        if self.theme_name == MARIO:
+            self._update_goombas(rows[~dead])
+
+        rewards = self.score - score_before
+        dones = self.done.copy()
+        if self.autoreset:
+            self.reset(dones)
+        return rewards, dones
+
+    def _random_free_cells(self, rows):
+        """ Pick a random free cell for each game in rows, -1 when its board is full """
+        cells = self.rng.integers(0, self.num_cells, size=len(rows))
+        # A few cheap rounds of rejection sampling, then an exact pick for the rest
+        for _ in range(4):
+            taken = self.covered[rows, cells] != 0
+            if not taken.any():
+                return cells
+            cells[taken] = self.rng.integers(0, self.num_cells, size=int(taken.sum()))
+        taken = self.covered[rows, cells] != 0
+        if taken.any():
+            free = self.covered[rows[taken]] == 0
+            keys = self.rng.random(free.shape)
+            keys[~free] = -1.0
+            picks = keys.argmax(axis=1)
+            picks[~free.any(axis=1)] = -1
+            cells[taken] = picks
+        return cells
+
+    def _spawn_food(self, rows):
+        """ Spawn food with the theme's food types, marks full boards as won """
+        if len(rows) == 0:
+            return
+        rolls = self.rng.random(len(rows))
+        if self.theme_name == HELLO_KITTY:
+            self.food_type[rows] = np.where(rolls < 0.7, 2, 3)  # bow or hellokitty
+        elif self.theme_name == RETRO:
+            self.food_type[rows] = 0  # Only coins
+        else:
+            self.food_type[rows] = np.where(rolls < 0.7, 0, 1)  # coin or mushroom
+
+        cells = self._random_free_cells(rows)
+        full = cells < 0
+        self.won[rows[full]] = True
+        self.done[rows[full]] = True
+        self.food[rows] = cells
+        placed = rows[~full]
+        self.covered[placed, cells[~full]] += 1
+
+    def _move_snakes(self, rows):
+        """ Snake.move for every game in rows """
+        ptr = self.head_ptr[rows]
+        head = self.body[rows, ptr]
+        direction = self.direction[rows]
+        x = head % self.width + DIRECTION_DX[direction]
+        y = head // self.width + DIRECTION_DY[direction]
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        new_head = np.where(inside, y * self.width + x, -1)
+
+        # Drop the tail unless the snake is growing
+        grow = self.grow[rows]
+        shrink = rows[~grow]
+        tail_ptr = (ptr - self.length[rows] + 1) % self.num_cells
+        tail = self.body[rows, tail_ptr][~grow]
+        self.snake_count[shrink, tail] -= 1
+        self.covered[shrink, tail] -= 1
+        self.length[rows[grow]] += 1
+        self.grow[rows] = False
+
+        ptr = (ptr + 1) % self.num_cells
+        self.head_ptr[rows] = ptr
+        self.body[rows, ptr] = new_head
+        self.snake_count[rows[inside], new_head[inside]] += 1
+        self.covered[rows[inside], new_head[inside]] += 1
+
+    def _move_obstacles(self, rows):
+        """ Obstacle.move with wall bounce for every obstacle in rows """
+        if self.obstacle_type is None:
+            return
+        pos = self.obstacle_pos[rows]
+        counter = self.obstacle_counter[rows]
+        active = pos >= 0
+        counter[active] += 1
+        movers = active & (counter >= self.obstacle_delay)
+        counter[movers] = 0
+        self.obstacle_counter[rows] = counter
+        if not movers.any():
+            return
+
+        game, slot = np.nonzero(movers)
+        game_rows = rows[game]
+        old = pos[game, slot]
+        direction = self.obstacle_dir[game_rows, slot]
+        x = old % self.width
+        y = old // self.width
+        new_x = x + DIRECTION_DX[direction]
+        new_y = y + DIRECTION_DY[direction]
+
+        # Bounce off walls, LEFT <-> RIGHT and UP <-> DOWN
+        bounce_x = (new_x < 0) | (new_x >= self.width)
+        bounce_y = (new_y < 0) | (new_y >= self.height)
+        direction = np.where(bounce_x, np.where(direction == RIGHT, LEFT, RIGHT), direction)
+        direction = np.where(bounce_y, np.where(direction == DOWN, UP, DOWN), direction)
+        new_x = np.where(bounce_x, x, new_x)
+        new_y = np.where(bounce_y, y, new_y)
+        new = new_y * self.width + new_x
+
+        self.obstacle_dir[game_rows, slot] = direction
+        self.obstacle_pos[game_rows, slot] = new
+        # Several obstacles may share a cell, so use unbuffered updates
+        np.subtract.at(self.covered, (game_rows, old), 1)
+        np.add.at(self.covered, (game_rows, new), 1)
+
+    def _spawn_obstacles(self, rows):
+        """ Per-theme obstacle spawn rules from SnakeEngine """
+        if self.theme_name not in OBSTACLE_THEMES or len(rows) == 0:
+            return
+        self.obstacle_spawn_counter[rows] += 1
+        due = self.obstacle_spawn_counter[rows] >= OBSTACLE_SPAWN_RATE
+        if self.theme_name == HELLO_KITTY:
+            # Spawn Kuromi immediately if none exists
+            empty = (self.obstacle_pos[rows] < 0).all(axis=1)
+            due = due & ~empty
+            self._spawn_obstacle(rows[empty])
+        self._spawn_obstacle(rows[due])
+        self.obstacle_spawn_counter[rows[due]] = 0
+
+    def _spawn_obstacle(self, rows):
+        """ SnakeEngine.spawn_obstacle for every game in rows """
+        if len(rows) == 0:
+            return
+        cells = self._random_free_cells(rows)
+        placed = cells >= 0
+        rows, cells = rows[placed], cells[placed]
+        slot = (self.obstacle_pos[rows] >= 0).argmin(axis=1)
+        self.obstacle_pos[rows, slot] = cells
+        self.obstacle_dir[rows, slot] = self.rng.integers(0, 4, size=len(rows))
+        self.obstacle_counter[rows, slot] = 0
+        if self.theme_name == ZELDA:
+            self.obstacle_color[rows, slot] = self.rng.integers(0, len(RUPEE_COLORS), size=len(rows))
+        self.obstacle_age[rows, slot] = self.spawn_sequence
+        self.spawn_sequence += 1
+        self.covered[rows, cells] += 1
+
+        # Limit number of obstacles, the oldest one disappears
+        if self.theme_name == STITCH:
+            limit = np.full(len(rows), 5)
+        elif self.theme_name == HELLO_KITTY:
+            limit = np.minimum(5, 1 + self.food_collected[rows] // 5)
+        else:
+            limit = np.full(len(rows), 6)
+        active = self.obstacle_pos[rows] >= 0
+        over = active.sum(axis=1) > limit
+        if over.any():
+            over_rows = rows[over]
+            age = np.where(active[over], self.obstacle_age[over_rows], np.iinfo(np.int64).max)
+            oldest = age.argmin(axis=1)
+            self.covered[over_rows, self.obstacle_pos[over_rows, oldest]] -= 1
+            self.obstacle_pos[over_rows, oldest] = -1
+
+    def _check_collisions(self, rows):
+        """ Wall, self, obstacle and Goomba collisions, returns a mask over rows """
+        head = self.body[rows, self.head_ptr[rows]]
+        dead = head < 0
+        safe_head = np.where(dead, 0, head)
+        dead |= self.snake_count[rows, safe_head] > 1
+        dead |= (self.obstacle_pos[rows] == head[:, None]).any(axis=1)
+        if self.theme_name == MARIO:
+            dead |= self.goomba_count_grid[rows, safe_head] > 0
+        return dead
+
+    def _eat_food(self, rows):
+        """ Snake.eat_food plus scoring and Goomba spawns """
+        head = self.body[rows, self.head_ptr[rows]]
+        eaters = rows[head == self.food[rows]]
+        if len(eaters) == 0:
+            return
+        self.grow[eaters] = True
+        self.score[eaters] += FOOD_POINTS[self.food_type[eaters]]
+        self.food_collected[eaters] += 1
+
+        if self.theme_name == MARIO:
+            # First at 5 blocks, then every 3rd (at 8, 11, 14, 17, etc.)
+            collected = self.food_collected[eaters]
+            spawn = (collected == 5) | ((collected > 5) & ((collected - 5) % 3 == 0))
+            self._spawn_goomba(eaters[spawn])
+
+        self.covered[eaters, self.food[eaters]] -= 1
+        self._spawn_food(eaters)
+
+    def _spawn_goomba(self, rows):
+        """ SnakeEngine.spawn_goomba for every game in rows """
+        rows = rows[self.num_goombas[rows] < self.goomba_pos.shape[1]]
+        if len(rows) == 0:
+            return
+        cells = self._random_free_cells(rows)
+        placed = cells >= 0
+        rows, cells = rows[placed], cells[placed]
+        slot = self.num_goombas[rows]
+        self.goomba_pos[rows, slot] = cells
+        self.goomba_dir[rows, slot] = self.rng.integers(0, 4, size=len(rows))
+        self.goomba_counter[rows, slot] = 0
+        self.goomba_anim_counter[rows, slot] = 0
+        self.goomba_anim_frame[rows, slot] = 0
+        self.num_goombas[rows] += 1
+        self.goomba_count_grid[rows, cells] += 1
+        self.covered[rows, cells] += 1
+        # Goombas start moving after 15 collected food items
+        self.goomba_can_move[rows[self.food_collected[rows] >= 15]] = True
+
+    def _update_goombas(self, rows):
+        """ Goomba.update_animation and Goomba.move, one Goomba slot at a time """
+        if len(rows) == 0:
+            return
+        active = self.goomba_pos[rows] >= 0
+        anim = self.goomba_anim_counter[rows] + active
+        flip = anim >= GOOMBA_ANIMATION_SPEED
+        anim[flip] = 0
+        self.goomba_anim_counter[rows] = anim
+        self.goomba_anim_frame[rows] ^= flip.astype(np.int8)
+
+        rows = rows[self.goomba_can_move[rows]]
+        if len(rows) == 0:
+            return
+        # Goombas move in list order and see each other's new positions
+        for slot in range(int(self.num_goombas[rows].max())):
+            movers = rows[self.goomba_pos[rows, slot] >= 0]
+            self.goomba_counter[movers, slot] += 1
+            movers = movers[self.goomba_counter[movers, slot] >= GOOMBA_MOVE_SPEED]
+            if len(movers) == 0:
+                continue
+            self.goomba_counter[movers, slot] = 0
+
+            old = self.goomba_pos[movers, slot]
+            direction = self.goomba_dir[movers, slot]
+            x = old % self.width + DIRECTION_DX[direction]
+            y = old // self.width + DIRECTION_DY[direction]
+            inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+            new = np.where(inside, y * self.width + x, 0)
+            valid = (inside &
+                     (self.snake_count[movers, new] == 0) &
+                     (self.food[movers] != new) &
+                     (self.goomba_count_grid[movers, new] == 0))
+
+            stepping, blocked = movers[valid], movers[~valid]
+            old, new = old[valid], new[valid]
+            self.goomba_pos[stepping, slot] = new
+            self.goomba_count_grid[stepping, old] -= 1
+            self.goomba_count_grid[stepping, new] += 1
+            self.covered[stepping, old] -= 1
+            self.covered[stepping, new] += 1
+            # Change direction if we collide
+            self.goomba_dir[blocked, slot] = self.rng.integers(0, 4, size=len(blocked))
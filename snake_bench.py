@@ -0,0 +1,253 @@
+"""
+Benchmarks for the engine and the renderer, with baselines to catch slowdowns
+
+Micro benchmarks time single engine operations and report operations per
+second. Macro benchmarks time Game.update() and full draw_game() frames
+per theme on an offscreen window and also report p50/p95/p99 times.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from collections import Counter, deque
+from snake_autopilot import hamiltonian_direction
+from snake_engine import MARIO, THEME_NAMES, SNAKE_CELL, FOOD_CELL, Snake, SnakeEngine
+
+SNAKE_LENGTHS = (10, 100, 1000, 10000)
+FILL_RATIOS = (0.5, 0.9, 0.99, 0.999)
+FRAME_LENGTH = 200  # Snake length for the macro benchmarks
+MAX_GOOMBAS = 20
+
+def time_ops(run, number, repeat, setup=None):
+    """ Best operations per second of repeat runs of run(number)
+
+    setup() is called untimed before every run, and run() can return the
+    seconds it spent on anything else than the operations, which are left
+    out too.
+    """
+    best = None
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        excluded = run(number) or 0.0
+        elapsed = time.perf_counter() - start - excluded
+        best = elapsed if best is None else min(best, elapsed)
+    return number / best
+
+def time_calls(call, number, setup=None):
+    """ ops/sec and p50/p95/p99 in microseconds of number timed calls """
+    samples = []
+    for i in range(number):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    def percentile(q):
+        return round(samples[min(len(samples) - 1, len(samples) * q // 100)] * 1e6, 2)
+    return {"ops_per_sec": round(number / sum(samples), 1),
+            "p50_us": percentile(50), "p95_us": percentile(95), "p99_us": percentile(99)}
+
+def cycle_cells(width, height, count):
+    """ The first count cells of the board's Hamiltonian cycle, starting in the top left corner """
+    direction = hamiltonian_direction(width, height)
+    cells = [(0, 0)]
+    while len(cells) < count:
+        x, y = cells[-1]
+        dx, dy = direction(x, y).value
+        cells.append((x + dx, y + dy))
+    return cells
+
+def lay_snake(engine, length):
+    """ Put a snake of the given length along the cycle, so following it never kills it """
+    free_cells = engine.free_cells
+    snake = engine.snake
+    for pos in snake.body:
+        free_cells.release(pos, SNAKE_CELL)
+    free_cells.release(engine.food.position, FOOD_CELL)
+    snake.body = deque(reversed(cycle_cells(engine.width, engine.height, length)))
+    snake.occupied = Counter(snake.body)
+    for pos in snake.body:
+        free_cells.occupy(pos, SNAKE_CELL)
+    engine.spawn_food()
+
+def bench_snake_move(length, number, repeat):
+    """ Snake.move() plus check_collision() with a snake of the given length """
+    side = 2 * int((length * 2) ** 0.5 / 2 + 1)  # Even side with room to spare
+    snake = Snake(side, side)
+    snake.body = deque(reversed(cycle_cells(side, side, length)))
+    snake.occupied = Counter(snake.body)
+    direction = hamiltonian_direction(side, side)
+
+    def run(number):
+        for i in range(number):
+            snake.direction = direction(*snake.body[0])
+            snake.move()
+            if snake.check_collision():
+                raise RuntimeError("benchmark snake collided")
+    return {"ops_per_sec": round(time_ops(run, number, repeat), 1)}
+
+def bench_food_spawn(fill, number, repeat):
+    """ SnakeEngine.spawn_food() on a board where only a fraction of the cells are free """
+    engine = SnakeEngine(THEME_NAMES[0], 1)
+    free_cells = engine.free_cells
+    free_cells.release(engine.food.position, FOOD_CELL)
+    size = free_cells.width * free_cells.height
+    while free_cells.count > max(1, round(size * (1 - fill))):
+        free_cells.occupy(free_cells.random_position(engine.rng), SNAKE_CELL)
+
+    def run(number):
+        for i in range(number):
+            engine.spawn_food()
+            free_cells.release(engine.food.position, FOOD_CELL)
+    return {"ops_per_sec": round(time_ops(run, number, repeat), 1), "free_cells": free_cells.count}
+
+def bench_engine_step(theme_name, number, repeat):
+    """ SnakeEngine.step() with a long snake and every obstacle or Goomba the theme allows """
+    engine = SnakeEngine(theme_name, 1)
+    direction = hamiltonian_direction(engine.width, engine.height)
+
+    def run(number):
+        excluded = 0.0
+        for i in range(number):
+            if engine.game_over:
+                start = time.perf_counter()
+                populate(engine)
+                excluded += time.perf_counter() - start
+            engine.snake.direction = direction(*engine.snake.body[0])
+            engine.step()
+        return excluded
+    return {"ops_per_sec": round(time_ops(run, number, repeat, lambda: populate(engine)), 1)}
+
+def populate(engine):
+    """ Reset to a long snake with the most obstacles or Goombas the theme allows """
+    engine.reset()
+    lay_snake(engine, FRAME_LENGTH)
+    engine.food_collected = 20  # Unlocks the most Kuromis and moving Goombas
+    for i in range(10):
+        engine.spawn_obstacle()
+    if engine.theme_name == MARIO:
+        while len(engine.goombas) < MAX_GOOMBAS:
+            engine.spawn_goomba()
+
+def game_benchmarks(themes, number):
+    """ Game.update() and draw_game() per theme on an offscreen window """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import snake_game
+
+    game = snake_game.Game(prefetch=False)
+    results = {}
+    for theme in game.themes:
+        if theme.name not in themes:
+            continue
+        game.current_theme = theme
+        theme.load_background(snake_game.WINDOW_WIDTH, snake_game.WINDOW_HEIGHT)
+        game.reset_game()
+        populate(game.engine)
+        game.game_state = "playing"
+        game.remember_positions()
+        direction = hamiltonian_direction(game.engine.width, game.engine.height)
+
+        def setup():
+            if game.engine.game_over or game.game_state != "playing":
+                populate(game.engine)
+                game.game_state = "playing"
+                game.remember_positions()
+            game.snake.direction = direction(*game.snake.body[0])
+
+        results[f"game_update[{theme.name}]"] = time_calls(game.update, number, setup)
+        game.draw_game()  # Builds the sprite atlas and background cache outside the timing
+        results[f"draw_game[{theme.name}]"] = time_calls(lambda: game.draw_game(0.5), number)
+    return results
+
+def run_benchmarks(quick=False, only=None):
+    """ Run every benchmark whose name contains only, returns {name: metrics} """
+    scale = 10 if quick else 1
+    benchmarks = []
+    for length in SNAKE_LENGTHS:
+        benchmarks.append((f"snake_move[{length}]", bench_snake_move, (length, 20000 // scale, 5)))
+    for fill in FILL_RATIOS:
+        benchmarks.append((f"food_spawn[{fill}]", bench_food_spawn, (fill, 20000 // scale, 5)))
+    for theme_name in THEME_NAMES:
+        benchmarks.append((f"engine_step[{theme_name}]", bench_engine_step, (theme_name, 5000 // scale, 3)))
+
+    results = {}
+    for name, bench, args in benchmarks:
+        if only is None or only in name:
+            results[name] = bench(*args)
+            print(f"{name:<40}{results[name]['ops_per_sec']:>14,.0f} ops/s", file=sys.stderr)
+    themes = [theme_name for theme_name in THEME_NAMES
+              if only is None or only in f"game_update[{theme_name}]" or only in f"draw_game[{theme_name}]"]
+    if themes:
+        for name, metrics in game_benchmarks(themes, 2000 // scale).items():
+            if only is None or only in name:
+                results[name] = metrics
+                print(f"{name:<40}{metrics['ops_per_sec']:>14,.0f} ops/s   p50 {metrics['p50_us']:8.1f} us"
+                      f"   p95 {metrics['p95_us']:8.1f} us   p99 {metrics['p99_us']:8.1f} us", file=sys.stderr)
+    return results
+
+def environment():
+    """ Where the numbers come from, stored with the results """
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "machine": platform.machine(), "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+def compare(results, baseline, threshold):
+    """ Regression report against a baseline, returns (lines, number of regressions)
+
+    A benchmark regresses when its ops/sec drop, or its p95 grows, by more
+    than threshold (a fraction).
+    """
+    lines = [f"{'benchmark':<40}{'baseline':>14}{'current':>14}{'change':>9}"]
+    regressions = 0
+    for name, metrics in results.items():
+        old = baseline.get(name)
+        if old is None:
+            lines.append(f"{name:<40}{'-':>14}{metrics['ops_per_sec']:>14,.0f}{'new':>9}")
+            continue
+        change = metrics["ops_per_sec"] / old["ops_per_sec"] - 1
+        verdict = ""
+        if change < -threshold:
+            verdict = "  REGRESSION"
+        elif "p95_us" in metrics and "p95_us" in old and metrics["p95_us"] > old["p95_us"] * (1 + threshold):
+            verdict = f"  REGRESSION (p95 {old['p95_us']:.1f} -> {metrics['p95_us']:.1f} us)"
+        elif change > threshold:
+            verdict = "  faster"
+        regressions += bool(verdict.startswith("  REGRESSION"))
+        lines.append(f"{name:<40}{old['ops_per_sec']:>14,.0f}{metrics['ops_per_sec']:>14,.0f}{change:>+9.1%}{verdict}")
+    return lines, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Snake engine and renderer")
+    parser.add_argument("--quick", action="store_true", help="a tenth of the iterations, for a fast check")
+    parser.add_argument("--only", metavar="TEXT", help="only run benchmarks whose name contains TEXT")
+    parser.add_argument("--output", metavar="FILE", help="write the results as JSON to FILE (use it as a baseline)")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with the results in FILE")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown that counts as a regression (default 0.1 = 10%%)")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.quick, args.only)
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        lines, regressions = compare(results, baseline, args.threshold)
+        print("\n".join(lines), file=sys.stderr)
+        if regressions:
+            print(f"{regressions} regression(s) over {args.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1025 @@
+"""
+Headless Snake engine: all game rules without any pygame dependency
+"""
+
+import argparse
+import copy
+import itertools
+import random
+from array import array
+from collections import Counter, deque
+from enum import Enum
+
+# Default board size in cells (matches the 800x600 window with a 50px header
+# and 20px cells), SnakeEngine takes any other size
+GRID_WIDTH = 40
+GRID_HEIGHT = 27
+# Biggest board side for --board, positions are sent over the network as i16
+MAX_BOARD_SIZE = 4096
+
+# Theme names used by the game rules
+MARIO = "Super Mario World"
+ZELDA = "Hyrule Kingdom"
+STITCH = "Ohana Island"
+HELLO_KITTY = "Kawaii Paradise"
+RETRO = "Retro Classic"
+
+# All themes, in the same order as the menu
+THEME_NAMES = (MARIO, ZELDA, STITCH, HELLO_KITTY, RETRO)
+
+# Themes that spawn moving obstacles
+OBSTACLE_THEMES = (STITCH, HELLO_KITTY, ZELDA)
+
+# How many turns can be queued ahead of the snake
+MAX_QUEUED_TURNS = 3
+
+# Rupee obstacle colors in Hyrule (green, blue, red, gold)
+RUPEE_COLORS = ((0, 255, 0), (0, 0, 255), (255, 0, 0), (255, 215, 0))
+
+# What can cover a cell, the tags of the occupancy grid in FreeCells
+SNAKE_CELL, FOOD_CELL, OBSTACLE_CELL, GOOMBA_CELL = range(4)
+CELL_KINDS = (SNAKE_CELL, FOOD_CELL, OBSTACLE_CELL, GOOMBA_CELL)
+
+# How far from the snake's head hunting enemies can find it on big boards, in steps;
+# boards of up to HUNT_CELLS cells are searched all the way
+HUNT_RADIUS = 64
+HUNT_CELLS = 8192
+
+# Obstacles that hunt the snake (palm trees stay where they wander)
+HUNTING_OBSTACLES = ("kuromi", "rupee")
+
+# Cells a new snake in a shared game looks ahead to pick its first direction
+SPAWN_LOOKAHEAD = 5
+
+def board_size(text):
+    """ Parse a WIDTHxHEIGHT board size for argparse """
+    try:
+        width, height = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    if not (2 <= width <= MAX_BOARD_SIZE and 2 <= height <= MAX_BOARD_SIZE):
+        raise argparse.ArgumentTypeError(f"board sides must be between 2 and {MAX_BOARD_SIZE} cells")
+    return width, height
+
+class TrackedRandom(random.Random):
+    """ random.Random that gets a new version number whenever its state changes
+
+    The numbers never repeat, so two equal versions mean equal states and a
+    checkpoint only has to copy the (large) state when it has been used.
+    Draws give the same numbers as random.Random.
+    """
+    versions = itertools.count(1)
+
+    def seed(self, *args, **kwargs):
+        super().seed(*args, **kwargs)
+        self.version = next(self.versions)
+
+    def setstate(self, state):
+        super().setstate(state)
+        self.version = next(self.versions)
+
+    def random(self):
+        self.version = next(self.versions)
+        return super().random()
+
+    def getrandbits(self, k):
+        self.version = next(self.versions)
+        return super().getrandbits(k)
+
+class FreeCells:
+    """ Occupancy grid of the board plus an index of the empty cells
+
+    `kinds[kind]` counts how many things of each kind (SNAKE_CELL, FOOD_CELL,
+    OBSTACLE_CELL, GOOMBA_CELL) cover every cell, so any collision query is
+    one lookup, and `covered` is the total over all kinds.
+
+    The first `count` entries of `cells` are the free cell indices, the rest
+    are covered, so spawning is a single random pick. `slot` maps a cell
+    index to its place in `cells`, so a cell is moved between the two halves
+    with one swap. Every cell touched is also added to `changed`, which
+    observers clear when they have caught up.
+
+    While `journal` is a list every change is logged there, so undo() can
+    take the grid, including the order of `cells`, back to an earlier point.
+    """
+    def __init__(self, width=GRID_WIDTH, height=GRID_HEIGHT):
+        self.width = width
+        self.height = height
+        size = width * height
+        self.cells = array('i', range(size))
+        self.slot = array('i', range(size))
+        self.covered = bytearray(size)  # How many things cover each cell
+        self.kinds = [bytearray(size) for kind in CELL_KINDS]
+        self.count = size
+        self.changed = set()
+        self.journal = None  # (kind, index, +1/-1, old slot or -1) while SnakeEngine has checkpoints
+
+    def _swap(self, index, slot):
+        """ Move cell index into the given slot """
+        other = self.cells[slot]
+        old_slot = self.slot[index]
+        self.cells[slot] = index
+        self.cells[old_slot] = other
+        self.slot[index] = slot
+        self.slot[other] = old_slot
+
+    def occupy(self, pos, kind):
+        """ Mark pos as covered by one more thing of the given kind """
+        x, y = pos
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.changed.add(pos)
+            index = y * self.width + x
+            self.kinds[kind][index] += 1
+            self.covered[index] += 1
+            old_slot = -1
+            if self.covered[index] == 1:
+                old_slot = self.slot[index]
+                self.count -= 1
+                self._swap(index, self.count)
+            if self.journal is not None:
+                self.journal.append((kind, index, 1, old_slot))
+
+    def release(self, pos, kind):
+        """ Mark pos as covered by one less thing of the given kind """
+        x, y = pos
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.changed.add(pos)
+            index = y * self.width + x
+            self.kinds[kind][index] -= 1
+            self.covered[index] -= 1
+            old_slot = -1
+            if self.covered[index] == 0:
+                old_slot = self.slot[index]
+                self._swap(index, self.count)
+                self.count += 1
+            if self.journal is not None:
+                self.journal.append((kind, index, -1, old_slot))
+
+    def move(self, old_pos, new_pos, kind):
+        """ Move one thing of the given kind between two cells """
+        self.release(old_pos, kind)
+        self.occupy(new_pos, kind)
+
+    def undo(self, mark):
+        """ Undo the changes logged after the journal had mark entries """
+        journal = self.journal
+        while len(journal) > mark:
+            kind, index, delta, old_slot = journal.pop()
+            if old_slot >= 0:
+                # Swaps are their own inverse, count moves back the other way
+                if delta > 0:
+                    self._swap(index, old_slot)
+                    self.count += 1
+                else:
+                    self.count -= 1
+                    self._swap(index, old_slot)
+            self.kinds[kind][index] -= delta
+            self.covered[index] -= delta
+        self.changed.clear()
+
+    def copy(self):
+        """ Independent copy of the index (without pending changes or journal) """
+        other = FreeCells.__new__(FreeCells)
+        other.width = self.width
+        other.height = self.height
+        other.cells = array('i', self.cells)
+        other.slot = array('i', self.slot)
+        other.covered = bytearray(self.covered)
+        other.kinds = [bytearray(counts) for counts in self.kinds]
+        other.count = self.count
+        other.changed = set()
+        other.journal = None
+        return other
+
+    def inside(self, pos):
+        """ Check if pos is on the board """
+        x, y = pos
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def is_free(self, pos):
+        """ Check if nothing covers pos """
+        x, y = pos
+        return self.covered[y * self.width + x] == 0
+
+    def has(self, pos, kind):
+        """ Check if something of the given kind is on pos (False outside the board) """
+        x, y = pos
+        return 0 <= x < self.width and 0 <= y < self.height and self.kinds[kind][y * self.width + x] > 0
+
+    def random_position(self, rng=random):
+        """ Pick a random free cell, or None when the board is full """
+        if self.count == 0:
+            return None
+        index = self.cells[rng.randrange(self.count)]
+        return (index % self.width, index // self.width)
+
+class DistanceField:
+    """ Steps from every cell to the snake's head, shared by all hunting enemies
+
+    One BFS from the head over the occupancy grid, going around the snake's
+    body, replaces a path search per enemy. It is only computed the first
+    time an enemy asks after retarget(), so ticks where nobody moves cost
+    nothing. On boards of up to HUNT_CELLS cells the search goes on until
+    every reachable cell is found (or the byte sized distances run out),
+    so detours around the body count too. Bigger boards stop at
+    HUNT_RADIUS steps, which keeps them from costing O(cells) per tick;
+    enemies further away keep wandering.
+    """
+    UNREACHED = 255
+
+    def __init__(self, free_cells, target, radius=None):
+        if radius is None:
+            radius = self.UNREACHED - 1 if free_cells.width * free_cells.height <= HUNT_CELLS else HUNT_RADIUS
+        self.radius = min(radius, self.UNREACHED - 1)
+        self.retarget(free_cells, target)
+
+    def retarget(self, free_cells, target):
+        """ Aim at a new head position, the distances are computed when first needed """
+        self.free_cells = free_cells
+        self.target = target
+        self.distances = None
+
+    def compute(self):
+        free_cells = self.free_cells
+        width = free_cells.width
+        size = width * free_cells.height
+        distances = bytearray(b"\xff") * size
+        self.distances = distances
+        if not free_cells.inside(self.target):
+            return
+        snake = free_cells.kinds[SNAKE_CELL]
+        x, y = self.target
+        frontier = [y * width + x]
+        distances[frontier[0]] = 0
+        for distance in range(1, self.radius + 1):
+            reached = []
+            for index in frontier:
+                x = index % width
+                for neighbour, inside in ((index - 1, x > 0), (index + 1, x < width - 1),
+                                          (index - width, index >= width), (index + width, index < size - width)):
+                    if inside and distances[neighbour] == self.UNREACHED and not snake[neighbour]:
+                        distances[neighbour] = distance
+                        reached.append(neighbour)
+            if not reached:
+                break
+            frontier = reached
+
+    def distance(self, pos):
+        """ Steps from pos to the head, UNREACHED if it is too far or walled in """
+        if not self.free_cells.inside(pos):
+            return self.UNREACHED
+        if self.distances is None:
+            self.compute()
+        x, y = pos
+        return self.distances[y * self.free_cells.width + x]
+
+    def step_towards(self, pos, allowed):
+        """ Direction that gets closer to the head through a cell where allowed(cell) holds, or None """
+        best = self.distance(pos)
+        best_direction = None
+        x, y = pos
+        for direction in (Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT):
+            dx, dy = direction.value
+            new_pos = (x + dx, y + dy)
+            distance = self.distance(new_pos)
+            if distance < best and allowed(new_pos):
+                best = distance
+                best_direction = direction
+        return best_direction
+
+class Direction(Enum):
+    UP = (0, -1)
+    DOWN = (0, 1)
+    LEFT = (-1, 0)
+    RIGHT = (1, 0)
+
+class Snake:
+    """ Snake-klassen for handeling the snakes logic """
+    def __init__(self, width=GRID_WIDTH, height=GRID_HEIGHT):
+        self.width = width
+        self.height = height
+        self.reset()
+
+    def reset(self):
+        """ Reset the snake to start position """
+        self.body = deque([(self.width // 2, self.height // 2)])
+        # How many segments cover each cell, so lookups don't scan the body
+        self.occupied = Counter(self.body)
+        self.direction = Direction.RIGHT
+        self.grow = False
+        # Turns waiting for coming moves, one is taken per move
+        self.turns = deque()
+        self.journal = None  # Tail left by every move while SnakeEngine has checkpoints
+
+    def move(self):
+        """ Move the snake, returns the tail cell it left (None when growing) """
+        if self.turns:
+            self.direction = self.turns.popleft()
+        head_x, head_y = self.body[0]
+        dx, dy = self.direction.value
+        new_head = (head_x + dx, head_y + dy)
+
+        self.body.appendleft(new_head)
+        self.occupied[new_head] += 1
+        tail = None
+        if not self.grow:
+            tail = self.body.pop()
+            count = self.occupied[tail] - 1
+            if count:
+                self.occupied[tail] = count
+            else:
+                del self.occupied[tail]
+        self.grow = False
+        if self.journal is not None:
+            self.journal.append(tail)
+        return tail
+
+    def undo(self, mark):
+        """ Take back the moves logged after the journal had mark entries """
+        journal = self.journal
+        while len(journal) > mark:
+            tail = journal.pop()
+            head = self.body.popleft()
+            count = self.occupied[head] - 1
+            if count:
+                self.occupied[head] = count
+            else:
+                del self.occupied[head]
+            if tail is not None:
+                self.body.append(tail)
+                self.occupied[tail] += 1
+
+    def occupies(self, pos):
+        """ Check if any part of the snake is on pos """
+        return pos in self.occupied
+
+    def change_direction(self, new_direction):
+        """ Change direction """
+        if (self.direction == Direction.UP and new_direction != Direction.DOWN) or \
+        (self.direction == Direction.DOWN and new_direction != Direction.UP) or \
+        (self.direction == Direction.LEFT and new_direction != Direction.RIGHT) or \
+        (self.direction == Direction.RIGHT and new_direction != Direction.LEFT):
+            self.direction = new_direction
+
+    def queue_direction(self, new_direction):
+        """ Queue a turn for the next free move, returns whether it was queued
+
+        The turn is checked against the last queued direction rather than the
+        current one, so two quick presses can't reverse the snake into itself.
+        Presses that don't change anything and presses beyond MAX_QUEUED_TURNS
+        are dropped.
+        """
+        last = self.turns[-1] if self.turns else self.direction
+        dx, dy = last.value
+        if new_direction == last or new_direction.value == (-dx, -dy) or len(self.turns) >= MAX_QUEUED_TURNS:
+            return False
+        self.turns.append(new_direction)
+        return True
+
+    def check_collision(self):
+        """ Check if the snake is colliding with itself or the wall """
+        head_x, head_y = self.body[0]
+
+        # Wall-collision
+        if head_x < 0 or head_x >= self.width or head_y < 0 or head_y >= self.height:
+            return True
+
+        # Self-collision (the head cell is covered twice)
+        if self.occupied[self.body[0]] > 1:
+            return True
+
+        return False
+
+    def eat_food(self, food_pos):
+        """ Check if the snake eats food """
+        if self.body[0] == food_pos:
+            self.grow = True
+            return True
+        return False
+
+class Food:
+    """Base class for food (coins, mushrooms, and special items)
+
+    With free_cells it is placed on a free cell of the engine's board
+    (position None when the board is full), else anywhere.
+    """
+    def __init__(self, food_type="coin", rng=random, width=GRID_WIDTH, height=GRID_HEIGHT, free_cells=None):
+        self.rng = rng
+        self.width = width
+        self.height = height
+        self.food_type = food_type  # "coin", "mushroom", "bow", "hellokitty"
+        self.type = food_type  # Alias for compatibility
+
+        # Set points based on food type
+        if food_type == "coin":
+            self.points = 1
+        elif food_type == "mushroom":
+            self.points = 2
+        elif food_type == "bow":
+            self.points = 1
+        elif food_type == "hellokitty":
+            self.points = 1
+        else:
+            self.points = 1  # Default
+
+        self.position = self.generate_position(free_cells)
+
+    def generate_position(self, free_cells=None):
+        """Generate a random position for food, None if the board is full"""
+        if free_cells is None:
+            pos = (self.rng.randint(0, self.width - 1), self.rng.randint(0, self.height - 1))
+        else:
+            pos = free_cells.random_position(self.rng)
+        self.position = pos
+        return pos
+
+class Goomba:
+    """Goomba class for Mario theme obstacles, placed like Food without a position"""
+    def __init__(self, position=None, can_move=False, rng=random, width=GRID_WIDTH, height=GRID_HEIGHT,
+                 free_cells=None):
+        self.rng = rng
+        self.width = width
+        self.height = height
+        if position is None:
+            self.position = self.generate_position(free_cells)
+        else:
+            self.position = position
+        self.animation_frame = 0
+        self.animation_speed = 10
+        self.animation_counter = 0
+        self.can_move = can_move
+        self.move_counter = 0
+        self.move_speed = 15  # How many frames between each movement
+        self.direction = self.rng.choice([Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT])
+
+    def generate_position(self, free_cells=None):
+        """Generate a random position for Goomba, None if the board is full"""
+        if free_cells is None:
+            pos = (self.rng.randint(0, self.width - 1), self.rng.randint(0, self.height - 1))
+        else:
+            pos = free_cells.random_position(self.rng)
+        self.position = pos
+        return pos
+
+    def update_animation(self):
+        """Update animation for Goomba"""
+        self.animation_counter += 1
+        if self.animation_counter >= self.animation_speed:
+            self.animation_counter = 0
+            self.animation_frame = (self.animation_frame + 1) % 2
+
+    def move(self, free_cells, field=None):
+        """Move Goomba if it can move, free_cells is the engine's occupancy grid
+
+        With a DistanceField the Goomba hunts the snake's head, and only walks
+        straight on when it can't get any closer.
+        """
+        if not self.can_move:
+            return
+
+        self.move_counter += 1
+        if self.move_counter >= self.move_speed:
+            self.move_counter = 0
+
+            def valid(pos):
+                return (free_cells.inside(pos) and
+                        not free_cells.has(pos, SNAKE_CELL) and
+                        not free_cells.has(pos, FOOD_CELL) and
+                        not free_cells.has(pos, GOOMBA_CELL))
+
+            if field is not None:
+                direction = field.step_towards(self.position, valid)
+                if direction is not None:
+                    self.direction = direction
+
+            # Try to move in current direction
+            x, y = self.position
+            dx, dy = self.direction.value
+            new_pos = (x + dx, y + dy)
+
+            # Check if new position is valid
+            if valid(new_pos):
+                self.position = new_pos
+            else:
+                # Change direction if we collide
+                self.direction = self.rng.choice([Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT])
+
+class Obstacle:
+    """ Obstacle class for moving obstacles in themed worlds, placed like Food """
+    def __init__(self, obstacle_type, color, rng=random, width=GRID_WIDTH, height=GRID_HEIGHT, free_cells=None):
+        self.rng = rng
+        self.width = width
+        self.height = height
+        self.type = obstacle_type  # "palm", "surfboard", "kuromi", or "rupee"
+        self.color = color
+        self.position = self.generate_position(free_cells)
+        self.direction = self.rng.choice([Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT])
+        self.move_counter = 0
+        # Kuromi moves faster than palm trees, rupees move at medium speed
+        if obstacle_type == "kuromi":
+            self.move_delay = 2
+        elif obstacle_type == "rupee":
+            self.move_delay = 4
+        else:
+            self.move_delay = 3
+
+    def generate_position(self, free_cells=None):
+        """ Generate random position for obstacle, None if the board is full """
+        if free_cells is None:
+            return (self.rng.randint(0, self.width - 1), self.rng.randint(0, self.height - 1))
+        return free_cells.random_position(self.rng)
+
+    def move(self, field=None):
+        """ Move the obstacle, towards the snake's head if given a DistanceField """
+        self.move_counter += 1
+        if self.move_counter >= self.move_delay:
+            self.move_counter = 0
+
+            if field is not None:
+                direction = field.step_towards(self.position, lambda pos: True)
+                if direction is not None:
+                    self.direction = direction
+
+            x, y = self.position
+            dx, dy = self.direction.value
+            new_x = x + dx
+            new_y = y + dy
+
+            # Bounce off walls
+            if new_x < 0 or new_x >= self.width:
+                self.direction = Direction.LEFT if self.direction == Direction.RIGHT else Direction.RIGHT
+                new_x = x
+            if new_y < 0 or new_y >= self.height:
+                self.direction = Direction.UP if self.direction == Direction.DOWN else Direction.DOWN
+                new_y = y
+
+            self.position = (new_x, new_y)
+
+class SnakeEngine:
+    """ Game rules for one session, independent of rendering and frame rate
+
+    All randomness comes from self.rng, which is re-seeded with self.seed on
+    every reset, so a session is fully determined by its seed, theme and the
+    direction used on each tick.
+
+    The board can be any size: every rule works on the cells around the
+    snake's head and the spawn index in FreeCells, so a tick costs the same
+    on a 1000x1000 board as on the default one. Only reset() and snapshots
+    touch every cell.
+
+    With hunting, Goombas, Kuromis and rupees move towards the snake's
+    head instead of walking straight, all steered by one shared
+    DistanceField per tick.
+
+    legacy_spawns replays sessions recorded before replay version 4, when
+    every spawn first drew a random cell, threw it away and then picked a
+    free one; the extra RNG draws are needed to play them back identically.
+    """
+    def __init__(self, theme_name=None, seed=None, width=GRID_WIDTH, height=GRID_HEIGHT, hunting=False,
+                 legacy_spawns=False):
+        self.theme_name = theme_name
+        self.width = width
+        self.height = height
+        self.hunting = hunting
+        self.legacy_spawns = legacy_spawns
+        self.rng = TrackedRandom(seed)
+        self.rng_state = (None, None)  # (version, state) of the last checkpoint
+        self.snake = Snake(width, height)
+        self.obstacle_spawn_rate = 50  # Spawn obstacle every 50 ticks (approx 5 seconds at 10 FPS)
+        self.reset(theme_name, seed)
+
+    def reset(self, theme_name=None, seed=None):
+        """ Start a new session, optionally switching theme
+
+        Without a seed the next one is drawn from the current RNG, so an
+        engine created with a seed gives the same sequence of sessions.
+        """
+        if theme_name is not None:
+            self.theme_name = theme_name
+        if seed is None:
+            seed = self.rng.getrandbits(64)
+        self.seed = seed
+        self.rng.seed(seed)
+        self.snake.reset()
+        self.free_cells = FreeCells(self.width, self.height)
+        for pos in self.snake.body:
+            self.free_cells.occupy(pos, SNAKE_CELL)
+        self.field = DistanceField(self.free_cells, self.snake.body[0])
+        self.obstacles = []
+        self.obstacle_spawn_counter = 0
+        self.game_over = False
+        self.won = False  # Set when the snake fills the board
+        self.death_cause = None  # "wall", "self", "obstacle", "goomba" or "full"
+        self.spawn_food()
+        self.score = 0
+        self.food_collected = 0
+        self.goombas = []
+        self.ticks = 0
+
+    def create(self, cls, *args, **kwargs):
+        """ New Food, Obstacle or Goomba on a free cell, its position is None when the board is full """
+        if not self.legacy_spawns:
+            return cls(*args, rng=self.rng, width=self.width, height=self.height, free_cells=self.free_cells, **kwargs)
+        entity = cls(*args, rng=self.rng, width=self.width, height=self.height, **kwargs)
+        entity.position = entity.generate_position(self.free_cells)
+        return entity
+
+    def spawn_food(self):
+        """ Spawn food based on current theme """
+        if self.theme_name == HELLO_KITTY:
+            # 70% chance for bow, 30% chance for Hello Kitty
+            food_type = "bow" if self.rng.random() < 0.7 else "hellokitty"
+        elif self.theme_name == RETRO:
+            # Only coins for Retro Classic Snake (no mushrooms)
+            food_type = "coin"
+        else:
+            # Coin/mushroom system for other themes (70% coin=1pt, 30% mushroom=2pt)
+            food_type = "coin" if self.rng.random() < 0.7 else "mushroom"
+        self.food = self.create(Food, food_type)
+
+        if self.food.position is None:
+            # No free cell left for food, the board is full
+            self.won = True
+            self.game_over = True
+            self.death_cause = "full"
+        else:
+            self.free_cells.occupy(self.food.position, FOOD_CELL)
+
+    def spawn_obstacle(self):
+        """ Spawn a random obstacle for themed worlds """
+        if self.theme_name == STITCH:
+            obstacle = self.create(Obstacle, "palm", (255, 140, 0))  # Only palm trees
+            max_obstacles = 5
+        elif self.theme_name == HELLO_KITTY:
+            obstacle = self.create(Obstacle, "kuromi", (255, 105, 180))  # Only Kuromi
+            # Start with 1, then add 1 more every 5 food items collected (max 5 Kuromis)
+            max_obstacles = min(5, 1 + (self.food_collected // 5))
+        elif self.theme_name == ZELDA:
+            # Spawn rupees with different colors
+            obstacle = self.create(Obstacle, "rupee", self.rng.choice(RUPEE_COLORS))
+            max_obstacles = 6
+        else:
+            return
+
+        # Only spawned on a free cell (not on snake, food or other obstacles)
+        if obstacle.position is not None:
+            self.obstacles.append(obstacle)
+            self.free_cells.occupy(obstacle.position, OBSTACLE_CELL)
+
+        # Limit number of obstacles
+        if len(self.obstacles) > max_obstacles:
+            self.free_cells.release(self.obstacles.pop(0).position, OBSTACLE_CELL)
+
+    def spawn_goomba(self):
+        """ Spawn a new Goomba on a safe position """
+        # Goombas start moving after 15 collected food items
+        can_move = self.food_collected >= 15
+
+        new_goomba = self.create(Goomba, can_move=can_move)
+        if new_goomba.position is None:
+            return
+        self.goombas.append(new_goomba)
+        self.free_cells.occupy(new_goomba.position, GOOMBA_CELL)
+
+        # Activate movement for all Goombas once the threshold is reached
+        if can_move:
+            for goomba in self.goombas:
+                goomba.can_move = True
+
+    def check_obstacle_collision(self):
+        """ Check if snake collides with any obstacle """
+        return self.free_cells.has(self.snake.body[0], OBSTACLE_CELL)
+
+    def check_goomba_collision(self):
+        """ Check if snake collides with any Goomba """
+        return self.free_cells.has(self.snake.body[0], GOOMBA_CELL)
+
+    def update_goombas(self):
+        """ Animate and move all Goombas one frame """
+        if self.theme_name != MARIO:
+            return
+        for goomba in self.goombas:
+            goomba.update_animation()
+            old_position = goomba.position
+            goomba.move(self.free_cells, self.field if self.hunting else None)
+            if goomba.position != old_position:
+                self.free_cells.move(old_position, goomba.position, GOOMBA_CELL)
+
+    def snapshot(self):
+        """ Copy of the complete game state, for restore() """
+        return {
+            "theme_name": self.theme_name,
+            "seed": self.seed,
+            "rng": self.rng.getstate(),
+            "body": tuple(self.snake.body),
+            "direction": self.snake.direction,
+            "grow": self.snake.grow,
+            "turns": tuple(self.snake.turns),
+            "food": copy.copy(self.food),
+            "obstacles": [copy.copy(obstacle) for obstacle in self.obstacles],
+            "goombas": [copy.copy(goomba) for goomba in self.goombas],
+            "free_cells": self.free_cells.copy(),
+            "obstacle_spawn_counter": self.obstacle_spawn_counter,
+            "score": self.score,
+            "food_collected": self.food_collected,
+            "ticks": self.ticks,
+            "game_over": self.game_over,
+            "won": self.won,
+            "death_cause": self.death_cause
+        }
+
+    def restore(self, state):
+        """ Return to a state from snapshot(), the snapshot can be reused """
+        self.theme_name = state["theme_name"]
+        self.seed = state["seed"]
+        self.rng.setstate(state["rng"])
+        self.snake.body = deque(state["body"])
+        self.snake.occupied = Counter(state["body"])
+        self.snake.direction = state["direction"]
+        self.snake.grow = state["grow"]
+        self.snake.turns = deque(state["turns"])
+        self.food = copy.copy(state["food"])
+        self.obstacles = [copy.copy(obstacle) for obstacle in state["obstacles"]]
+        self.goombas = [copy.copy(goomba) for goomba in state["goombas"]]
+        self.free_cells = state["free_cells"].copy()
+        self.snake.journal = None
+        self.field.retarget(self.free_cells, self.snake.body[0])
+        self.obstacle_spawn_counter = state["obstacle_spawn_counter"]
+        self.score = state["score"]
+        self.food_collected = state["food_collected"]
+        self.ticks = state["ticks"]
+        self.game_over = state["game_over"]
+        self.won = state["won"]
+        self.death_cause = state["death_cause"]
+
+    def checkpoint(self):
+        """ Compact copy of the game state for rollback(), for lookahead search
+
+        Unlike snapshot() nothing board sized is copied: from the first
+        checkpoint on, the occupancy grid and the snake log every change,
+        and rollback() undoes them. The entities are kept as tuples of their
+        moving parts, and the RNG state is only copied when it was used
+        since the last checkpoint. Checkpoints work like a stack: rolling
+        back to one invalidates every checkpoint taken after it, while the
+        same one can be rolled back to any number of times. reset() and
+        restore() invalidate all of them, and clear_checkpoints() stops the
+        logging.
+        """
+        free_cells = self.free_cells
+        snake = self.snake
+        if free_cells.journal is None:
+            free_cells.journal = []
+            snake.journal = []
+        if self.rng_state[0] != self.rng.version:
+            self.rng_state = (self.rng.version, self.rng.getstate())
+        return (
+            free_cells, len(free_cells.journal), len(snake.journal), self.rng_state,
+            snake.direction, snake.grow, tuple(snake.turns), self.food, self.food.position,
+            tuple((obstacle, obstacle.position, obstacle.direction, obstacle.move_counter)
+                  for obstacle in self.obstacles),
+            tuple((goomba, goomba.position, goomba.direction, goomba.move_counter, goomba.animation_frame,
+                   goomba.animation_counter, goomba.can_move) for goomba in self.goombas),
+            self.obstacle_spawn_counter, self.score, self.food_collected, self.ticks,
+            self.game_over, self.won, self.death_cause
+        )
+
+    def rollback(self, checkpoint):
+        """ Return to the state of a checkpoint() """
+        (free_cells, cells_mark, snake_mark, rng_state, direction, grow, turns, food, food_position,
+         obstacles, goombas, obstacle_spawn_counter, score, food_collected, ticks,
+         game_over, won, death_cause) = checkpoint
+        if free_cells is not self.free_cells or free_cells.journal is None:
+            raise ValueError("Checkpoint is from before the last reset, restore or clear_checkpoints")
+        free_cells.undo(cells_mark)
+        snake = self.snake
+        snake.undo(snake_mark)
+        snake.direction = direction
+        snake.grow = grow
+        snake.turns = deque(turns)
+
+        version, state = rng_state
+        if self.rng.version != version:
+            self.rng.setstate(state)
+            self.rng.version = version
+        self.rng_state = rng_state
+
+        self.food = food
+        food.position = food_position
+        self.obstacles = []
+        for obstacle, position, obstacle_direction, move_counter in obstacles:
+            obstacle.position = position
+            obstacle.direction = obstacle_direction
+            obstacle.move_counter = move_counter
+            self.obstacles.append(obstacle)
+        self.goombas = []
+        for goomba, position, goomba_direction, move_counter, frame, animation_counter, can_move in goombas:
+            goomba.position = position
+            goomba.direction = goomba_direction
+            goomba.move_counter = move_counter
+            goomba.animation_frame = frame
+            goomba.animation_counter = animation_counter
+            goomba.can_move = can_move
+            self.goombas.append(goomba)
+
+        self.obstacle_spawn_counter = obstacle_spawn_counter
+        self.score = score
+        self.food_collected = food_collected
+        self.ticks = ticks
+        self.game_over = game_over
+        self.won = won
+        self.death_cause = death_cause
+        self.field.retarget(free_cells, snake.body[0])
+
+    def clear_checkpoints(self):
+        """ Stop logging changes for rollback(), every checkpoint becomes invalid """
+        self.free_cells.journal = None
+        self.snake.journal = None
+
+    def rivals(self):
+        """ Snakes of other players to draw besides self.snake, none in a single player game """
+        return ()
+
+    @property
+    def changed_cells(self):
+        """ Cells whose contents changed during the last step """
+        return self.free_cells.changed
+
+    def step(self):
+        """ Advance the game one tick, returns False once the snake has died """
+        if self.game_over:
+            return False
+
+        self.ticks += 1
+        self.free_cells.changed.clear()
+        self._update()
+        self.update_goombas()
+        return not self.game_over
+
+    def _update(self):
+        """ Snake, obstacle, spawn and scoring rules for one tick """
+        tail = self.snake.move()
+        self.free_cells.occupy(self.snake.body[0], SNAKE_CELL)
+        if tail is not None:
+            self.free_cells.release(tail, SNAKE_CELL)
+        self.field.retarget(self.free_cells, self.snake.body[0])
+        self.move_obstacles()
+
+        # Checks collisions with walls and self
+        if self.snake.check_collision():
+            self.game_over = True
+            self.death_cause = "self" if self.free_cells.inside(self.snake.body[0]) else "wall"
+            return
+
+        # Check collisions with obstacles
+        if self.check_obstacle_collision():
+            self.game_over = True
+            self.death_cause = "obstacle"
+            return
+
+        # Check Goomba collisions (Mario theme)
+        if self.theme_name == MARIO and self.check_goomba_collision():
+            self.game_over = True
+            self.death_cause = "goomba"
+            return
+
+        # Check if the snake eats food
+        if self.snake.eat_food(self.food.position):
+            # Add points based on food type
+            self.score += self.food.points
+            self.collect_food()
+
+    def move_obstacles(self):
+        """ Move the obstacles one tick and spawn new ones in themed worlds """
+        for obstacle in self.obstacles:
+            old_position = obstacle.position
+            obstacle.move(self.field if self.hunting and obstacle.type in HUNTING_OBSTACLES else None)
+            if obstacle.position != old_position:
+                self.free_cells.move(old_position, obstacle.position, OBSTACLE_CELL)
+
+        if self.theme_name in OBSTACLE_THEMES:
+            self.obstacle_spawn_counter += 1
+            if self.theme_name == HELLO_KITTY and len(self.obstacles) == 0:
+                # Spawn Kuromi immediately if none exists
+                self.spawn_obstacle()
+            elif self.obstacle_spawn_counter >= self.obstacle_spawn_rate:
+                self.spawn_obstacle()
+                self.obstacle_spawn_counter = 0
+
+    def collect_food(self):
+        """ Count the food that was just eaten and replace it """
+        self.food_collected += 1
+
+        # Spawn Goomba (Mario theme only)
+        # First at 5 blocks, then every 3rd (at 8, 11, 14, 17, etc.)
+        if self.theme_name == MARIO:
+            if self.food_collected == 5 or (self.food_collected > 5 and (self.food_collected - 5) % 3 == 0):
+                self.spawn_goomba()
+
+        # Spawn new food (ends the game as a win if the board is full)
+        self.free_cells.release(self.food.position, FOOD_CELL)
+        self.spawn_food()
+
+class MultiSnakeEngine(SnakeEngine):
+    """ Shared board with one snake per player, for the rooms of snake_server
+
+    Food, obstacles, Goombas and spawning work as in SnakeEngine, all
+    snakes move on every tick and the first one whose head is on the food
+    eats it. A snake dies on walls, obstacles, Goombas and any snake
+    (its own body, another's body or another head) and is taken off the
+    board, its player can be added again later. Players join and leave
+    between ticks, and the session only ends when the board is full.
+
+    self.snake stays off the board. Hunting, snapshot() and checkpoint()
+    are single player only.
+    """
+    def reset(self, theme_name=None, seed=None):
+        """ Start a new session without any players """
+        super().reset(theme_name, seed)
+        for pos in self.snake.body:
+            self.free_cells.release(pos, SNAKE_CELL)
+        self.free_cells.changed.clear()
+        self.snakes = {}  # Player id -> Snake, in joining order
+        self.scores = {}  # Player id -> score, kept while a dead player waits to come back
+        self.deaths = {}  # Player id -> death cause, for the last step
+
+    def add_player(self, player_id):
+        """ Put a new snake for the player on a random free cell, None when the board is full
+
+        It starts off in the direction with the most free cells straight
+        ahead, so it doesn't spawn facing a wall or a snake.
+        """
+        free_cells = self.free_cells
+        pos = free_cells.random_position(self.rng)
+        if pos is None:
+            return None
+        snake = Snake(self.width, self.height)
+        snake.body = deque([pos])
+        snake.occupied = Counter(snake.body)
+        best = -1
+        for direction in (Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT):
+            dx, dy = direction.value
+            ahead = 0
+            while ahead < SPAWN_LOOKAHEAD:
+                cell = (pos[0] + dx * (ahead + 1), pos[1] + dy * (ahead + 1))
+                if not free_cells.inside(cell) or not free_cells.is_free(cell):
+                    break
+                ahead += 1
+            if ahead > best:
+                best = ahead
+                snake.direction = direction
+        free_cells.occupy(pos, SNAKE_CELL)
+        self.snakes[player_id] = snake
+        self.scores[player_id] = 0
+        return snake
+
+    def remove_player(self, player_id):
+        """ Take the player's snake (if it is alive) and score off the board """
+        snake = self.snakes.pop(player_id, None)
+        if snake is not None:
+            self.take_off(snake)
+        self.scores.pop(player_id, None)
+
+    def take_off(self, snake):
+        for pos in snake.body:
+            self.free_cells.release(pos, SNAKE_CELL)
+
+    def collision(self, snake):
+        """ Death cause for a snake that has just moved, None if it survives """
+        free_cells = self.free_cells
+        head = snake.body[0]
+        if not free_cells.inside(head):
+            return "wall"
+        x, y = head
+        if free_cells.kinds[SNAKE_CELL][y * self.width + x] > 1:
+            return "self" if snake.occupied[head] > 1 else "snake"
+        if free_cells.has(head, OBSTACLE_CELL):
+            return "obstacle"
+        if self.theme_name == MARIO and free_cells.has(head, GOOMBA_CELL):
+            return "goomba"
+        return None
+
+    def _update(self):
+        """ Snake, obstacle, spawn and scoring rules for one tick, for every player """
+        free_cells = self.free_cells
+        for snake in self.snakes.values():
+            tail = snake.move()
+            free_cells.occupy(snake.body[0], SNAKE_CELL)
+            if tail is not None:
+                free_cells.release(tail, SNAKE_CELL)
+        self.move_obstacles()
+
+        # Every snake is checked before any is taken off, so a head-on crash kills both
+        self.deaths = {}
+        for player_id, snake in self.snakes.items():
+            cause = self.collision(snake)
+            if cause is not None:
+                self.deaths[player_id] = cause
+        for player_id in self.deaths:
+            self.take_off(self.snakes.pop(player_id))
+
+        for player_id, snake in self.snakes.items():
+            if snake.eat_food(self.food.position):
+                self.scores[player_id] += self.food.points
+                self.score += self.food.points
+                self.collect_food()
+                break
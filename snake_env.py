@@ -0,0 +1,161 @@
+"""
+Gym-style reinforcement learning environment around the headless engine
+"""
+
+import numpy as np
+from snake_engine import GOOMBA_CELL, OBSTACLE_CELL, RETRO, Direction, SnakeEngine
+
+# Actions are direction indices in this order (same as snake_batch)
+ACTIONS = (Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT)
+
+# Grid observation channels
+SNAKE, HEAD, FOOD, OBSTACLE, GOOMBA = range(5)
+NUM_CHANNELS = 5
+
+# Colors for the RGB observation, later entries are drawn on top
+RGB_BACKGROUND = (0, 0, 0)
+RGB_COLORS = (
+    (SNAKE, (0, 160, 0)),
+    (HEAD, (0, 255, 0)),
+    (FOOD, (255, 215, 0)),
+    (OBSTACLE, (138, 43, 226)),
+    (GOOMBA, (139, 69, 19))
+)
+
+OBSERVATIONS = ("features", "grid", "rgb")
+NUM_FEATURES = 11
+
+class SnakeEnv:
+    """ reset()/step(action) environment for one game
+
+    observation selects the encoding:
+      "features" - 11 floats: danger per direction, current direction
+                   one-hot, food offset and snake length
+      "grid"     - (5, height, width) uint8 channels for snake, head,
+                   food, obstacles and Goombas
+      "rgb"      - (height * rgb_scale, width * rgb_scale, 3) uint8 image
+
+    Observations live in buffers allocated once and patched from the
+    engine's changed cells every tick. step() returns the same array each
+    time, so copy it if you need to keep it.
+    """
+    def __init__(self, theme_name=RETRO, observation="features", rgb_scale=1, death_penalty=-1.0,
+                 seed=None):
+        if observation not in OBSERVATIONS:
+            raise ValueError(f"Unknown observation {observation!r}, expected one of {OBSERVATIONS}")
+        self.engine = SnakeEngine(theme_name, seed)
+        self.observation = observation
+        self.rgb_scale = rgb_scale
+        self.death_penalty = death_penalty
+        self.width = self.engine.free_cells.width
+        self.height = self.engine.free_cells.height
+        self.num_actions = len(ACTIONS)
+
+        if observation == "features":
+            self.observation_shape = (NUM_FEATURES,)
+            self.obs = np.zeros(self.observation_shape, dtype=np.float32)
+        elif observation == "grid":
+            self.observation_shape = (NUM_CHANNELS, self.height, self.width)
+            self.obs = np.zeros(self.observation_shape, dtype=np.uint8)
+        else:
+            self.observation_shape = (self.height * rgb_scale, self.width * rgb_scale, 3)
+            self.obs = np.zeros(self.observation_shape, dtype=np.uint8)
+            # Cell contents are kept as a grid even for RGB, pixels are painted from it
+            self.grid = np.zeros((NUM_CHANNELS, self.height, self.width), dtype=np.uint8)
+        self.last_head = None
+
+    def reset(self, seed=None):
+        """ Start a new game and return the first observation """
+        self.engine.reset(seed=seed)
+        if self.observation == "features":
+            self._update_features()
+        else:
+            grid = self.obs if self.observation == "grid" else self.grid
+            grid.fill(0)
+            if self.observation == "rgb":
+                self.obs[:] = RGB_BACKGROUND
+            cells = set(self.engine.snake.body)
+            if self.engine.food.position is not None:
+                cells.add(self.engine.food.position)
+            self.last_head = self.engine.snake.body[0]
+            self._update_cells(cells)
+        self.engine.free_cells.changed.clear()
+        return self.obs
+
+    def step(self, action):
+        """ Apply an action index and advance one tick
+
+        Returns (observation, reward, done, info) where reward is the points
+        scored this tick, plus death_penalty when the snake dies. Once the
+        game is over nothing moves any more and the reward is 0 until reset().
+        """
+        engine = self.engine
+        if engine.game_over:
+            info = {"score": engine.score, "ticks": engine.ticks, "won": engine.won}
+            return self.obs, 0.0, True, info
+        engine.snake.change_direction(ACTIONS[action])
+        score_before = engine.score
+        alive = engine.step()
+        reward = float(engine.score - score_before)
+        if not alive and not engine.won:
+            reward += self.death_penalty
+
+        if self.observation == "features":
+            self._update_features()
+        else:
+            cells = set(engine.changed_cells)
+            # The old head cell turns into body without its cover count changing
+            cells.add(self.last_head)
+            self.last_head = engine.snake.body[0]
+            self._update_cells(cells)
+
+        info = {"score": engine.score, "ticks": engine.ticks, "won": engine.won}
+        return self.obs, reward, not alive, info
+
+    def _update_features(self):
+        """ Refill the compact feature vector in place """
+        engine = self.engine
+        obs = self.obs
+        head_x, head_y = engine.snake.body[0]
+        free_cells = engine.free_cells
+        food = engine.food.position
+
+        for i, direction in enumerate(ACTIONS):
+            dx, dy = direction.value
+            x, y = head_x + dx, head_y + dy
+            # Danger when the cell is outside the board or covered by anything but food
+            inside = 0 <= x < self.width and 0 <= y < self.height
+            obs[i] = not inside or (not free_cells.is_free((x, y)) and (x, y) != food)
+            obs[4 + i] = engine.snake.direction == direction
+
+        if food is not None:
+            obs[8] = (food[0] - head_x) / self.width
+            obs[9] = (food[1] - head_y) / self.height
+        else:
+            obs[8] = obs[9] = 0.0
+        obs[10] = len(engine.snake.body) / (self.width * self.height)
+
+    def _update_cells(self, cells):
+        """ Recompute the grid channels (and pixels) for the given cells """
+        engine = self.engine
+        grid = self.obs if self.observation == "grid" else self.grid
+        head = engine.snake.body[0]
+        food = engine.food.position
+        scale = self.rgb_scale
+
+        for pos in cells:
+            x, y = pos
+            if not (0 <= x < self.width and 0 <= y < self.height):
+                continue
+            grid[SNAKE, y, x] = engine.snake.occupies(pos)
+            grid[HEAD, y, x] = pos == head
+            grid[FOOD, y, x] = pos == food
+            grid[OBSTACLE, y, x] = engine.free_cells.has(pos, OBSTACLE_CELL)
+            grid[GOOMBA, y, x] = engine.free_cells.has(pos, GOOMBA_CELL)
+
+            if self.observation == "rgb":
+                color = RGB_BACKGROUND
+                for channel, channel_color in RGB_COLORS:
+                    if grid[channel, y, x]:
+                        color = channel_color
+                self.obs[y * scale:(y + 1) * scale, x * scale:(x + 1) * scale] = color
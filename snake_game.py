@@ -2,32 +2,87 @@
 Snake Game with theme worlds
 """
 
+import time
+IMPORT_START = time.perf_counter()  # Before anything heavy, for --profile-startup
+
+import argparse
+import csv
+import hashlib
+import json
+import os
 import pygame
-import random
 import sys
-from enum import Enum
-
-# Starting Pygame
-pygame.init()
-
+import threading
+from collections import OrderedDict, deque
+from itertools import chain, islice
+from snake_engine import (
+    GRID_WIDTH, GRID_HEIGHT, RUPEE_COLORS, SNAKE_CELL, FOOD_CELL, OBSTACLE_CELL, GOOMBA_CELL,
+    THEME_NAMES, Direction, SnakeEngine, board_size
+)
+from snake_autopilot import Autopilot
+from snake_replay import Replay, ReplayPlayer
+
+# Nothing is initialized on import, Game starts the pygame subsystems it uses
 # Constants
 WINDOW_WIDTH = 800
 WINDOW_HEIGHT = 600
 HEADER_HEIGHT = 50
 GRID_SIZE = 20
-GRID_WIDTH = WINDOW_WIDTH // GRID_SIZE
-GRID_HEIGHT = (WINDOW_HEIGHT - HEADER_HEIGHT) // GRID_SIZE
-FPS = 10
+FPS = 10  # Game ticks per second
+TICK_TIME = 1 / FPS
+RENDER_FPS = 60  # Frames per second drawn while playing, in between ticks
+MAX_FRAME_TIME = 0.25  # Longer stalls are not caught up on
+HEADER_RECT = pygame.Rect(0, 0, WINDOW_WIDTH, HEADER_HEIGHT + 2)  # Includes the 3px accent line
+SNAKE_SHADES = 25  # Body segments after this all have the darkest shade
+STARTUP_BUDGET = 0.5  # Seconds from import until the menu is on screen
+VIEW_WIDTH = GRID_WIDTH * GRID_SIZE  # Pixels of the board on screen, bigger boards scroll
+VIEW_HEIGHT = GRID_HEIGHT * GRID_SIZE
+MINIMAP_SIZE = 150  # Pixels along the longest side of the minimap
+TEXT_CACHE_SIZE = 128  # Rendered strings kept by TextCache
+PROFILE_WINDOW = 300  # Frames the profiler percentiles are taken over
+PROFILE_REFRESH = 15  # Frames between updates of the profiler overlay
+AUTOPILOT_RESTART = 3 * FPS  # Ticks on the game over screen before the autopilot plays again
+RIVAL_COLOR = (170, 170, 170)  # Other players' snakes in a network game
 
 # Colors
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
-class Direction(Enum):
-    UP = (0, -1)
-    DOWN = (0, 1)
-    LEFT = (-1, 0)
-    RIGHT = (1, 0)
+# Background images, and where their scaled pixels are cached between runs
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_DIR = os.path.join(SCRIPT_DIR, "images")
+CACHE_DIR = os.path.join(SCRIPT_DIR, ".cache", "backgrounds")
+
+def scale_image(path, size):
+    """ Decode an image and resize it, returns the RGB pixel data """
+    try:
+        from PIL import Image
+    except ImportError:
+        print("PIL/Pillow not installed. Trying direct pygame load...")
+        image = pygame.transform.scale(pygame.image.load(path), size)
+        return pygame.image.tostring(image, "RGB")
+    pil_image = Image.open(path).convert('RGB')
+    return pil_image.resize(size, Image.LANCZOS).tobytes()
+
+def read_cache(path, num_bytes):
+    """ Cached pixel data, or None if it is missing or the wrong size """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    return data if len(data) == num_bytes else None
+
+def write_cache(path, data):
+    """ Store pixel data, written to a temp file first so readers never see half a file """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not write background cache: {e}")
 
 class Theme:
     """ Base class for theme worlds """
@@ -38,6 +93,41 @@ class Theme:
         self.food_color = food_color
         self.accent_color = accent_color
         self.description = ""
+        self.background_file = None  # File in images/ to use as background
+        self.background_image = None
+        self.background_loaded = False
+        self.background_lock = threading.Lock()
+
+    def load_background(self, window_width, window_height, cache_dir=CACHE_DIR):
+        """ Load and scale the background image, the first time it is called
+
+        The scaled pixels are cached in cache_dir, keyed by the hash of the
+        source file and the target size, so later starts skip decoding and
+        resizing. Safe to call from several threads, a second caller waits
+        for the load in progress.
+        """
+        with self.background_lock:
+            if self.background_loaded or self.background_file is None:
+                return
+            self.background_loaded = True
+
+            bg_path = os.path.join(IMAGE_DIR, self.background_file)
+            if not os.path.exists(bg_path):
+                print(f"Background image not found at: {bg_path}")
+                return
+            size = (window_width, window_height)
+            try:
+                with open(bg_path, "rb") as f:
+                    source_hash = hashlib.sha1(f.read()).hexdigest()
+                cache_path = os.path.join(cache_dir, f"{source_hash}_{window_width}x{window_height}.rgb")
+                data = read_cache(cache_path, window_width * window_height * 3)
+                if data is None:
+                    data = scale_image(bg_path, size)
+                    write_cache(cache_path, data)
+                self.background_image = pygame.image.fromstring(data, size, "RGB")
+            except Exception as e:
+                print(f"Could not load {self.name} background image: {e}")
+                self.background_image = None
 
 # Defining all the theme worlds
 class MarioTheme(Theme):
@@ -50,43 +140,7 @@ class MarioTheme(Theme):
             accent_color=(0, 168, 0)   # Green tubes
         )
         self.description = "It's-a me, Snake-io!"
-        self.background_image = None
-
-    def load_background(self, window_width, window_height):
-        """ Load and scale the background image """
-        try:
-            import os
-            from PIL import Image
-            # Get path relative to this script
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            bg_path = os.path.join(script_dir, "images", "supermario.png")
-            if os.path.exists(bg_path):
-                # Load image using PIL first, then convert to pygame surface
-                pil_image = Image.open(bg_path).convert('RGB')
-                # Resize using PIL
-                pil_image = pil_image.resize((window_width, window_height), Image.LANCZOS)
-                # Convert PIL image to pygame surface
-                mode = pil_image.mode
-                size = pil_image.size
-                data = pil_image.tobytes()
-                self.background_image = pygame.image.fromstring(data, size, mode)
-            else:
-                print(f"Background image not found at: {bg_path}")
-        except ImportError:
-            print("PIL/Pillow not installed. Trying direct pygame load...")
-            try:
-                import os
-                script_dir = os.path.dirname(os.path.abspath(__file__))
-                bg_path = os.path.join(script_dir, "images", "supermario.png")
-                if os.path.exists(bg_path):
-                    self.background_image = pygame.image.load(bg_path).convert()
-                    self.background_image = pygame.transform.scale(self.background_image, (window_width, window_height))
-            except Exception as e:
-                print(f"Could not load background image with pygame: {e}")
-                self.background_image = None
-        except Exception as e:
-            print(f"Could not load background image: {e}")
-            self.background_image = None
+        self.background_file = "supermario.png"
 
 class ZeldaTheme(Theme):
     def __init__(self):
@@ -109,43 +163,7 @@ class StitchTheme(Theme):
             accent_color=(255, 140, 0)  # Tropical orange
         )
         self.description = "Ohana means family!"
-        self.background_image = None
-
-    def load_background(self, window_width, window_height):
-        """ Load and scale the background image """
-        try:
-            import os
-            from PIL import Image
-            # Get path relative to this script
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            bg_path = os.path.join(script_dir, "images", "stitch.jpg")
-            if os.path.exists(bg_path):
-                # Load image using PIL first, then convert to pygame surface
-                pil_image = Image.open(bg_path).convert('RGB')
-                # Resize using PIL
-                pil_image = pil_image.resize((window_width, window_height), Image.LANCZOS)
-                # Convert PIL image to pygame surface
-                mode = pil_image.mode
-                size = pil_image.size
-                data = pil_image.tobytes()
-                self.background_image = pygame.image.fromstring(data, size, mode)
-            else:
-                print(f"Background image not found at: {bg_path}")
-        except ImportError:
-            print("PIL/Pillow not installed. Trying direct pygame load...")
-            try:
-                import os
-                script_dir = os.path.dirname(os.path.abspath(__file__))
-                bg_path = os.path.join(script_dir, "images", "stitch.jpg")
-                if os.path.exists(bg_path):
-                    self.background_image = pygame.image.load(bg_path).convert()
-                    self.background_image = pygame.transform.scale(self.background_image, (window_width, window_height))
-            except Exception as e:
-                print(f"Could not load background image with pygame: {e}")
-                self.background_image = None
-        except Exception as e:
-            print(f"Could not load Stitch background image: {e}")
-            self.background_image = None
+        self.background_file = "stitch.jpg"
 
 class HelloKittyTheme(Theme):
     def __init__(self):
@@ -157,43 +175,7 @@ class HelloKittyTheme(Theme):
             accent_color=(255, 105, 180) # Hot pink
         )
         self.description = "Kawaii desu ne~!"
-        self.background_image = None
-
-    def load_background(self, window_width, window_height):
-        """ Load and scale the background image """
-        try:
-            import os
-            from PIL import Image
-            # Get path relative to this script
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            bg_path = os.path.join(script_dir, "images", "hellokitty_bc.jpg")
-            if os.path.exists(bg_path):
-                # Load image using PIL first, then convert to pygame surface
-                pil_image = Image.open(bg_path).convert('RGB')
-                # Resize using PIL
-                pil_image = pil_image.resize((window_width, window_height), Image.LANCZOS)
-                # Convert PIL image to pygame surface
-                mode = pil_image.mode
-                size = pil_image.size
-                data = pil_image.tobytes()
-                self.background_image = pygame.image.fromstring(data, size, mode)
-            else:
-                print(f"Background image not found at: {bg_path}")
-        except ImportError:
-            print("PIL/Pillow not installed. Trying direct pygame load...")
-            try:
-                import os
-                script_dir = os.path.dirname(os.path.abspath(__file__))
-                bg_path = os.path.join(script_dir, "images", "hellokitty_bc.jpg")
-                if os.path.exists(bg_path):
-                    self.background_image = pygame.image.load(bg_path).convert()
-                    self.background_image = pygame.transform.scale(self.background_image, (window_width, window_height))
-            except Exception as e:
-                print(f"Could not load background image with pygame: {e}")
-                self.background_image = None
-        except Exception as e:
-            print(f"Could not load Hello Kitty background image: {e}")
-            self.background_image = None
+        self.background_file = "hellokitty_bc.jpg"
 
 class RetroTheme(Theme):
     def __init__(self):
@@ -206,320 +188,281 @@ class RetroTheme(Theme):
         )
         self.description = "Old school vibes!"
 
-class Snake:
-    """ Snake-klassen for handeling the snakes logic """
-    def __init__(self):
-        self.reset()
-
-    def reset(self):
-        """ Reset the snake to start position """
-        self.body = [(GRID_WIDTH // 2, GRID_HEIGHT // 2)]
-        self.direction = Direction.RIGHT
-        self.grow = False
-
-    def move(self):
-        """ Move the snake """
-        head_x, head_y = self.body[0]
-        dx, dy = self.direction.value
-        new_head = (head_x + dx, head_y + dy)
-
-        self.body.insert(0, new_head)
-        if not self.grow:
-            self.body.pop()
-        else:
-            self.grow = False
-
-    def change_direction(self, new_direction):
-        """ Change direction """
-        if (self.direction == Direction.UP and new_direction != Direction.DOWN) or \
-        (self.direction == Direction.DOWN and new_direction != Direction.UP) or \
-        (self.direction == Direction.LEFT and new_direction != Direction.RIGHT) or \
-        (self.direction == Direction.RIGHT and new_direction != Direction.LEFT):
-            self.direction = new_direction
-
-    def check_collision(self):
-        """ Check if the snake is colliding with itself or the wall """
-        head_x, head_y = self.body[0]
-
-        # Wall-collision
-        if head_x < 0 or head_x >= GRID_WIDTH or head_y < 0 or head_y >= GRID_HEIGHT:
-            return True
-
-        # Self-collision
-        if self.body[0] in self.body[1:]:
-            return True
-
-        return False
-
-    def eat_food(self, food_pos):
-        """ Check if the snake eats food """
-        if self.body[0] == food_pos:
-            self.grow = True
-            return True
-        return False
-
-class Food:
-    """Base class for food (coins, mushrooms, and special items)"""
-    def __init__(self, food_type="coin"):
-        self.food_type = food_type  # "coin", "mushroom", "bow", "hellokitty"
-        self.type = food_type  # Alias for compatibility
-
-        # Set points based on food type
-        if food_type == "coin":
-            self.points = 1
-        elif food_type == "mushroom":
-            self.points = 2
-        elif food_type == "bow":
-            self.points = 1
-        elif food_type == "hellokitty":
-            self.points = 1
-        else:
-            self.points = 1  # Default
-
-        self.position = self.generate_position()
-
-    def generate_position(self, snake_body=None, obstacles=None):
-        """Generate a random position for food"""
-        while True:
-            pos = (random.randint(0, GRID_WIDTH - 1), random.randint(0, GRID_HEIGHT - 1))
-            obstacle_positions = [obs.position for obs in obstacles] if obstacles else []
-            if (snake_body is None or pos not in snake_body) and pos not in obstacle_positions:
-                self.position = pos
-                return pos
-
-class Goomba:
-    """Goomba class for Mario theme obstacles"""
-    def __init__(self, position=None, can_move=False):
-        if position is None:
-            self.position = self.generate_position()
-        else:
-            self.position = position
-        self.animation_frame = 0
-        self.animation_speed = 10
-        self.animation_counter = 0
-        self.can_move = can_move
-        self.move_counter = 0
-        self.move_speed = 15  # How many frames between each movement
-        self.direction = random.choice([Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT])
-
-    def generate_position(self, snake_body=None, food_pos=None, other_goombas=None):
-        """Generate a random position for Goomba"""
-        while True:
-            pos = (random.randint(0, GRID_WIDTH - 1), random.randint(0, GRID_HEIGHT - 1))
-            if snake_body is None or pos not in snake_body:
-                if food_pos is None or pos != food_pos:
-                    if other_goombas is None or pos not in other_goombas:
-                        self.position = pos
-                        return pos
-
-    def update_animation(self):
-        """Update animation for Goomba"""
-        self.animation_counter += 1
-        if self.animation_counter >= self.animation_speed:
-            self.animation_counter = 0
-            self.animation_frame = (self.animation_frame + 1) % 2
-
-    def move(self, snake_body, food_pos, other_goombas):
-        """Move Goomba if it can move"""
-        if not self.can_move:
-            return
-
-        self.move_counter += 1
-        if self.move_counter >= self.move_speed:
-            self.move_counter = 0
-
-            # Try to move in current direction
-            x, y = self.position
-            dx, dy = self.direction.value
-            new_pos = (x + dx, y + dy)
-
-            # Check if new position is valid
-            if (0 <= new_pos[0] < GRID_WIDTH and
-                0 <= new_pos[1] < GRID_HEIGHT and
-                new_pos not in snake_body and
-                new_pos != food_pos and
-                new_pos not in other_goombas):
-                self.position = new_pos
+class StartupProfile:
+    """ Time spent in each startup phase, reported by --profile-startup """
+    def __init__(self, start):
+        self.last = start
+        self.phases = []
+
+    def mark(self, name):
+        """ End the current phase """
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self, budget=STARTUP_BUDGET):
+        """ Print the phases, returns whether the total is within budget """
+        total = sum(seconds for name, seconds in self.phases)
+        for name, seconds in self.phases:
+            print(f"{name:<20}{seconds * 1000:8.1f} ms")
+        verdict = "ok" if total <= budget else "OVER BUDGET"
+        print(f"{'total':<20}{total * 1000:8.1f} ms  (budget {budget * 1000:.0f} ms, {verdict})")
+        return total <= budget
+
+def percentile(sorted_values, q):
+    """ Nearest-rank percentile of an already sorted list """
+    return sorted_values[min(len(sorted_values) - 1, len(sorted_values) * q // 100)]
+
+class FrameProfiler:
+    """ Timings of the main loop phases, frame by frame
+
+    Like StartupProfile, mark(name) charges the time since the previous mark
+    to a phase. end_frame() stores the frame together with entity counts and
+    how many memory blocks Python has allocated, and percentiles are taken
+    over the last PROFILE_WINDOW frames. With keep_frames every frame is
+    also kept for export().
+    """
+    PHASES = ("events", "update", "draw_menu", "draw_game", "draw_game_dirty", "draw_paused",
+              "draw_game_over", "hud", "flip", "sleep")
+    COUNTS = ("snake", "obstacles", "goombas", "blocks", "allocated")
+
+    def __init__(self, window=PROFILE_WINDOW, keep_frames=False):
+        self.frames = deque(maxlen=window)
+        self.history = [] if keep_frames else None
+        self.frame_count = 0
+        self.current = {}
+        self.last = time.perf_counter()
+        self.blocks = sys.getallocatedblocks()
+
+    def start_frame(self):
+        self.current = {}
+        self.last = time.perf_counter()
+
+    def mark(self, name):
+        """ End the current phase """
+        now = time.perf_counter()
+        self.current[name] = self.current.get(name, 0.0) + now - self.last
+        self.last = now
+
+    def end_frame(self, **counts):
+        """ Store the frame, counts are entity counts to keep with it """
+        frame = self.current
+        frame["frame"] = sum(frame.values())
+        blocks = sys.getallocatedblocks()
+        frame.update(counts, blocks=blocks, allocated=blocks - self.blocks)
+        self.blocks = blocks
+        self.frames.append(frame)
+        if self.history is not None:
+            self.history.append(frame)
+        self.frame_count += 1
+
+    def summary(self, frames=None):
+        """ p50/p95/p99 and mean of every phase and the whole frame, in ms """
+        frames = self.frames if frames is None else frames
+        result = {}
+        for name in ("frame",) + self.PHASES:
+            values = sorted(frame[name] for frame in frames if name in frame)
+            if values:
+                result[name] = {"p50": round(percentile(values, 50) * 1000, 3),
+                                "p95": round(percentile(values, 95) * 1000, 3),
+                                "p99": round(percentile(values, 99) * 1000, 3),
+                                "mean": round(sum(values) / len(values) * 1000, 3),
+                                "frames": len(values)}
+        return result
+
+    def export(self, path):
+        """ Write the frames to a .json file (summary and frames) or a .csv file (one row per frame) """
+        frames = self.history if self.history is not None else list(self.frames)
+        rows = [{name: round(value * 1000, 3) if name == "frame" or name in self.PHASES else value
+                 for name, value in frame.items()} for frame in frames]
+        with open(path, "w", newline="") as f:
+            if path.endswith(".json"):
+                json.dump({"summary": self.summary(frames), "frames": rows}, f, indent=1)
             else:
-                # Change direction if we collide
-                self.direction = random.choice([Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT])
-
-class Obstacle:
-    """ Obstacle class for moving obstacles in themed worlds """
-    def __init__(self, obstacle_type, color):
-        self.type = obstacle_type  # "palm", "surfboard", "kuromi", or "rupee"
-        self.color = color
-        self.position = self.generate_position()
-        self.direction = random.choice([Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT])
-        self.move_counter = 0
-        # Kuromi moves faster than palm trees, rupees move at medium speed
-        if obstacle_type == "kuromi":
-            self.move_delay = 2
-        elif obstacle_type == "rupee":
-            self.move_delay = 4
-        else:
-            self.move_delay = 3
-
-    def generate_position(self):
-        """ Generate random position for obstacle """
-        return (random.randint(0, GRID_WIDTH - 1), random.randint(0, GRID_HEIGHT - 1))
-
-    def move(self):
-        """ Move the obstacle """
-        self.move_counter += 1
-        if self.move_counter >= self.move_delay:
-            self.move_counter = 0
-
-            x, y = self.position
-            dx, dy = self.direction.value
-            new_x = x + dx
-            new_y = y + dy
-
-            # Bounce off walls
-            if new_x < 0 or new_x >= GRID_WIDTH:
-                self.direction = Direction.LEFT if self.direction == Direction.RIGHT else Direction.RIGHT
-                new_x = x
-            if new_y < 0 or new_y >= GRID_HEIGHT:
-                self.direction = Direction.UP if self.direction == Direction.DOWN else Direction.DOWN
-                new_y = y
-
-            self.position = (new_x, new_y)
-
-    def draw(self, screen):
-        """ Draw the obstacle """
-        x, y = self.position
-        screen_x = x * GRID_SIZE
-        screen_y = y * GRID_SIZE + HEADER_HEIGHT
-        rect = pygame.Rect(screen_x, screen_y, GRID_SIZE, GRID_SIZE)
-
-        if self.type == "palm":
-            # Draw palm tree (brown trunk + green fronds)
-            trunk_color = (139, 69, 19)
-            leaf_color = (34, 139, 34)
-            dark_leaf_color = (0, 128, 0)
-
-            # Trunk (curved/segmented for tropical look)
-            trunk_rect = pygame.Rect(screen_x + 7, screen_y + 8, 6, 12)
-            pygame.draw.rect(screen, trunk_color, trunk_rect)
-            # Trunk segments
-            pygame.draw.line(screen, (101, 50, 15), (screen_x + 7, screen_y + 11), (screen_x + 13, screen_y + 11), 1)
-            pygame.draw.line(screen, (101, 50, 15), (screen_x + 7, screen_y + 15), (screen_x + 13, screen_y + 15), 1)
-
-            # Palm fronds (5-6 leaves radiating from center)
-            center_x = screen_x + 10
-            center_y = screen_y + 6
-
-            # Top frond
-            pygame.draw.line(screen, leaf_color, (center_x, center_y), (center_x, center_y - 6), 3)
-            pygame.draw.line(screen, dark_leaf_color, (center_x, center_y), (center_x, center_y - 6), 1)
-
-            # Top-left frond
-            pygame.draw.line(screen, leaf_color, (center_x, center_y), (center_x - 5, center_y - 4), 3)
-            pygame.draw.line(screen, dark_leaf_color, (center_x, center_y), (center_x - 5, center_y - 4), 1)
-
-            # Top-right frond
-            pygame.draw.line(screen, leaf_color, (center_x, center_y), (center_x + 5, center_y - 4), 3)
-            pygame.draw.line(screen, dark_leaf_color, (center_x, center_y), (center_x + 5, center_y - 4), 1)
-
-            # Left frond
-            pygame.draw.line(screen, leaf_color, (center_x, center_y), (center_x - 7, center_y), 3)
-            pygame.draw.line(screen, dark_leaf_color, (center_x, center_y), (center_x - 7, center_y), 1)
-
-            # Right frond
-            pygame.draw.line(screen, leaf_color, (center_x, center_y), (center_x + 7, center_y), 3)
-            pygame.draw.line(screen, dark_leaf_color, (center_x, center_y), (center_x + 7, center_y), 1)
-
-            # Bottom-left frond
-            pygame.draw.line(screen, leaf_color, (center_x, center_y), (center_x - 5, center_y + 3), 3)
-            pygame.draw.line(screen, dark_leaf_color, (center_x, center_y), (center_x - 5, center_y + 3), 1)
-
-            # Bottom-right frond
-            pygame.draw.line(screen, leaf_color, (center_x, center_y), (center_x + 5, center_y + 3), 3)
-            pygame.draw.line(screen, dark_leaf_color, (center_x, center_y), (center_x + 5, center_y + 3), 1)
-
-        elif self.type == "surfboard":
-            # Draw surfboard (elongated oval)
-            board_color = (255, 69, 0)  # Orange-red
-            stripe_color = (255, 255, 255)
-
-            # Main board
-            pygame.draw.ellipse(screen, board_color, rect)
-            # Stripe
-            stripe_rect = pygame.Rect(screen_x + 2, screen_y + GRID_SIZE//2 - 1,
-                                     GRID_SIZE - 4, 2)
-            pygame.draw.rect(screen, stripe_color, stripe_rect)
-
-        elif self.type == "kuromi":
-            # Draw Kuromi (black/purple character with devil tail and pink skull)
-            kuromi_black = (50, 50, 50)
-            kuromi_purple = (138, 43, 226)
-            pink = (255, 105, 180)
-
-            # Body (black circle)
-            pygame.draw.circle(screen, kuromi_black, rect.center, GRID_SIZE // 2 - 1)
-
-            # Eyes (white with black pupils)
-            eye_left = (screen_x + 6, screen_y + 8)
-            eye_right = (screen_x + 14, screen_y + 8)
-            pygame.draw.circle(screen, (255, 255, 255), eye_left, 2)
-            pygame.draw.circle(screen, (255, 255, 255), eye_right, 2)
-            pygame.draw.circle(screen, BLACK, eye_left, 1)
-            pygame.draw.circle(screen, BLACK, eye_right, 1)
-
-            # Devil ears (purple triangles)
-            ear_left_points = [
-                (screen_x + 3, screen_y + 2),
-                (screen_x, screen_y - 3),
-                (screen_x + 6, screen_y + 2)
-            ]
-            ear_right_points = [
-                (screen_x + 14, screen_y + 2),
-                (screen_x + 20, screen_y - 3),
-                (screen_x + 17, screen_y + 2)
-            ]
-            pygame.draw.polygon(screen, kuromi_purple, ear_left_points)
-            pygame.draw.polygon(screen, kuromi_purple, ear_right_points)
-
-            # Pink skull mark on forehead
-            pygame.draw.circle(screen, pink, (screen_x + 10, screen_y + 4), 2)
-
-        elif self.type == "rupee":
-            # Draw rupee (diamond-shaped gem from Zelda)
-            center_x = screen_x + GRID_SIZE // 2
-            center_y = screen_y + GRID_SIZE // 2
+                writer = csv.DictWriter(f, fieldnames=("frame",) + self.PHASES + self.COUNTS, restval=0)
+                writer.writeheader()
+                writer.writerows(rows)
+
+    def render(self, font):
+        """ Overlay surface with the current percentiles and counts """
+        rows = [("ms", "p50", "p95", "p99")]
+        for name, stats in self.summary().items():
+            rows.append((name, f"{stats['p50']:.2f}", f"{stats['p95']:.2f}", f"{stats['p99']:.2f}"))
+        if self.frames:
+            last = self.frames[-1]
+            rows.append((f"snake {last.get('snake', 0)}  obstacles {last.get('obstacles', 0)}  "
+                         f"goombas {last.get('goombas', 0)}",))
+            rows.append((f"blocks {last['blocks']}  ({last['allocated']:+d} last frame)",))
+        line_height = font.get_linesize()
+        surface = pygame.Surface((300, line_height * len(rows) + 10))
+        surface.set_alpha(200)
+        for i, row in enumerate(rows):
+            y = 5 + i * line_height
+            surface.blit(font.render(row[0], True, WHITE), (5, y))
+            # Numbers are right aligned in their columns
+            for column, text in enumerate(row[1:]):
+                text_surface = font.render(text, True, WHITE)
+                surface.blit(text_surface, (175 + column * 60 - text_surface.get_width(), y))
+        return surface
+
+class SpriteAtlas:
+    """ Sprites pre-rendered once into a single surface
+
+    Every sprite gets a square slot of GRID_SIZE plus PADDING on each side,
+    since some sprites (ears, bows) reach outside their cell. Drawing a
+    sprite is then one blit from the atlas instead of a handful of
+    pygame.draw calls.
+    """
+    PADDING = 4
+    COLUMNS = 8
 
-            # Diamond points
-            rupee_points = [
-                (center_x, center_y - 8),      # Top
-                (center_x + 6, center_y),      # Right
-                (center_x, center_y + 8),      # Bottom
-                (center_x - 6, center_y)       # Left
-            ]
-
-            # Draw filled rupee
-            pygame.draw.polygon(screen, self.color, rupee_points)
-
-            # Add highlight (lighter color on top-left)
-            highlight_color = tuple(min(255, c + 50) for c in self.color)
-            highlight_points = [
-                (center_x, center_y - 8),
-                (center_x - 3, center_y - 4),
-                (center_x, center_y)
-            ]
-            pygame.draw.polygon(screen, highlight_color, highlight_points)
-
-            # Draw outline
-            dark_color = tuple(max(0, c - 50) for c in self.color)
-            pygame.draw.polygon(screen, dark_color, rupee_points, 2)
+    def __init__(self):
+        self.slot_size = GRID_SIZE + 2 * self.PADDING
+        self.surface = None
+        self.rects = {}
+
+    def __contains__(self, key):
+        return key in self.rects
+
+    def add(self, key, paint):
+        """ Render a sprite into the next free slot with paint(surface, x, y) """
+        index = len(self.rects)
+        rows = index // self.COLUMNS + 1
+        if self.surface is None or self.surface.get_height() < rows * self.slot_size:
+            # Double the number of rows, keeping what is already rendered
+            old = self.surface
+            height = max(rows, 2 * old.get_height() // self.slot_size if old else 1) * self.slot_size
+            self.surface = pygame.Surface((self.COLUMNS * self.slot_size, height), pygame.SRCALPHA)
+            if pygame.display.get_surface() is not None:
+                self.surface = self.surface.convert_alpha()
+            if old is not None:
+                self.surface.blit(old, (0, 0))
+        rect = pygame.Rect((index % self.COLUMNS) * self.slot_size, (index // self.COLUMNS) * self.slot_size,
+                           self.slot_size, self.slot_size)
+        paint(self.surface, rect.x + self.PADDING, rect.y + self.PADDING)
+        self.rects[key] = rect
+
+    def blit(self, target, key, x, y):
+        """ Draw a sprite with its cell's top left corner at (x, y) """
+        target.blit(self.surface, (x - self.PADDING, y - self.PADDING), self.rects[key])
+
+class TextCache:
+    """ Least recently used cache of rendered text surfaces
+
+    Keyed by (text, font, color), so the menu, header and overlays only
+    rasterize their glyphs the first time a string is shown. Strings that
+    keep changing (score, replay tick) push out the oldest entries.
+    """
+    def __init__(self, max_size=TEXT_CACHE_SIZE):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+
+    def render(self, text, font, color):
+        """ Rendered surface for the text, from the cache when possible """
+        key = (text, font, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = font.render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.max_size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+class Minimap:
+    """ Overview of a board that is too big to fit on the screen
+
+    Every pixel block stands for a square block of cells and shows the most
+    dangerous thing in it (Goombas and obstacles, then food, then the
+    snake). Only blocks with changed cells are repainted, so keeping the
+    minimap up to date costs the same on any board size.
+    """
+    BACKGROUND = (20, 20, 20)
+    DANGER = (220, 40, 40)
+
+    def __init__(self, engine, theme, max_size=MINIMAP_SIZE):
+        self.engine = engine
+        longest = max(engine.width, engine.height)
+        self.block = max(1, -(-longest // max_size))  # Cells per block, rounded up
+        self.scale = max(1, max_size // longest)  # Pixels per block
+        self.layers = ((GOOMBA_CELL, self.DANGER), (OBSTACLE_CELL, self.DANGER),
+                       (FOOD_CELL, theme.food_color), (SNAKE_CELL, theme.snake_color))
+        blocks_x = -(-engine.width // self.block)
+        blocks_y = -(-engine.height // self.block)
+        self.surface = pygame.Surface((blocks_x * self.scale, blocks_y * self.scale))
+        self.rebuild()
+
+    def paint_block(self, block_x, block_y):
+        """ Repaint one block from the occupancy grid """
+        free_cells = self.engine.free_cells
+        width = free_cells.width
+        x0 = block_x * self.block
+        x1 = min(x0 + self.block, width)
+        rows = range(block_y * self.block, min((block_y + 1) * self.block, free_cells.height))
+        color = self.BACKGROUND
+        for kind, kind_color in self.layers:
+            counts = free_cells.kinds[kind]
+            if any(any(counts[y * width + x0:y * width + x1]) for y in rows):
+                color = kind_color
+                break
+        self.surface.fill(color, (block_x * self.scale, block_y * self.scale, self.scale, self.scale))
+
+    def update(self, cells):
+        """ Repaint the blocks of the given cells """
+        for block in {(x // self.block, y // self.block) for x, y in cells}:
+            self.paint_block(*block)
+
+    def rebuild(self):
+        """ Repaint everything, after a reset or a jump in a replay """
+        engine = self.engine
+        self.surface.fill(self.BACKGROUND)
+        cells = list(engine.snake.body)
+        cells.extend(entity.position for entity in engine.obstacles + engine.goombas)
+        if engine.food.position is not None:
+            cells.append(engine.food.position)
+        self.update(cell for cell in cells if engine.free_cells.inside(cell))
+
+    def draw(self, target, camera):
+        """ Draw in the bottom right corner with the snake's head and the visible area marked """
+        size = self.block / self.scale  # Cells per pixel
+        rect = self.surface.get_rect(bottomright=(WINDOW_WIDTH - 10, WINDOW_HEIGHT - 10))
+        target.blit(self.surface, rect)
+        pygame.draw.rect(target, WHITE, rect.inflate(2, 2), 1)
+        view = pygame.Rect(rect.x + camera[0] / GRID_SIZE / size, rect.y + camera[1] / GRID_SIZE / size,
+                           GRID_WIDTH / size, GRID_HEIGHT / size)
+        pygame.draw.rect(target, WHITE, view.clip(rect), 1)
+        head_x, head_y = self.engine.snake.body[0]
+        pygame.draw.circle(target, WHITE, (rect.x + int(head_x / size), rect.y + int(head_y / size)), 2)
 
 class Game:
     """ Main class for the game """
-    def __init__(self):
+    def __init__(self, record_dir=None, dirty_rects=False, prefetch=True, board_size=None, profile_path=None,
+                 autopilot=False, hunting=False):
+        self.startup = StartupProfile(IMPORT_START)
+        self.startup.mark("imports")
+
+        # Only display and fonts are used, no need for pygame.init() to start audio and joysticks
+        pygame.display.init()
+        pygame.font.init()
+        self.startup.mark("pygame init")
+
         self.screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
         pygame.display.set_caption("Snake - Theme worlds")
         self.clock = pygame.time.Clock()
+        self.startup.mark("window")
         self.font = pygame.font.Font(None, 36)
         self.small_font = pygame.font.Font(None, 24)
+        self.text_cache = TextCache()
+        self.startup.mark("fonts")
+
+        # Dark overlays for the paused and game over screens, made once instead of every frame
+        self.overlays = {}
+        for alpha in (150, 180):
+            overlay = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT)).convert()
+            overlay.fill(BLACK)
+            overlay.set_alpha(alpha)
+            self.overlays[alpha] = overlay
 
         # All avaliable themes
         self.themes = [
@@ -530,33 +473,113 @@ class Game:
             RetroTheme()
         ]
 
-        # Load background images for themes that have them
-        for theme in self.themes:
-            if hasattr(theme, 'load_background'):
-                theme.load_background(WINDOW_WIDTH, WINDOW_HEIGHT)
+        # Backgrounds are loaded when a world is chosen, and meanwhile prefetched
+        # on a background thread so the choice usually finds them ready
+        if prefetch:
+            threading.Thread(target=self.load_backgrounds, daemon=True).start()
 
         self.current_theme = None
-        self.snake = Snake()
-        self.food = Food()
-        self.score = 0
-        self.food_collected = 0
-        self.goombas = []
+        self.atlases = {}  # Theme name -> SpriteAtlas, built the first time the theme is played
+        self.background_cache = {}  # Theme name -> full screen surface with the static background
+        self.header_cache = None  # ((theme name, score), header surface)
+
+        # Only repaint and push the cells that changed while playing
+        self.dirty_rects = dirty_rects
+        # (shaded snake segments, Goombas) on the screen, None when it needs a full redraw
+        self.drawn_sprites = None
+        self.dirty_cells = set()  # Cells the engine changed since the last frame
+        width, height = board_size or (GRID_WIDTH, GRID_HEIGHT)
+        self.engine = SnakeEngine(width=width, height=height, hunting=hunting)
         self.game_state = "menu"  # menu, playing, game_over
         self.paused = False
-        self.obstacles = []
-        self.obstacle_spawn_counter = 0
-        self.obstacle_spawn_rate = 50  # Spawn obstacle every 50 frames (approx 5 seconds)
 
+        # Replay of the current session, saved to record_dir when it ends
+        self.record_dir = record_dir
+        self.recording = None
+        # Positions at the previous tick, for drawing in between ticks
+        self.previous_tail = None
+        self.previous_positions = {}
+        # Boards bigger than the screen follow the snake's head, with a minimap
+        self.camera = (0, 0)  # Pixel offset of the visible part of the board
+        self.minimap = None
+
+        # Attract mode, the autopilot steers and starts over when it dies
+        self.autopilot = Autopilot(self.engine) if autopilot else None
+        self.game_over_ticks = 0
+
+        # Frame timings of run(), shown with F3 and written to profile_path on exit
+        self.profiler = FrameProfiler(keep_frames=profile_path is not None)
+        self.profile_path = profile_path
+        self.show_profiler = False
+        self.profiler_font = None
+        self.profiler_surface = None
+        self.startup.mark("game setup")
+
+    # The game state lives in the engine, these keep the drawing code short
+    @property
+    def snake(self):
+        return self.engine.snake
+
+    @property
+    def food(self):
+        return self.engine.food
+
+    @property
+    def obstacles(self):
+        return self.engine.obstacles
+
+    @property
+    def goombas(self):
+        return self.engine.goombas
+
+    @property
+    def score(self):
+        return self.engine.score
+
+    def load_backgrounds(self):
+        """ Load every theme's background image """
+        for theme in self.themes:
+            theme.load_background(WINDOW_WIDTH, WINDOW_HEIGHT)
 
     def grid_to_screen(self, grid_x, grid_y):
         """ Convert grid coordinates to screen coordinates (accounting for header) """
         return (grid_x * GRID_SIZE, grid_y * GRID_SIZE + HEADER_HEIGHT)
 
+    def scrolling(self):
+        """ Check if the board is too big for the screen """
+        return self.engine.width > GRID_WIDTH or self.engine.height > GRID_HEIGHT
+
+    def update_camera(self, alpha=1.0):
+        """ Center the view on the snake's head, without showing anything outside the board
+
+        It stays where it is while a network game has no snake of its own yet.
+        """
+        if self.snake is None:
+            return
+        x, y = self.snake.body[0]
+        previous_x, previous_y = self.snake.body[1] if len(self.snake.body) > 1 else self.previous_tail or (x, y)
+        if alpha < 1.0 and abs(x - previous_x) + abs(y - previous_y) == 1:
+            x = previous_x + (x - previous_x) * alpha
+            y = previous_y + (y - previous_y) * alpha
+        camera = []
+        for head, cells, view in ((x, self.engine.width, VIEW_WIDTH), (y, self.engine.height, VIEW_HEIGHT)):
+            world = cells * GRID_SIZE
+            camera.append(min(max(0, round((head + 0.5) * GRID_SIZE - view / 2)), world - view) if world > view else 0)
+        self.camera = tuple(camera)
+
+    def reset_minimap(self):
+        """ Start a minimap for the current session if the board scrolls """
+        self.minimap = Minimap(self.engine, self.current_theme) if self.scrolling() else None
+
+    def render_text(self, text, font, color):
+        """ Rendered text surface, cached between frames """
+        return self.text_cache.render(text, font, color)
+
     def draw_text(self, text, pos, font=None, color=WHITE):
         """ Draws text on the screen """
         if font is None:
             font = self.font
-        text_surface = font.render(text, True, color)
+        text_surface = self.render_text(text, font, color)
         text_rect = text_surface.get_rect(center=pos)
         self.screen.blit(text_surface, text_rect)
 
@@ -569,16 +592,16 @@ class Game:
                         (0, HEADER_HEIGHT), (WINDOW_WIDTH, HEADER_HEIGHT), 3)
 
         # Draw score on the left
-        score_text = self.small_font.render(f"Score: {self.score}", True, self.current_theme.accent_color)
+        score_text = self.render_text(f"Score: {self.score}", self.small_font, self.current_theme.accent_color)
         self.screen.blit(score_text, (20, 15))
 
         # Draw theme name in the center
-        theme_text = self.small_font.render(self.current_theme.name, True, self.current_theme.accent_color)
+        theme_text = self.render_text(self.current_theme.name, self.small_font, self.current_theme.accent_color)
         theme_rect = theme_text.get_rect(center=(WINDOW_WIDTH // 2, HEADER_HEIGHT // 2))
         self.screen.blit(theme_text, theme_rect)
 
         # Draw pause hint on the right
-        pause_text = self.small_font.render("Press P to pause", True, WHITE)
+        pause_text = self.render_text("Press P to pause", self.small_font, WHITE)
         self.screen.blit(pause_text, (WINDOW_WIDTH - pause_text.get_width() - 20, 15))
 
     def draw_triforce(self, x, y, size):
@@ -631,16 +654,15 @@ class Game:
             ]
             pygame.draw.polygon(self.screen, grass_green if i % 2 == 0 else dark_green, blade_points)
 
-    def draw_master_sword(self, grid_x, grid_y):
+    def draw_master_sword(self, surface, screen_x, screen_y):
         """ Draw Master Sword as food for Zelda theme """
-        screen_x, screen_y = self.grid_to_screen(grid_x, grid_y)
         x = screen_x + GRID_SIZE // 2
         y = screen_y + GRID_SIZE // 2
 
         # Blade (blue-silver)
         blade_color = (192, 192, 220)
         blade_rect = pygame.Rect(x - 2, y - 8, 4, 10)
-        pygame.draw.rect(self.screen, blade_color, blade_rect)
+        pygame.draw.rect(surface, blade_color, blade_rect)
 
         # Blade tip (triangle)
         tip_points = [
@@ -648,20 +670,20 @@ class Game:
             (x - 2, y - 8),
             (x + 2, y - 8)
         ]
-        pygame.draw.polygon(self.screen, blade_color, tip_points)
+        pygame.draw.polygon(surface, blade_color, tip_points)
 
         # Guard (gold)
         guard_color = (255, 215, 0)
         guard_rect = pygame.Rect(x - 5, y + 2, 10, 2)
-        pygame.draw.rect(self.screen, guard_color, guard_rect)
+        pygame.draw.rect(surface, guard_color, guard_rect)
 
         # Handle (blue)
         handle_color = (30, 144, 255)
         handle_rect = pygame.Rect(x - 1, y + 4, 2, 5)
-        pygame.draw.rect(self.screen, handle_color, handle_rect)
+        pygame.draw.rect(surface, handle_color, handle_rect)
 
         # Pommel (gold)
-        pygame.draw.circle(self.screen, guard_color, (x, y + 10), 2)
+        pygame.draw.circle(surface, guard_color, (x, y + 10), 2)
 
     def draw_pixelated_mario_mushroom(self, x, y, size=30):
         """ Draw a pixelated Mario mushroom decoration """
@@ -770,7 +792,7 @@ class Game:
         self.screen.fill((30, 30, 50))
 
         # Title
-        title = self.font.render("SNAKE - CHOOSE YOUR WORLD", True, WHITE)
+        title = self.render_text("SNAKE - CHOOSE YOUR WORLD", self.font, WHITE)
         title_rect = title.get_rect(center=(WINDOW_WIDTH // 2, 50))
         self.screen.blit(title, title_rect)
 
@@ -786,58 +808,175 @@ class Game:
             pygame.draw.rect(self.screen, theme.accent_color, box_rect, 3)
 
             # Draw the theme name
-            name_text = self.small_font.render(f"{i+1}. {theme.name}", True, theme.accent_color)
+            name_text = self.render_text(f"{i+1}. {theme.name}", self.small_font, theme.accent_color)
             self.screen.blit(name_text, (170, y_pos - 15))
 
             # Draw description
-            desc_text = self.small_font.render(theme.description, True, WHITE)
+            desc_text = self.render_text(theme.description, self.small_font, WHITE)
             self.screen.blit(desc_text, (170, y_pos + 10))
 
         # Instructions
-        instr = self.small_font.render("Press 1 to 5 to choose world", True, WHITE)
+        instr = self.render_text("Press 1 to 5 to choose world", self.small_font, WHITE)
         instr_rect = instr.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT - 30))
         self.screen.blit(instr, instr_rect)
 
-    def draw_coin(self, position, color):
+    def draw_coin(self, surface, color, screen_x, screen_y):
         """Rita ett mynt"""
-        x, y = position
-        screen_x, screen_y = self.grid_to_screen(x, y)
         center_x = screen_x + GRID_SIZE // 2
         center_y = screen_y + GRID_SIZE // 2
 
         # Guldmynt med cirkel
-        pygame.draw.circle(self.screen, color, (center_x, center_y), GRID_SIZE // 2 - 2)
+        pygame.draw.circle(surface, color, (center_x, center_y), GRID_SIZE // 2 - 2)
         # Inre cirkel (detalj)
         darker_color = tuple(max(0, c - 40) for c in color)
-        pygame.draw.circle(self.screen, darker_color, (center_x, center_y), GRID_SIZE // 3, 2)
+        pygame.draw.circle(surface, darker_color, (center_x, center_y), GRID_SIZE // 3, 2)
 
-    def draw_mushroom(self, position, color):
+    def draw_mushroom(self, surface, color, base_x, base_y):
         """Rita en svamp (mushroom)"""
-        x, y = position
-        base_x, base_y = self.grid_to_screen(x, y)
-
         # Svamphatt (röd med vita prickar för Mario-tema)
-        mushroom_red = (255, 0, 0) if self.current_theme.name == "Super Mario World" else color
+        mushroom_red = color
         mushroom_white = (255, 255, 255)
         mushroom_beige = (245, 222, 179)
 
         # Hatt (övre delen)
         hat_rect = pygame.Rect(base_x + 2, base_y + 2, GRID_SIZE - 4, GRID_SIZE // 2)
-        pygame.draw.ellipse(self.screen, mushroom_red, hat_rect)
+        pygame.draw.ellipse(surface, mushroom_red, hat_rect)
 
         # Vita prickar på hatten
-        pygame.draw.circle(self.screen, mushroom_white, (base_x + GRID_SIZE // 2, base_y + 6), 2)
-        pygame.draw.circle(self.screen, mushroom_white, (base_x + 5, base_y + 8), 1)
-        pygame.draw.circle(self.screen, mushroom_white, (base_x + GRID_SIZE - 5, base_y + 8), 1)
+        pygame.draw.circle(surface, mushroom_white, (base_x + GRID_SIZE // 2, base_y + 6), 2)
+        pygame.draw.circle(surface, mushroom_white, (base_x + 5, base_y + 8), 1)
+        pygame.draw.circle(surface, mushroom_white, (base_x + GRID_SIZE - 5, base_y + 8), 1)
 
         # Stam (nedre delen)
         stem_rect = pygame.Rect(base_x + GRID_SIZE // 3, base_y + GRID_SIZE // 2, GRID_SIZE // 3, GRID_SIZE // 2 - 2)
-        pygame.draw.rect(self.screen, mushroom_beige, stem_rect, border_radius=2)
+        pygame.draw.rect(surface, mushroom_beige, stem_rect, border_radius=2)
+
+    def draw_obstacle(self, surface, obstacle_type, color, screen_x, screen_y):
+        """ Draw an obstacle """
+        rect = pygame.Rect(screen_x, screen_y, GRID_SIZE, GRID_SIZE)
+
+        if obstacle_type == "palm":
+            # Draw palm tree (brown trunk + green fronds)
+            trunk_color = (139, 69, 19)
+            leaf_color = (34, 139, 34)
+            dark_leaf_color = (0, 128, 0)
+
+            # Trunk (curved/segmented for tropical look)
+            trunk_rect = pygame.Rect(screen_x + 7, screen_y + 8, 6, 12)
+            pygame.draw.rect(surface, trunk_color, trunk_rect)
+            # Trunk segments
+            pygame.draw.line(surface, (101, 50, 15), (screen_x + 7, screen_y + 11), (screen_x + 13, screen_y + 11), 1)
+            pygame.draw.line(surface, (101, 50, 15), (screen_x + 7, screen_y + 15), (screen_x + 13, screen_y + 15), 1)
+
+            # Palm fronds (5-6 leaves radiating from center)
+            center_x = screen_x + 10
+            center_y = screen_y + 6
+
+            # Top frond
+            pygame.draw.line(surface, leaf_color, (center_x, center_y), (center_x, center_y - 6), 3)
+            pygame.draw.line(surface, dark_leaf_color, (center_x, center_y), (center_x, center_y - 6), 1)
+
+            # Top-left frond
+            pygame.draw.line(surface, leaf_color, (center_x, center_y), (center_x - 5, center_y - 4), 3)
+            pygame.draw.line(surface, dark_leaf_color, (center_x, center_y), (center_x - 5, center_y - 4), 1)
+
+            # Top-right frond
+            pygame.draw.line(surface, leaf_color, (center_x, center_y), (center_x + 5, center_y - 4), 3)
+            pygame.draw.line(surface, dark_leaf_color, (center_x, center_y), (center_x + 5, center_y - 4), 1)
+
+            # Left frond
+            pygame.draw.line(surface, leaf_color, (center_x, center_y), (center_x - 7, center_y), 3)
+            pygame.draw.line(surface, dark_leaf_color, (center_x, center_y), (center_x - 7, center_y), 1)
 
-    def draw_goomba(self, goomba):
+            # Right frond
+            pygame.draw.line(surface, leaf_color, (center_x, center_y), (center_x + 7, center_y), 3)
+            pygame.draw.line(surface, dark_leaf_color, (center_x, center_y), (center_x + 7, center_y), 1)
+
+            # Bottom-left frond
+            pygame.draw.line(surface, leaf_color, (center_x, center_y), (center_x - 5, center_y + 3), 3)
+            pygame.draw.line(surface, dark_leaf_color, (center_x, center_y), (center_x - 5, center_y + 3), 1)
+
+            # Bottom-right frond
+            pygame.draw.line(surface, leaf_color, (center_x, center_y), (center_x + 5, center_y + 3), 3)
+            pygame.draw.line(surface, dark_leaf_color, (center_x, center_y), (center_x + 5, center_y + 3), 1)
+
+        elif obstacle_type == "surfboard":
+            # Draw surfboard (elongated oval)
+            board_color = (255, 69, 0)  # Orange-red
+            stripe_color = (255, 255, 255)
+
+            # Main board
+            pygame.draw.ellipse(surface, board_color, rect)
+            # Stripe
+            stripe_rect = pygame.Rect(screen_x + 2, screen_y + GRID_SIZE//2 - 1,
+                                     GRID_SIZE - 4, 2)
+            pygame.draw.rect(surface, stripe_color, stripe_rect)
+
+        elif obstacle_type == "kuromi":
+            # Draw Kuromi (black/purple character with devil tail and pink skull)
+            kuromi_black = (50, 50, 50)
+            kuromi_purple = (138, 43, 226)
+            pink = (255, 105, 180)
+
+            # Body (black circle)
+            pygame.draw.circle(surface, kuromi_black, rect.center, GRID_SIZE // 2 - 1)
+
+            # Eyes (white with black pupils)
+            eye_left = (screen_x + 6, screen_y + 8)
+            eye_right = (screen_x + 14, screen_y + 8)
+            pygame.draw.circle(surface, (255, 255, 255), eye_left, 2)
+            pygame.draw.circle(surface, (255, 255, 255), eye_right, 2)
+            pygame.draw.circle(surface, BLACK, eye_left, 1)
+            pygame.draw.circle(surface, BLACK, eye_right, 1)
+
+            # Devil ears (purple triangles)
+            ear_left_points = [
+                (screen_x + 3, screen_y + 2),
+                (screen_x, screen_y - 3),
+                (screen_x + 6, screen_y + 2)
+            ]
+            ear_right_points = [
+                (screen_x + 14, screen_y + 2),
+                (screen_x + 20, screen_y - 3),
+                (screen_x + 17, screen_y + 2)
+            ]
+            pygame.draw.polygon(surface, kuromi_purple, ear_left_points)
+            pygame.draw.polygon(surface, kuromi_purple, ear_right_points)
+
+            # Pink skull mark on forehead
+            pygame.draw.circle(surface, pink, (screen_x + 10, screen_y + 4), 2)
+
+        elif obstacle_type == "rupee":
+            # Draw rupee (diamond-shaped gem from Zelda)
+            center_x = screen_x + GRID_SIZE // 2
+            center_y = screen_y + GRID_SIZE // 2
+
+            # Diamond points
+            rupee_points = [
+                (center_x, center_y - 8),      # Top
+                (center_x + 6, center_y),      # Right
+                (center_x, center_y + 8),      # Bottom
+                (center_x - 6, center_y)       # Left
+            ]
+
+            # Draw filled rupee
+            pygame.draw.polygon(surface, color, rupee_points)
+
+            # Add highlight (lighter color on top-left)
+            highlight_color = tuple(min(255, c + 50) for c in color)
+            highlight_points = [
+                (center_x, center_y - 8),
+                (center_x - 3, center_y - 4),
+                (center_x, center_y)
+            ]
+            pygame.draw.polygon(surface, highlight_color, highlight_points)
+
+            # Draw outline
+            dark_color = tuple(max(0, c - 50) for c in color)
+            pygame.draw.polygon(surface, dark_color, rupee_points, 2)
+
+    def draw_goomba(self, surface, animation_frame, base_x, base_y):
         """Rita en Goomba"""
-        x, y = goomba.position
-        base_x, base_y = self.grid_to_screen(x, y)
 
         # Goomba kropp (brun svamp-form)
         goomba_brown = (139, 69, 19)
@@ -845,154 +984,52 @@ class Game:
 
         # Kropp
         body_rect = pygame.Rect(base_x + 2, base_y + 8, GRID_SIZE - 4, GRID_SIZE - 10)
-        pygame.draw.ellipse(self.screen, goomba_brown, body_rect)
+        pygame.draw.ellipse(surface, goomba_brown, body_rect)
 
         # Fötter (animerade)
-        foot_offset = 2 if goomba.animation_frame == 0 else -2
-        pygame.draw.rect(self.screen, goomba_dark,
+        foot_offset = 2 if animation_frame == 0 else -2
+        pygame.draw.rect(surface, goomba_dark,
                         (base_x + 3 + foot_offset, base_y + GRID_SIZE - 4, 5, 3))
-        pygame.draw.rect(self.screen, goomba_dark,
+        pygame.draw.rect(surface, goomba_dark,
                         (base_x + GRID_SIZE - 8 - foot_offset, base_y + GRID_SIZE - 4, 5, 3))
 
         # Ögon (arga)
         eye_white = WHITE
         eye_black = BLACK
         # Vänster öga
-        pygame.draw.circle(self.screen, eye_white, (base_x + 6, base_y + 10), 3)
-        pygame.draw.circle(self.screen, eye_black, (base_x + 7, base_y + 10), 2)
+        pygame.draw.circle(surface, eye_white, (base_x + 6, base_y + 10), 3)
+        pygame.draw.circle(surface, eye_black, (base_x + 7, base_y + 10), 2)
         # Höger öga
-        pygame.draw.circle(self.screen, eye_white, (base_x + GRID_SIZE - 6, base_y + 10), 3)
-        pygame.draw.circle(self.screen, eye_black, (base_x + GRID_SIZE - 7, base_y + 10), 2)
+        pygame.draw.circle(surface, eye_white, (base_x + GRID_SIZE - 6, base_y + 10), 3)
+        pygame.draw.circle(surface, eye_black, (base_x + GRID_SIZE - 7, base_y + 10), 2)
 
         # Ögonbryn (arga)
-        pygame.draw.line(self.screen, goomba_dark,
+        pygame.draw.line(surface, goomba_dark,
                         (base_x + 4, base_y + 8), (base_x + 8, base_y + 9), 2)
-        pygame.draw.line(self.screen, goomba_dark,
+        pygame.draw.line(surface, goomba_dark,
                         (base_x + GRID_SIZE - 4, base_y + 8), (base_x + GRID_SIZE - 8, base_y + 9), 2)
 
-    def draw_game(self):
-        """ Draws the game """
-        # Background - fill game area only (below header)
-        game_area_rect = pygame.Rect(0, HEADER_HEIGHT, WINDOW_WIDTH, WINDOW_HEIGHT - HEADER_HEIGHT)
-
-        # Fill entire screen first with black
-        self.screen.fill(BLACK)
-
-        # Draw themed background decorations
-        if self.current_theme.name == "Super Mario World":
-            # Check if background image is loaded
-            if hasattr(self.current_theme, 'background_image') and self.current_theme.background_image is not None:
-                # Draw Mario background image - blit the portion below the header
-                source_rect = pygame.Rect(0, HEADER_HEIGHT, WINDOW_WIDTH, WINDOW_HEIGHT - HEADER_HEIGHT)
-                self.screen.blit(self.current_theme.background_image, (0, HEADER_HEIGHT), source_rect)
-            else:
-                # Fill game area with theme color if no image
-                pygame.draw.rect(self.screen, self.current_theme.bg_color, game_area_rect)
-                # Draw pixelated Mario mushrooms in corners (below header) - bigger size
-                self.draw_pixelated_mario_mushroom(15, HEADER_HEIGHT + 15, 50)
-                self.draw_pixelated_mario_mushroom(WINDOW_WIDTH - 65, HEADER_HEIGHT + 15, 50)
-                self.draw_pixelated_mario_mushroom(15, WINDOW_HEIGHT - 65, 50)
-                self.draw_pixelated_mario_mushroom(WINDOW_WIDTH - 65, WINDOW_HEIGHT - 65, 50)
-
-        elif self.current_theme.name == "Ohana Island":
-            # Check if background image is loaded
-            if hasattr(self.current_theme, 'background_image') and self.current_theme.background_image is not None:
-                # Draw Stitch background image - blit the portion below the header
-                source_rect = pygame.Rect(0, HEADER_HEIGHT, WINDOW_WIDTH, WINDOW_HEIGHT - HEADER_HEIGHT)
-                self.screen.blit(self.current_theme.background_image, (0, HEADER_HEIGHT), source_rect)
-            else:
-                # Fill game area with theme color if no image
-                pygame.draw.rect(self.screen, self.current_theme.bg_color, game_area_rect)
-                # Fallback to pixelated Stitch if images not loaded
-                self.draw_pixelated_stitch(15, HEADER_HEIGHT + 15, 50)
-                self.draw_pixelated_stitch(WINDOW_WIDTH - 65, HEADER_HEIGHT + 15, 50)
-                self.draw_pixelated_stitch(15, WINDOW_HEIGHT - 65, 50)
-                self.draw_pixelated_stitch(WINDOW_WIDTH - 65, WINDOW_HEIGHT - 65, 50)
-
-        elif self.current_theme.name == "Hyrule Kingdom":
-            # Fill game area with theme color
-            pygame.draw.rect(self.screen, self.current_theme.bg_color, game_area_rect)
-            # Draw Triforce symbols in corners (below header)
-            self.draw_triforce(50, HEADER_HEIGHT + 50, 15)
-            self.draw_triforce(WINDOW_WIDTH - 50, HEADER_HEIGHT + 50, 15)
-            self.draw_triforce(50, WINDOW_HEIGHT - 50, 15)
-            self.draw_triforce(WINDOW_WIDTH - 50, WINDOW_HEIGHT - 50, 15)
-
-            # Draw grass patches around the map
-            grass_positions = [(5, 10), (15, 8), (25, 12), (35, 9), (10, 25), (30, 22),
-                              (5, 20), (20, 5), (38, 15), (2, 28)]
-            for gx, gy in grass_positions:
-                self.draw_hyrule_grass(gx, gy)
-
-        elif self.current_theme.name == "Kawaii Paradise":
-            # Check if background image is loaded
-            if hasattr(self.current_theme, 'background_image') and self.current_theme.background_image is not None:
-                # Draw Hello Kitty background image - blit the portion below the header
-                source_rect = pygame.Rect(0, HEADER_HEIGHT, WINDOW_WIDTH, WINDOW_HEIGHT - HEADER_HEIGHT)
-                self.screen.blit(self.current_theme.background_image, (0, HEADER_HEIGHT), source_rect)
-            else:
-                # Fill game area with theme color if no image
-                pygame.draw.rect(self.screen, self.current_theme.bg_color, game_area_rect)
-
-        else:
-            # Default: fill game area with theme color (for Retro and any other themes)
-            pygame.draw.rect(self.screen, self.current_theme.bg_color, game_area_rect)
-
-        # Draw obstacles
-        for obstacle in self.obstacles:
-            obstacle.draw(self.screen)
-
-        # Draw Goombas (Mario theme)
-        if self.current_theme and self.current_theme.name == "Super Mario World":
-            for goomba in self.goombas:
-                self.draw_goomba(goomba)
-                goomba.update_animation()
-
-                # Move Goomba
-                other_goomba_positions = [g.position for g in self.goombas if g != goomba]
-                goomba.move(self.snake.body, self.food.position, other_goomba_positions)
-
-        # Draw snake with gradient effect
-        for i, (x, y) in enumerate(self.snake.body):
-            screen_x, screen_y = self.grid_to_screen(x, y)
-            rect = pygame.Rect(screen_x, screen_y, GRID_SIZE - 2, GRID_SIZE - 2)
-
-            # Head i lighter
-            if i == 0:
-                color = self.current_theme.snake_color
-                pygame.draw.rect(self.screen, color, rect, border_radius=5)
-                # Draw eyes
-                eye_color = BLACK if self.current_theme.name != "Kawaii Paradise" else self.current_theme.food_color
-                pygame.draw.circle(self.screen, eye_color, (screen_x + 5, screen_y + 5), 2)
-                pygame.draw.circle(self.screen, eye_color, (screen_x + GRID_SIZE - 7, screen_y + 5), 2)
-            else:
-                # The body gets darker further back
-                factor = max(0.5, 1 - (i * 0.02))
-                color = tuple(int(c * factor) for c in self.current_theme.snake_color)
-                pygame.draw.rect(self.screen, color, rect, border_radius=3)
-
-        # Draw food (themed based on world)
-        food_x, food_y = self.food.position
-        food_screen_x, food_screen_y = self.grid_to_screen(food_x, food_y)
+    def draw_food(self, surface, theme, food_type, food_screen_x, food_screen_y):
+        """ Draw the food, themed based on world """
         food_rect = pygame.Rect(food_screen_x, food_screen_y, GRID_SIZE, GRID_SIZE)
 
-        if self.current_theme.name == "Hyrule Kingdom":
+        if theme.name == "Hyrule Kingdom":
             # Draw Master Sword for Zelda theme
-            self.draw_master_sword(food_x, food_y)
+            self.draw_master_sword(surface, food_screen_x, food_screen_y)
 
-        elif self.current_theme.name == "Ohana Island":
+        elif theme.name == "Ohana Island":
             # Draw Stitch (blue alien with big ears)
             stitch_blue = (65, 105, 225)
             dark_blue = (30, 60, 150)
 
             # Body (main circle)
-            pygame.draw.circle(self.screen, stitch_blue, food_rect.center, GRID_SIZE // 2 - 1)
+            pygame.draw.circle(surface, stitch_blue, food_rect.center, GRID_SIZE // 2 - 1)
 
             # Big black eyes
             eye_left = (food_screen_x + 5, food_screen_y + 8)
             eye_right = (food_screen_x + 15, food_screen_y + 8)
-            pygame.draw.circle(self.screen, BLACK, eye_left, 3)
-            pygame.draw.circle(self.screen, BLACK, eye_right, 3)
+            pygame.draw.circle(surface, BLACK, eye_left, 3)
+            pygame.draw.circle(surface, BLACK, eye_right, 3)
 
             # Ears (dark blue triangles on top)
             ear_left_points = [
@@ -1005,15 +1042,15 @@ class Game:
                 (food_screen_x + 20, food_screen_y - 3),
                 (food_screen_x + 17, food_screen_y + 2)
             ]
-            pygame.draw.polygon(self.screen, dark_blue, ear_left_points)
-            pygame.draw.polygon(self.screen, dark_blue, ear_right_points)
+            pygame.draw.polygon(surface, dark_blue, ear_left_points)
+            pygame.draw.polygon(surface, dark_blue, ear_right_points)
 
             # Nose (small pink)
-            pygame.draw.circle(self.screen, self.current_theme.food_color,
+            pygame.draw.circle(surface, theme.food_color,
                              (food_screen_x + 10, food_screen_y + 12), 2)
 
-        elif self.current_theme.name == "Kawaii Paradise":
-            if self.food.type == "bow":
+        elif theme.name == "Kawaii Paradise":
+            if food_type == "bow":
                 # Draw pink bow (1 point) - bigger with black outline
                 pink = (255, 105, 180)
                 dark_pink = (255, 20, 147)
@@ -1025,9 +1062,9 @@ class Game:
                     (food_screen_x + 8, food_screen_y + 10)
                 ]
                 # Draw black outline for left bow
-                pygame.draw.polygon(self.screen, BLACK, left_bow, 2)
+                pygame.draw.polygon(surface, BLACK, left_bow, 2)
                 # Fill left bow with pink
-                pygame.draw.polygon(self.screen, pink, left_bow)
+                pygame.draw.polygon(surface, pink, left_bow)
 
                 # Bow right side (bigger)
                 right_bow = [
@@ -1036,34 +1073,34 @@ class Game:
                     (food_screen_x + 18, food_screen_y + 12)
                 ]
                 # Draw black outline for right bow
-                pygame.draw.polygon(self.screen, BLACK, right_bow, 2)
+                pygame.draw.polygon(surface, BLACK, right_bow, 2)
                 # Fill right bow with pink
-                pygame.draw.polygon(self.screen, pink, right_bow)
+                pygame.draw.polygon(surface, pink, right_bow)
 
                 # Bow center (bigger)
-                pygame.draw.circle(self.screen, BLACK, food_rect.center, 4)  # Black outline
-                pygame.draw.circle(self.screen, dark_pink, food_rect.center, 3)  # Pink center
+                pygame.draw.circle(surface, BLACK, food_rect.center, 4)  # Black outline
+                pygame.draw.circle(surface, dark_pink, food_rect.center, 3)  # Pink center
 
-            elif self.food.type == "hellokitty":
+            elif food_type == "hellokitty":
                 # Draw Hello Kitty (2 points)
                 white = (255, 255, 255)
                 pink = (255, 105, 180)
                 yellow = (255, 215, 0)
 
                 # Black outline circle
-                pygame.draw.circle(self.screen, BLACK, food_rect.center, GRID_SIZE // 2, 2)
+                pygame.draw.circle(surface, BLACK, food_rect.center, GRID_SIZE // 2, 2)
 
                 # Head (white circle)
-                pygame.draw.circle(self.screen, white, food_rect.center, GRID_SIZE // 2 - 1)
+                pygame.draw.circle(surface, white, food_rect.center, GRID_SIZE // 2 - 1)
 
                 # Black eyes
                 eye_left = (food_screen_x + 6, food_screen_y + 9)
                 eye_right = (food_screen_x + 14, food_screen_y + 9)
-                pygame.draw.circle(self.screen, BLACK, eye_left, 2)
-                pygame.draw.circle(self.screen, BLACK, eye_right, 2)
+                pygame.draw.circle(surface, BLACK, eye_left, 2)
+                pygame.draw.circle(surface, BLACK, eye_right, 2)
 
                 # Yellow nose
-                pygame.draw.circle(self.screen, yellow,
+                pygame.draw.circle(surface, yellow,
                                  (food_screen_x + 10, food_screen_y + 12), 2)
 
                 # Ears (white triangles on top)
@@ -1077,22 +1114,354 @@ class Game:
                     (food_screen_x + 19, food_screen_y),
                     (food_screen_x + 17, food_screen_y + 4)
                 ]
-                pygame.draw.polygon(self.screen, white, ear_left_points)
-                pygame.draw.polygon(self.screen, white, ear_right_points)
+                pygame.draw.polygon(surface, white, ear_left_points)
+                pygame.draw.polygon(surface, white, ear_right_points)
 
                 # Pink bow on left ear
                 bow_center = (food_screen_x + 3, food_screen_y + 2)
-                pygame.draw.circle(self.screen, pink, bow_center, 3)
+                pygame.draw.circle(surface, pink, bow_center, 3)
 
         else:
             # Draw coin or mushroom for other themes
-            if self.food.food_type == "coin":
-                self.draw_coin(self.food.position, self.current_theme.food_color)
-            else:  # mushroom
-                self.draw_mushroom(self.food.position, self.current_theme.food_color)
+            if food_type == "coin":
+                self.draw_coin(surface, theme.food_color, food_screen_x, food_screen_y)
+            else:  # mushroom, always red in the Mario world
+                color = (255, 0, 0) if theme.name == "Super Mario World" else theme.food_color
+                self.draw_mushroom(surface, color, food_screen_x, food_screen_y)
+
+    def draw_snake_segment(self, surface, color, eye_color, screen_x, screen_y):
+        """ Draw one snake segment, the head is the one with eyes """
+        rect = pygame.Rect(screen_x, screen_y, GRID_SIZE - 2, GRID_SIZE - 2)
+        if eye_color is not None:
+            pygame.draw.rect(surface, color, rect, border_radius=5)
+            pygame.draw.circle(surface, eye_color, (screen_x + 5, screen_y + 5), 2)
+            pygame.draw.circle(surface, eye_color, (screen_x + GRID_SIZE - 7, screen_y + 5), 2)
+        else:
+            pygame.draw.rect(surface, color, rect, border_radius=3)
+
+    def sprite_atlas(self, theme):
+        """ Atlas with every sprite the theme can show """
+        if theme.name in self.atlases:
+            return self.atlases[theme.name]
+        atlas = SpriteAtlas()
+
+        # Head i lighter
+        eye_color = BLACK if theme.name != "Kawaii Paradise" else theme.food_color
+        atlas.add("head", lambda surface, x, y: self.draw_snake_segment(surface, theme.snake_color, eye_color, x, y))
+        # The body gets darker further back, down to half the brightness at segment 25
+        for i in range(1, SNAKE_SHADES + 1):
+            factor = max(0.5, 1 - (i * 0.02))
+            color = tuple(int(c * factor) for c in theme.snake_color)
+            atlas.add(("body", i), lambda surface, x, y, color=color: self.draw_snake_segment(surface, color, None, x, y))
+        atlas.add("rival_head", lambda surface, x, y: self.draw_snake_segment(surface, RIVAL_COLOR, BLACK, x, y))
+        atlas.add("rival_body", lambda surface, x, y: self.draw_snake_segment(surface, RIVAL_COLOR, None, x, y))
+
+        for food_type in ("coin", "mushroom", "bow", "hellokitty"):
+            atlas.add(("food", food_type),
+                      lambda surface, x, y, food_type=food_type: self.draw_food(surface, theme, food_type, x, y))
+        for frame in (0, 1):
+            atlas.add(("goomba", frame), lambda surface, x, y, frame=frame: self.draw_goomba(surface, frame, x, y))
+        for obstacle_type, color in [("palm", (255, 140, 0)), ("kuromi", (255, 105, 180))] + \
+                                    [("rupee", color) for color in RUPEE_COLORS]:
+            atlas.add((obstacle_type, color),
+                      lambda surface, x, y, obstacle_type=obstacle_type, color=color:
+                      self.draw_obstacle(surface, obstacle_type, color, x, y))
+
+        self.atlases[theme.name] = atlas
+        return atlas
+
+    def draw_background(self):
+        """ Draws the static background of the current theme """
+        # Background - fill game area only (below header)
+        game_area_rect = pygame.Rect(0, HEADER_HEIGHT, WINDOW_WIDTH, WINDOW_HEIGHT - HEADER_HEIGHT)
+
+        # Fill entire screen first with black
+        self.screen.fill(BLACK)
+
+        # Draw themed background decorations
+        if self.current_theme.name == "Super Mario World":
+            # Check if background image is loaded
+            if hasattr(self.current_theme, 'background_image') and self.current_theme.background_image is not None:
+                # Draw Mario background image - blit the portion below the header
+                source_rect = pygame.Rect(0, HEADER_HEIGHT, WINDOW_WIDTH, WINDOW_HEIGHT - HEADER_HEIGHT)
+                self.screen.blit(self.current_theme.background_image, (0, HEADER_HEIGHT), source_rect)
+            else:
+                # Fill game area with theme color if no image
+                pygame.draw.rect(self.screen, self.current_theme.bg_color, game_area_rect)
+                # Draw pixelated Mario mushrooms in corners (below header) - bigger size
+                self.draw_pixelated_mario_mushroom(15, HEADER_HEIGHT + 15, 50)
+                self.draw_pixelated_mario_mushroom(WINDOW_WIDTH - 65, HEADER_HEIGHT + 15, 50)
+                self.draw_pixelated_mario_mushroom(15, WINDOW_HEIGHT - 65, 50)
+                self.draw_pixelated_mario_mushroom(WINDOW_WIDTH - 65, WINDOW_HEIGHT - 65, 50)
+
+        elif self.current_theme.name == "Ohana Island":
+            # Check if background image is loaded
+            if hasattr(self.current_theme, 'background_image') and self.current_theme.background_image is not None:
+                # Draw Stitch background image - blit the portion below the header
+                source_rect = pygame.Rect(0, HEADER_HEIGHT, WINDOW_WIDTH, WINDOW_HEIGHT - HEADER_HEIGHT)
+                self.screen.blit(self.current_theme.background_image, (0, HEADER_HEIGHT), source_rect)
+            else:
+                # Fill game area with theme color if no image
+                pygame.draw.rect(self.screen, self.current_theme.bg_color, game_area_rect)
+                # Fallback to pixelated Stitch if images not loaded
+                self.draw_pixelated_stitch(15, HEADER_HEIGHT + 15, 50)
+                self.draw_pixelated_stitch(WINDOW_WIDTH - 65, HEADER_HEIGHT + 15, 50)
+                self.draw_pixelated_stitch(15, WINDOW_HEIGHT - 65, 50)
+                self.draw_pixelated_stitch(WINDOW_WIDTH - 65, WINDOW_HEIGHT - 65, 50)
+
+        elif self.current_theme.name == "Hyrule Kingdom":
+            # Fill game area with theme color
+            pygame.draw.rect(self.screen, self.current_theme.bg_color, game_area_rect)
+            # Draw Triforce symbols in corners (below header)
+            self.draw_triforce(50, HEADER_HEIGHT + 50, 15)
+            self.draw_triforce(WINDOW_WIDTH - 50, HEADER_HEIGHT + 50, 15)
+            self.draw_triforce(50, WINDOW_HEIGHT - 50, 15)
+            self.draw_triforce(WINDOW_WIDTH - 50, WINDOW_HEIGHT - 50, 15)
+
+            # Draw grass patches around the map
+            grass_positions = [(5, 10), (15, 8), (25, 12), (35, 9), (10, 25), (30, 22),
+                              (5, 20), (20, 5), (38, 15), (2, 28)]
+            for gx, gy in grass_positions:
+                self.draw_hyrule_grass(gx, gy)
+
+        elif self.current_theme.name == "Kawaii Paradise":
+            # Check if background image is loaded
+            if hasattr(self.current_theme, 'background_image') and self.current_theme.background_image is not None:
+                # Draw Hello Kitty background image - blit the portion below the header
+                source_rect = pygame.Rect(0, HEADER_HEIGHT, WINDOW_WIDTH, WINDOW_HEIGHT - HEADER_HEIGHT)
+                self.screen.blit(self.current_theme.background_image, (0, HEADER_HEIGHT), source_rect)
+            else:
+                # Fill game area with theme color if no image
+                pygame.draw.rect(self.screen, self.current_theme.bg_color, game_area_rect)
+
+        else:
+            # Default: fill game area with theme color (for Retro and any other themes)
+            pygame.draw.rect(self.screen, self.current_theme.bg_color, game_area_rect)
+
+    def draw_game(self, alpha=1.0):
+        """ Draws the game
+
+        alpha is how far the simulation has come towards the next tick, the
+        snake, obstacles and Goombas are drawn that far along from the cell
+        they were in at the last tick to the cell they are in now.
+        """
+        # The background never changes within a theme, draw it once and keep a copy
+        background = self.background_cache.get(self.current_theme.name)
+        if background is None:
+            self.draw_background()
+            self.background_cache[self.current_theme.name] = self.screen.copy()
+        else:
+            self.screen.blit(background, (0, 0))
+
+        # Only what is inside the view is drawn, so big boards cost the same as small ones
+        view = None
+        if self.scrolling():
+            self.update_camera(alpha)
+            camera_x, camera_y = self.camera
+            view = (camera_x // GRID_SIZE - 1, camera_y // GRID_SIZE - 1,
+                    (camera_x + VIEW_WIDTH) // GRID_SIZE + 1, (camera_y + VIEW_HEIGHT) // GRID_SIZE + 1)
+        else:
+            self.camera = (0, 0)
+            camera_x = camera_y = 0
+        # Boards smaller than the screen are framed in black
+        board_width = self.engine.width * GRID_SIZE
+        board_height = self.engine.height * GRID_SIZE
+        if board_width < VIEW_WIDTH:
+            self.screen.fill(BLACK, (board_width, HEADER_HEIGHT, WINDOW_WIDTH - board_width, WINDOW_HEIGHT))
+        if board_height < VIEW_HEIGHT:
+            self.screen.fill(BLACK, (0, HEADER_HEIGHT + board_height, WINDOW_WIDTH, WINDOW_HEIGHT))
+
+        atlas = self.sprite_atlas(self.current_theme)
+        for key, (x, y), previous in self.sprite_list(atlas, view):
+            if alpha < 1.0 and previous is not None and abs(x - previous[0]) + abs(y - previous[1]) == 1:
+                screen_x, screen_y = self.grid_to_screen(previous[0] + (x - previous[0]) * alpha,
+                                                         previous[1] + (y - previous[1]) * alpha)
+                atlas.blit(self.screen, key, round(screen_x) - camera_x, round(screen_y) - camera_y)
+            else:
+                screen_x, screen_y = self.grid_to_screen(x, y)
+                atlas.blit(self.screen, key, screen_x - camera_x, screen_y - camera_y)
+
+        if self.minimap is not None:
+            self.minimap.draw(self.screen, self.camera)
 
         # Draw header with score and theme name
-        self.draw_header()
+        self.screen.blit(self.header_surface(), HEADER_RECT)
+
+    def sprite_list(self, atlas, view=None):
+        """ (atlas key, cell, cell at the previous tick) of everything on the board, in drawing order
+
+        With a view (left, top, right, bottom) in cells, only what is inside it is listed.
+        """
+        sprites = []
+        previous_positions = self.previous_positions
+        if view is None:
+            def visible(position):
+                return True
+        else:
+            left, top, right, bottom = view
+            def visible(position):
+                return left <= position[0] <= right and top <= position[1] <= bottom
+
+        # Obstacles
+        for obstacle in self.obstacles:
+            key = self.obstacle_sprite(atlas, obstacle)
+            if visible(obstacle.position):
+                sprites.append((key, obstacle.position, previous_positions.get(obstacle, obstacle.position)))
+
+        # Goombas (Mario theme)
+        if self.current_theme and self.current_theme.name == "Super Mario World":
+            for goomba in self.goombas:
+                if visible(goomba.position):
+                    sprites.append((("goomba", goomba.animation_frame), goomba.position,
+                                    previous_positions.get(goomba, goomba.position)))
+
+        # Other players' snakes in a network game, where their tails were is not known
+        for snake in self.engine.rivals():
+            body = snake.body
+            for i, (position, previous) in enumerate(zip(body, chain(islice(body, 1, None), (None,)))):
+                if visible(position):
+                    sprites.append(("rival_head" if i == 0 else "rival_body", position, previous))
+
+        # Snake with gradient effect, every segment slides into the cell the one
+        # behind it is in now, and the last one from where the tail was
+        # (a network game has none until the player's snake first spawns)
+        if self.snake is not None:
+            body = self.snake.body
+            for i, (position, previous) in enumerate(zip(body, chain(islice(body, 1, None), (self.previous_tail,)))):
+                if visible(position):
+                    sprites.append(("head" if i == 0 else ("body", min(i, SNAKE_SHADES)), position, previous))
+
+        # Food (themed based on world), unless the board is full
+        if self.food.position is not None and visible(self.food.position):
+            sprites.append((("food", self.food.type), self.food.position, self.food.position))
+        return sprites
+
+    def obstacle_sprite(self, atlas, obstacle):
+        """ Atlas key of the obstacle, rendered into the atlas the first time it is seen """
+        key = (obstacle.type, obstacle.color)
+        if key not in atlas:
+            atlas.add(key, lambda surface, x, y: self.draw_obstacle(surface, obstacle.type, obstacle.color, x, y))
+        return key
+
+    def remember_positions(self):
+        """ Keep where everything is before a tick, to interpolate from
+
+        The rest of the snake's old cells are still in its body one segment
+        further back, so only the tail needs to be kept.
+        """
+        self.previous_tail = self.snake.body[-1] if self.snake is not None else None
+        self.previous_positions = {entity: entity.position for entity in self.obstacles + self.goombas}
+
+    def header_surface(self):
+        """ Header with score and theme name, re-rendered only when the score changes """
+        header_key = (self.current_theme.name, self.score)
+        if self.header_cache is None or self.header_cache[0] != header_key:
+            # Render on the screen, the header is on top of everything there anyway
+            self.draw_header()
+            self.header_cache = (header_key, self.screen.subsurface(HEADER_RECT).copy())
+        return self.header_cache[1]
+
+    def collect_changed_cells(self):
+        """ Pass the cells the engine changed on to the minimap and the dirty rects
+
+        The set belongs to the engine, which empties it at the start of every
+        step, and the autopilot reads it too, so it is only read here.
+        """
+        changed = self.engine.changed_cells
+        if self.minimap is not None:
+            self.minimap.update(changed)
+        if self.dirty_rects:
+            self.dirty_cells.update(changed)
+
+    def draw_game_dirty(self):
+        """ Draws the game by repainting only what changed since the last frame
+
+        The engine reports every cell it moved, spawned or removed something
+        in. On top of those only the first segments of the snake, whose
+        shading moves along with the head, and Goombas that changed their
+        animation frame are compared with the last frame. Only those cells
+        are restored from the cached background and redrawn, so a frame
+        costs the same however long the snake is.
+        Returns the screen rects to pass to pygame.display.update().
+        """
+        self.collect_changed_cells()
+        snake = self.snake
+        shaded = set(enumerate(islice(snake.body, SNAKE_SHADES + 1)))
+        mario = self.current_theme.name == "Super Mario World"
+        goombas = {(goomba.position, goomba.animation_frame) for goomba in self.goombas} if mario else set()
+        dirty_cells = self.dirty_cells
+        self.dirty_cells = set()
+        if self.drawn_sprites is None:
+            self.draw_game()
+            self.drawn_sprites = (shaded, goombas)
+            return [self.screen.get_rect()]
+
+        drawn_shaded, drawn_goombas = self.drawn_sprites
+        dirty_cells.update(cell for index, cell in shaded ^ drawn_shaded)
+        dirty_cells.update(cell for cell, frame in goombas ^ drawn_goombas)
+        self.drawn_sprites = (shaded, goombas)
+
+        rects = []
+        header_key = self.header_cache[0] if self.header_cache else None
+        header = self.header_surface()
+        if self.header_cache[0] != header_key:
+            rects.append(HEADER_RECT)
+
+        # Sprites can reach PADDING pixels outside their cell, so a padded cell
+        # only ever touches sprites in the cells right next to it. They are
+        # looked up cell by cell and drawn in the same order as in sprite_list()
+        atlas = self.sprite_atlas(self.current_theme)
+        by_cell = {}
+        for order, obstacle in enumerate(self.obstacles):
+            by_cell.setdefault(obstacle.position, []).append(((0, order), self.obstacle_sprite(atlas, obstacle)))
+        if mario:
+            for order, goomba in enumerate(self.goombas):
+                by_cell.setdefault(goomba.position, []).append(((1, order), ("goomba", goomba.animation_frame)))
+        shades = {}
+        for index, cell in shaded:
+            shades.setdefault(cell, []).append(index)
+        if self.food.position is not None:
+            by_cell.setdefault(self.food.position, []).append(((3, 0), ("food", self.food.type)))
+
+        def sprites_at(cell):
+            sprites = by_cell.get(cell, [])
+            if snake.occupies(cell):
+                # Segments further back all look the same and never overlap, their order doesn't matter
+                # (a head that ran into the body shares its cell)
+                indices = shades.get(cell, [])
+                indices = indices + [SNAKE_SHADES] * (snake.occupied[cell] - len(indices))
+                sprites = sprites + [((2, index), "head" if index == 0 else ("body", index)) for index in indices]
+            return [(order, key, cell) for order, key in sprites]
+
+        background = self.background_cache[self.current_theme.name]
+        padding = SpriteAtlas.PADDING
+        screen_rect = self.screen.get_rect()
+
+        for cell_x, cell_y in dirty_cells:
+            screen_x, screen_y = self.grid_to_screen(cell_x, cell_y)
+            rect = pygame.Rect(screen_x - padding, screen_y - padding,
+                               GRID_SIZE + 2 * padding, GRID_SIZE + 2 * padding).clip(screen_rect)
+            if not rect:
+                continue
+            self.screen.set_clip(rect)
+            self.screen.blit(background, rect, rect)
+            nearby = sorted(item for x in (cell_x - 1, cell_x, cell_x + 1) for y in (cell_y - 1, cell_y, cell_y + 1)
+                            for item in sprites_at((x, y)))
+            for order, key, cell in nearby:
+                atlas.blit(self.screen, key, *self.grid_to_screen(*cell))
+            if rect.colliderect(HEADER_RECT):
+                self.screen.blit(header, HEADER_RECT)
+            rects.append(rect)
+        self.screen.set_clip(None)
+        return rects
+
+    def draw_profiler(self):
+        """ Draws the profiler overlay, returns the screen rect it covers """
+        if self.profiler_surface is None or self.profiler.frame_count % PROFILE_REFRESH == 0:
+            if self.profiler_font is None:
+                self.profiler_font = pygame.font.Font(None, 20)
+            self.profiler_surface = self.profiler.render(self.profiler_font)
+        return self.screen.blit(self.profiler_surface, (10, HEADER_HEIGHT + 10))
 
     def draw_paused(self):
         """ Draws the paused screen """
@@ -1100,10 +1469,7 @@ class Game:
         self.draw_game()
 
         # Dark overlay
-        overlay = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
-        overlay.set_alpha(150)
-        overlay.fill(BLACK)
-        self.screen.blit(overlay, (0, 0))
+        self.screen.blit(self.overlays[150], (0, 0))
 
         # Paused text
         self.draw_text("PAUSED", (WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 - 40), color=self.current_theme.accent_color)
@@ -1121,13 +1487,11 @@ class Game:
         self.draw_game()
 
         # Dark overlay
-        overlay = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
-        overlay.set_alpha(180)
-        overlay.fill(BLACK)
-        self.screen.blit(overlay, (0, 0))
+        self.screen.blit(self.overlays[180], (0, 0))
 
-        # Game Over text
-        self.draw_text("GAME OVER!", (WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 - 60), color=self.current_theme.food_color)
+        # Game Over text (or win when the board is full)
+        title = "YOU WIN!" if self.engine.won else "GAME OVER!"
+        self.draw_text(title, (WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 - 60), color=self.current_theme.food_color)
 
         # Final score
         self.draw_text(f"Final Score: {self.score}", (WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2),
@@ -1142,106 +1506,21 @@ class Game:
 
     def reset_game(self):
         """ Resets the game """
-        self.snake.reset()
-        self.obstacles = []
-        self.obstacle_spawn_counter = 0
-        self.spawn_food()
-        self.score = 0
-        self.food_collected = 0
-        self.goombas = []
+        self.engine.reset(self.current_theme.name)
         self.paused = False
-
-    def spawn_food(self):
-        """ Spawn food based on current theme """
-        if self.current_theme and self.current_theme.name == "Kawaii Paradise":
-            # 70% chance for bow (10 points), 30% chance for Hello Kitty (10 points)
-            if random.random() < 0.7:
-                self.food = Food(food_type="bow")
-            else:
-                self.food = Food(food_type="hellokitty")
-        elif self.current_theme and self.current_theme.name == "Retro Classic":
-            # Only coins for Retro Classic Snake (no mushrooms)
-            self.food = Food(food_type="coin")
-        else:
-            # Coin/mushroom system for other themes (70% coin=1pt, 30% mushroom=2pt)
-            food_type = "coin" if random.random() < 0.7 else "mushroom"
-            self.food = Food(food_type=food_type)
-
-        self.food.generate_position(self.snake.body, self.obstacles)
-
-    def spawn_obstacle(self):
-        """ Spawn a random obstacle for themed worlds """
-        if self.current_theme and self.current_theme.name == "Ohana Island":
-            obstacle_type = "palm"  # Only palm trees
-            obstacle = Obstacle(obstacle_type, self.current_theme.accent_color)
-
-            # Make sure obstacle doesn't spawn on snake or food
-            attempts = 0
-            while attempts < 10:
-                if (obstacle.position not in self.snake.body and
-                    obstacle.position != self.food.position):
-                    self.obstacles.append(obstacle)
-                    break
-                obstacle.position = obstacle.generate_position()
-                attempts += 1
-
-            # Limit number of obstacles
-            if len(self.obstacles) > 5:
-                self.obstacles.pop(0)
-
-        elif self.current_theme and self.current_theme.name == "Kawaii Paradise":
-            obstacle_type = "kuromi"  # Only Kuromi
-            obstacle = Obstacle(obstacle_type, self.current_theme.accent_color)
-
-            # Make sure obstacle doesn't spawn on snake or food
-            attempts = 0
-            while attempts < 10:
-                if (obstacle.position not in self.snake.body and
-                    obstacle.position != self.food.position):
-                    self.obstacles.append(obstacle)
-                    break
-                obstacle.position = obstacle.generate_position()
-                attempts += 1
-
-            # Gradually increase max Kuromis based on food collected
-            # Start with 1, then add 1 more every 5 food items collected (max 5 Kuromis)
-            max_kuromis = min(5, 1 + (self.food_collected // 5))
-            if len(self.obstacles) > max_kuromis:
-                self.obstacles.pop(0)
-
-        elif self.current_theme and self.current_theme.name == "Hyrule Kingdom":
-            # Spawn rupees with different colors (green, blue, red, gold)
-            rupee_colors = [
-                (0, 255, 0),      # Green rupee
-                (0, 0, 255),      # Blue rupee
-                (255, 0, 0),      # Red rupee
-                (255, 215, 0)     # Gold rupee
-            ]
-            obstacle_type = "rupee"
-            rupee_color = random.choice(rupee_colors)
-            obstacle = Obstacle(obstacle_type, rupee_color)
-
-            # Make sure obstacle doesn't spawn on snake or food
-            attempts = 0
-            while attempts < 10:
-                if (obstacle.position not in self.snake.body and
-                    obstacle.position != self.food.position):
-                    self.obstacles.append(obstacle)
-                    break
-                obstacle.position = obstacle.generate_position()
-                attempts += 1
-
-            # Limit number of obstacles to 6 for Zelda world
-            if len(self.obstacles) > 6:
-                self.obstacles.pop(0)
-
-    def check_obstacle_collision(self):
-        """ Check if snake collides with any obstacle """
-        head = self.snake.body[0]
-        for obstacle in self.obstacles:
-            if head == obstacle.position:
-                return True
-        return False
+        self.remember_positions()
+        self.reset_minimap()
+        if self.record_dir is not None:
+            self.recording = Replay.from_engine(self.engine)
+
+    def save_recording(self):
+        """ Save the replay of the current session, if we are recording """
+        if self.recording is None:
+            return
+        os.makedirs(self.record_dir, exist_ok=True)
+        filename = f"{self.recording.theme_name.replace(' ', '_').lower()}_{self.recording.seed}.snkr"
+        self.recording.save(os.path.join(self.record_dir, filename))
+        self.recording = None
 
     def handle_menu_input(self, event):
         """ Handles input in the menu """
@@ -1250,6 +1529,7 @@ class Game:
                 theme_index = event.key - pygame.K_1
                 if theme_index < len(self.themes):
                     self.current_theme = self.themes[theme_index]
+                    self.current_theme.load_background(WINDOW_WIDTH, WINDOW_HEIGHT)
                     self.game_state = "playing"
                     self.reset_game()
 
@@ -1262,21 +1542,22 @@ class Game:
             elif event.key == pygame.K_ESCAPE:
                 if self.paused:
                     # Return to menu when paused
+                    self.save_recording()
                     self.game_state = "menu"
                     self.paused = False
                 else:
                     # Allow ESC to pause as well
                     self.paused = True
-            elif not self.paused:
-                # Only allow movement when not paused
+            elif not self.paused and self.autopilot is None:
+                # Only allow movement when not paused, and not while the autopilot steers
                 if event.key == pygame.K_UP or event.key == pygame.K_w:
-                    self.snake.change_direction(Direction.UP)
+                    self.snake.queue_direction(Direction.UP)
                 elif event.key == pygame.K_DOWN or event.key == pygame.K_s:
-                    self.snake.change_direction(Direction.DOWN)
+                    self.snake.queue_direction(Direction.DOWN)
                 elif event.key == pygame.K_LEFT or event.key == pygame.K_a:
-                    self.snake.change_direction(Direction.LEFT)
+                    self.snake.queue_direction(Direction.LEFT)
                 elif event.key == pygame.K_RIGHT or event.key == pygame.K_d:
-                    self.snake.change_direction(Direction.RIGHT)
+                    self.snake.queue_direction(Direction.RIGHT)
 
     def handle_game_over_input(self, event):
         """ Handles inputs on the game over-screen"""
@@ -1287,86 +1568,53 @@ class Game:
             elif event.key == pygame.K_ESCAPE:
                 self.game_state = "menu"
 
-    def spawn_goomba(self):
-        """Skapa en ny Goomba på en säker plats"""
-        goomba_positions = [g.position for g in self.goombas]
-
-        # Goombas börjar röra sig efter 15 block (5 + 3 + 3 + 3 + 3 = 17, så efter 4:e Goomban)
-        can_move = self.food_collected >= 15
-
-        new_goomba = Goomba(can_move=can_move)
-        new_goomba.generate_position(self.snake.body, self.food.position, goomba_positions)
-        self.goombas.append(new_goomba)
-
-        # Aktivera rörelse för alla Goombas när tröskeln nås
-        if can_move:
-            for goomba in self.goombas:
-                goomba.can_move = True
-
     def update(self):
         """ Updating game logic """
         if self.game_state == "playing" and not self.paused:
-            self.snake.move()
-
-            # Move obstacles
-            for obstacle in self.obstacles:
-                obstacle.move()
-
-            # Spawn obstacles for themed worlds
-            if self.current_theme and (self.current_theme.name == "Ohana Island" or
-                                       self.current_theme.name == "Kawaii Paradise" or
-                                       self.current_theme.name == "Hyrule Kingdom"):
-                self.obstacle_spawn_counter += 1
-                # Spawn rate depends on theme
-                spawn_rate = self.obstacle_spawn_rate
-                if self.current_theme.name == "Kawaii Paradise" and len(self.obstacles) == 0:
-                    # Spawn Kuromi immediately if none exists
-                    self.spawn_obstacle()
-                elif self.obstacle_spawn_counter >= spawn_rate:
-                    self.spawn_obstacle()
-                    self.obstacle_spawn_counter = 0
-
-            # Checks collisions with walls and self
-            if self.snake.check_collision():
+            if self.autopilot is not None:
+                direction = self.autopilot.next_direction()
+                if direction is not None:
+                    self.snake.change_direction(direction)
+            self.remember_positions()
+            alive = self.engine.step()
+            if self.recording is not None:
+                # The direction the snake moved in, after taking a queued turn
+                self.recording.record_step(self.snake.direction)
+            if not alive:
                 self.game_state = "game_over"
-                return
-
-            # Check collisions with obstacles (Stitch theme)
-            if self.check_obstacle_collision():
-                self.game_state = "game_over"
-                return
-
-            # Check Goomba collisions (Mario theme)
-            if self.current_theme and self.current_theme.name == "Super Mario World":
-                for goomba in self.goombas:
-                    if self.snake.body[0] == goomba.position:
-                        self.game_state = "game_over"
-                        return
-
-            # Check if the snake eats food
-            if self.snake.eat_food(self.food.position):
-                # Add points based on food type
-                self.score += self.food.points
-                self.food_collected += 1
-
-                # Spawn Goomba (Mario theme only)
-                # First at 5 blocks, then every 3rd (at 8, 11, 14, 17, etc.)
-                if self.current_theme and self.current_theme.name == "Super Mario World":
-                    if self.food_collected == 5 or (self.food_collected > 5 and (self.food_collected - 5) % 3 == 0):
-                        self.spawn_goomba()
-
-                # Spawn new food
-                self.spawn_food()
+                self.game_over_ticks = 0
+                self.save_recording()
+        elif self.game_state == "game_over":
+            # Goombas keep walking on the game over screen, everything stands still while paused
+            self.engine.update_goombas()
+            self.game_over_ticks += 1
+            if self.autopilot is not None and self.game_over_ticks >= AUTOPILOT_RESTART:
+                self.reset_game()
+                self.game_state = "playing"
+        self.collect_changed_cells()
 
     def run(self):
         """ Main game loop """
         running = True
+        accumulator = 0.0
+        previous_time = time.perf_counter()
+        # A scrolling board moves everything on every tick, nothing to gain from dirty rects
+        dirty_rects = self.dirty_rects and not self.scrolling()
+
+        profiler = self.profiler
 
         while running:
+            profiler.start_frame()
+
             # Handle events
-            for event in pygame.event.get():
+            events = pygame.event.get()
+            for event in events:
                 if event.type == pygame.QUIT:
                     running = False
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    self.show_profiler = not self.show_profiler
+                    self.drawn_sprites = None
+                    continue
 
                 if self.game_state == "menu":
                     self.handle_menu_input(event)
@@ -1374,27 +1622,232 @@ class Game:
                     self.handle_game_input(event)
                 elif self.game_state == "game_over":
                     self.handle_game_over_input(event)
-
-            # Updating game logic
-            self.update()
+            profiler.mark("events")
+
+            # Updating game logic, at a fixed tick rate however often frames are drawn
+            now = time.perf_counter()
+            accumulator += min(now - previous_time, MAX_FRAME_TIME)
+            previous_time = now
+            ticked = False
+            while accumulator >= TICK_TIME:
+                self.update()
+                accumulator -= TICK_TIME
+                ticked = True
+            profiler.mark("update")
 
             # Draw everything
-            if self.game_state == "menu":
+            rects = None
+            if dirty_rects and not ticked and not events:
+                # Nothing can have changed since the last frame
+                rects = []
+            elif self.game_state == "menu":
                 self.draw_menu()
+                profiler.mark("draw_menu")
             elif self.game_state == "playing":
                 if self.paused:
                     self.draw_paused()
+                    profiler.mark("draw_paused")
+                elif dirty_rects:
+                    rects = self.draw_game_dirty()
+                    profiler.mark("draw_game_dirty")
                 else:
-                    self.draw_game()
+                    self.draw_game(accumulator / TICK_TIME)
+                    profiler.mark("draw_game")
             elif self.game_state == "game_over":
                 self.draw_game_over()
+                profiler.mark("draw_game_over")
+
+            if self.show_profiler and rects != []:
+                hud_rect = self.draw_profiler()
+                if rects is not None:
+                    rects.append(hud_rect)
+                profiler.mark("hud")
+
+            if rects is None:
+                # Full frame, the next dirty frame has to start over from scratch
+                self.drawn_sprites = None
+                pygame.display.flip()
+            else:
+                pygame.display.update(rects)
+            profiler.mark("flip")
+            self.clock.tick(RENDER_FPS)
+            profiler.mark("sleep")
+            profiler.end_frame(snake=len(self.snake.body), obstacles=len(self.obstacles), goombas=len(self.goombas))
+
+        if self.profile_path is not None:
+            self.profiler.export(self.profile_path)
+        self.save_recording()
+        pygame.quit()
+        sys.exit()
 
+    def run_replay(self, replay):
+        """ Watch a recorded session
+
+        SPACE pauses, LEFT/RIGHT jump 100 ticks, PAGE UP/DOWN jump 1000,
+        HOME/END go to the start/end and +/- change the playback speed.
+        Only the frames that are shown get drawn, skipped ticks are just
+        simulated.
+        """
+        player = ReplayPlayer(replay)
+        self.engine = player.engine
+        self.current_theme = next(theme for theme in self.themes if theme.name == replay.theme_name)
+        self.current_theme.load_background(WINDOW_WIDTH, WINDOW_HEIGHT)
+        self.game_state = "playing"
+        self.remember_positions()
+        self.reset_minimap()
+        speed = 1  # Ops per frame
+        playing = True
+        running = True
+
+        while running:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE:
+                        running = False
+                    elif event.key == pygame.K_SPACE:
+                        playing = not playing
+                    elif event.key == pygame.K_RIGHT:
+                        player.seek(player.tick + 100)
+                    elif event.key == pygame.K_LEFT:
+                        player.seek(player.tick - 100)
+                    elif event.key == pygame.K_PAGEUP:
+                        player.seek(player.tick + 1000)
+                    elif event.key == pygame.K_PAGEDOWN:
+                        player.seek(player.tick - 1000)
+                    elif event.key == pygame.K_HOME:
+                        player.seek(0)
+                    elif event.key == pygame.K_END:
+                        player.seek(player.num_ticks)
+                    elif event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+                        speed = min(speed * 2, 1024)
+                    elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                        speed = max(1, speed // 2)
+
+            if playing and not player.at_end():
+                player.advance(speed)
+            if self.minimap is not None:
+                # Seeking swaps the whole board, cheaper to repaint than to track
+                self.minimap.rebuild()
+
+            self.draw_game()
+            self.draw_text(f"REPLAY  tick {player.tick}/{player.num_ticks}  x{speed}",
+                           (WINDOW_WIDTH // 2, WINDOW_HEIGHT - 20), font=self.small_font)
             pygame.display.flip()
             self.clock.tick(FPS)
 
         pygame.quit()
         sys.exit()
 
+    def run_client(self, remote):
+        """ Play in a room of snake_server
+
+        The server runs the game, this only sends turns and draws the room,
+        interpolated between ticks like in run(). A dead snake stays where
+        it died until the server brings it back. ESC leaves.
+        """
+        key_directions = {
+            pygame.K_UP: Direction.UP, pygame.K_w: Direction.UP,
+            pygame.K_DOWN: Direction.DOWN, pygame.K_s: Direction.DOWN,
+            pygame.K_LEFT: Direction.LEFT, pygame.K_a: Direction.LEFT,
+            pygame.K_RIGHT: Direction.RIGHT, pygame.K_d: Direction.RIGHT
+        }
+        view = remote.view
+        self.engine = view
+        self.game_state = "playing"
+        received = time.perf_counter()
+        running = True
+
+        while running:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE:
+                        running = False
+                    elif event.key in key_directions and view.alive:
+                        remote.turn(key_directions[event.key])
+
+            try:
+                messages = remote.receive()
+            except ConnectionError:
+                messages = []
+                running = False
+            for kind, payload in messages:
+                self.remember_positions()
+                view.apply(kind, payload)
+                received = time.perf_counter()
+
+            if view.theme_name is None:
+                self.screen.fill(BLACK)
+                self.draw_text("Connecting...", (WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
+            else:
+                if self.current_theme is None or self.current_theme.name != view.theme_name:
+                    self.current_theme = next(theme for theme in self.themes if theme.name == view.theme_name)
+                    self.current_theme.load_background(WINDOW_WIDTH, WINDOW_HEIGHT)
+                self.draw_game(min(1.0, (time.perf_counter() - received) / TICK_TIME))
+                status = f"{len(view.snakes)} snakes in the room"
+                if not view.alive:
+                    status = "Waiting to respawn...  " + status
+                self.draw_text(status, (WINDOW_WIDTH // 2, WINDOW_HEIGHT - 20), font=self.small_font)
+            pygame.display.flip()
+            self.clock.tick(RENDER_FPS)
+
+        remote.close()
+        pygame.quit()
+        sys.exit()
+
+def main():
+    parser = argparse.ArgumentParser(description="Snake - Theme worlds")
+    parser.add_argument("--record", metavar="DIR", help="save a replay of every session in DIR")
+    parser.add_argument("--replay", metavar="FILE", help="watch a recorded session")
+    parser.add_argument("--dirty-rects", action="store_true",
+                        help="only repaint and update the parts of the screen that changed (for slow machines)")
+    parser.add_argument("--no-prefetch", action="store_true",
+                        help="load theme backgrounds only when a world is chosen")
+    parser.add_argument("--board", metavar="WxH", type=board_size,
+                        help=f"board size in cells, default {GRID_WIDTH}x{GRID_HEIGHT}; bigger boards scroll")
+    parser.add_argument("--autopilot", action="store_true",
+                        help="let the autopilot play the chosen world and start over when it dies (attract mode)")
+    parser.add_argument("--hunting", action="store_true",
+                        help="Goombas and obstacles chase the snake instead of wandering")
+    parser.add_argument("--connect", metavar="HOST[:PORT]", help="play in a room of a snake_server.py server")
+    parser.add_argument("--room", default="lobby", help="room to join with --connect (default lobby)")
+    parser.add_argument("--world", type=int, choices=range(1, len(THEME_NAMES) + 1), default=1,
+                        help="world of the room if --connect creates it, numbered as in the menu (default 1)")
+    parser.add_argument("--profile-frames", metavar="FILE",
+                        help="write per-frame timings of the main loop to FILE (.csv or .json) on exit")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="time each startup phase up to the first menu frame, then exit")
+    args = parser.parse_args()
+
+    remote = None
+    if args.connect:
+        # Only network games need asyncio and sockets, keep them out of the normal startup
+        from snake_server import DEFAULT_PORT, RemoteRoom
+        host, _, port = args.connect.partition(":")
+        try:
+            remote = RemoteRoom(host, int(port) if port else DEFAULT_PORT, args.room, THEME_NAMES[args.world - 1])
+        except (ValueError, OSError) as error:
+            parser.error(f"can't connect to {args.connect}: {error}")
+
+    game = Game(record_dir=args.record, dirty_rects=args.dirty_rects, prefetch=not args.no_prefetch,
+                board_size=args.board, profile_path=args.profile_frames, autopilot=args.autopilot,
+                hunting=args.hunting)
+    if args.profile_startup:
+        game.draw_menu()
+        pygame.display.flip()
+        game.startup.mark("first frame")
+        within_budget = game.startup.report()
+        pygame.quit()
+        sys.exit(0 if within_budget else 1)
+    if remote is not None:
+        game.run_client(remote)
+    elif args.replay:
+        game.run_replay(Replay.load(args.replay))
+    else:
+        game.run()
+
 if __name__ == "__main__":
-    game = Game()
-    game.run()
+    main()
@@ -0,0 +1,226 @@
+"""
+Compact replay recording: seed + theme + one packed input per tick
+
+File layout (little endian):
+  header  - magic b"SNKR", version (u8), theme index (u8), seed (u64),
+            number of ops (u32), board width and height (u16 each),
+            flags (u8, bit 0 = hunting enemies)
+            (version 1 files have no board size and use the default board,
+            version 2 files have no flags, and files before version 4 are
+            played back with the spawn RNG draws of their time, see
+            SnakeEngine's legacy_spawns)
+  ops     - one 4 bit op per tick, two per byte, low nibble first
+            0-3 = SnakeEngine.step() with direction UP, DOWN, LEFT, RIGHT
+            4   = SnakeEngine.update_goombas() only (paused frames, which
+                  only recordings from before Goombas froze on pause have)
+"""
+
+import argparse
+import struct
+from array import array
+from snake_engine import GRID_WIDTH, GRID_HEIGHT, THEME_NAMES, Direction, SnakeEngine
+
+MAGIC = b"SNKR"
+VERSION = 4
+LEGACY_SPAWNS = 3  # Last version recorded with the old spawn RNG draws
+HEADER_V1 = struct.Struct("<4sBBQI")
+HEADER_V2 = struct.Struct("<4sBBQIHH")
+HEADER = struct.Struct("<4sBBQIHHB")
+HUNTING = 0x01
+
+DIRECTIONS = (Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT)
+GOOMBA_FRAME = 4
+
+# Byte translation tables for packing and unpacking nibbles
+LOW_NIBBLE = bytes(i & 0x0F for i in range(256))
+HIGH_NIBBLE = bytes(i >> 4 for i in range(256))
+TO_HIGH_NIBBLE = bytes((i << 4) & 0xFF for i in range(256))
+
+class ReplayError(Exception):
+    """ Raised for files that are not valid replays """
+
+class Replay:
+    """ Recorded session that can be re-simulated bit for bit """
+    def __init__(self, theme_name, seed, ops=None, width=GRID_WIDTH, height=GRID_HEIGHT, hunting=False,
+                 version=VERSION):
+        self.theme_name = theme_name
+        self.seed = seed
+        self.width = width
+        self.height = height
+        self.hunting = hunting
+        self.version = version  # File version it was recorded with
+        self.ops = bytearray(ops or b"")  # One op per byte while in memory
+
+    @classmethod
+    def from_engine(cls, engine):
+        """ Start recording the session the engine was just reset to """
+        return cls(engine.theme_name, engine.seed, width=engine.width, height=engine.height,
+                   hunting=engine.hunting)
+
+    def record_step(self, direction):
+        """ Record one engine tick taken with the given snake direction """
+        self.ops.append(DIRECTIONS.index(direction))
+
+    def record_goomba_frame(self):
+        """ Record a frame where only the Goombas were updated """
+        self.ops.append(GOOMBA_FRAME)
+
+    @property
+    def ticks(self):
+        """ Number of engine ticks in the recording """
+        return len(self.ops) - self.ops.count(GOOMBA_FRAME)
+
+    def new_engine(self):
+        """ Engine reset to the start of the recorded session """
+        return SnakeEngine(self.theme_name, self.seed, self.width, self.height, self.hunting,
+                           legacy_spawns=self.version <= LEGACY_SPAWNS)
+
+    def apply(self, engine, op):
+        """ Replay a single op on the engine """
+        if op == GOOMBA_FRAME:
+            engine.update_goombas()
+        else:
+            # Set the recorded direction as is, it is the one the snake moved in
+            # after any queued turn was taken
+            engine.snake.direction = DIRECTIONS[op]
+            engine.step()
+
+    def play(self, engine=None):
+        """ Re-simulate the whole session and return the final engine """
+        if engine is None:
+            engine = self.new_engine()
+        for op in self.ops:
+            self.apply(engine, op)
+        return engine
+
+    def to_bytes(self):
+        """ Pack the replay into the file format """
+        ops = self.ops + b"\x00" if len(self.ops) % 2 else self.ops
+        # OR the two halves together as big integers instead of byte by byte
+        low = int.from_bytes(ops[0::2], "little")
+        high = int.from_bytes(ops[1::2].translate(TO_HIGH_NIBBLE), "little")
+        packed = (low | high).to_bytes(len(ops) // 2, "little")
+        # Old recordings keep a version that plays them back with the old spawns
+        version = VERSION if self.version > LEGACY_SPAWNS else LEGACY_SPAWNS
+        header = HEADER.pack(MAGIC, version, THEME_NAMES.index(self.theme_name), self.seed, len(self.ops),
+                             self.width, self.height, HUNTING if self.hunting else 0)
+        return header + packed
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Unpack a replay from the file format """
+        if len(data) < HEADER_V1.size:
+            raise ReplayError("Replay is too short")
+        magic, version, theme_index, seed, num_ops = HEADER_V1.unpack_from(data)
+        if magic != MAGIC:
+            raise ReplayError("Not a replay file")
+        header = {1: HEADER_V1, 2: HEADER_V2, 3: HEADER, VERSION: HEADER}.get(version)
+        if header is None:
+            raise ReplayError(f"Unsupported replay version {version}")
+        if len(data) < header.size:
+            raise ReplayError("Replay is too short")
+        fields = header.unpack_from(data)
+        width, height = fields[5:7] if version >= 2 else (GRID_WIDTH, GRID_HEIGHT)
+        flags = fields[7] if version >= 3 else 0
+        if theme_index >= len(THEME_NAMES):
+            raise ReplayError(f"Unknown theme index {theme_index}")
+        if width == 0 or height == 0:
+            raise ReplayError(f"Invalid board size {width}x{height}")
+        packed = data[header.size:]
+        if len(packed) * 2 < num_ops:
+            raise ReplayError("Replay is truncated")
+
+        ops = bytearray(len(packed) * 2)
+        ops[0::2] = packed.translate(LOW_NIBBLE)
+        ops[1::2] = packed.translate(HIGH_NIBBLE)
+        return cls(THEME_NAMES[theme_index], seed, ops[:num_ops], width, height, bool(flags & HUNTING),
+                   version)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+class ReplayPlayer:
+    """ Headless playback of a replay that can jump to any tick
+
+    A snapshot of the engine is kept every keyframe_interval ops while
+    playing, so seeking restores the nearest earlier keyframe and only
+    re-simulates the ops after it. Nothing is rendered here, the caller
+    draws whatever tick it wants to show.
+    """
+    def __init__(self, replay, keyframe_interval=1000):
+        self.replay = replay
+        self.keyframe_interval = keyframe_interval
+        self.engine = replay.new_engine()
+        self.position = 0  # Index of the next op to apply
+        self.keyframes = {0: self.engine.snapshot()}
+        # Op index of every engine tick, to translate ticks into ops
+        self.step_ops = array('I', (i for i, op in enumerate(replay.ops) if op != GOOMBA_FRAME))
+
+    @property
+    def tick(self):
+        return self.engine.ticks
+
+    @property
+    def num_ticks(self):
+        return len(self.step_ops)
+
+    def at_end(self):
+        return self.position >= len(self.replay.ops)
+
+    def advance(self, num_ops=1):
+        """ Apply the next ops, storing keyframes on the way """
+        ops = self.replay.ops
+        stop = min(len(ops), self.position + num_ops)
+        while self.position < stop:
+            self.replay.apply(self.engine, ops[self.position])
+            self.position += 1
+            if self.position % self.keyframe_interval == 0 and self.position not in self.keyframes:
+                self.keyframes[self.position] = self.engine.snapshot()
+
+    def seek_op(self, position):
+        """ Move to just before op number position """
+        position = max(0, min(position, len(self.replay.ops)))
+        if position < self.position or position - self.position > self.keyframe_interval:
+            # Start from the closest keyframe at or before the target
+            keyframe = position - position % self.keyframe_interval
+            while keyframe not in self.keyframes:
+                keyframe -= self.keyframe_interval
+            if keyframe > self.position or position < self.position:
+                self.engine.restore(self.keyframes[keyframe])
+                self.position = keyframe
+        self.advance(position - self.position)
+
+    def seek(self, tick):
+        """ Move to the state right after engine tick number tick """
+        tick = max(0, min(tick, self.num_ticks))
+        self.seek_op(0 if tick == 0 else self.step_ops[tick - 1] + 1)
+
+    def build_index(self):
+        """ Play to the end once so every later seek starts from a keyframe """
+        position = self.position
+        self.advance(len(self.replay.ops) - self.position)
+        self.seek_op(position)
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-simulate a recorded Snake session")
+    parser.add_argument("replay", help="replay file (.snkr)")
+    args = parser.parse_args()
+
+    replay = Replay.load(args.replay)
+    engine = replay.play()
+    print(f"Theme: {replay.theme_name}")
+    print(f"Seed: {replay.seed}")
+    print(f"Board: {replay.width}x{replay.height}")
+    print(f"Hunting enemies: {'yes' if replay.hunting else 'no'}")
+    print(f"Ticks: {replay.ticks}")
+    print(f"Score: {engine.score}")
+    print(f"Ended by: {engine.death_cause or 'still running'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Run headless games across a process pool and collect statistics per theme
+"""
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from snake_autopilot import autopilot_policy
+from snake_engine import THEME_NAMES, Direction, SnakeEngine
+
+# How a game ended, stored as an index in the result buffer
+DEATH_CAUSES = ("timeout", "wall", "self", "obstacle", "goomba", "full")
+
+# One row per game in the shared result buffer
+RESULT_DTYPE = np.dtype([
+    ("theme", np.uint8),
+    ("score", np.int32),
+    ("length", np.int32),
+    ("ticks", np.int32),
+    ("death", np.uint8)
+])
+
+def random_policy(engine):
+    """ Turn in a random direction now and then, using the game's own RNG """
+    if engine.rng.random() < 0.1:
+        return engine.rng.choice(list(Direction))
+    return None
+
+def greedy_policy(engine):
+    """ Step towards the food, avoiding cells that are taken right now """
+    head_x, head_y = engine.snake.body[0]
+    food = engine.food.position
+    best = None
+    for direction in Direction:
+        dx, dy = direction.value
+        pos = (head_x + dx, head_y + dy)
+        if not engine.free_cells.inside(pos):
+            continue
+        if not engine.free_cells.is_free(pos) and pos != food:
+            continue
+        distance = abs(pos[0] - food[0]) + abs(pos[1] - food[1])
+        if best is None or distance < best[0]:
+            best = (distance, direction)
+    return best[1] if best else None
+
+POLICIES = {"random": random_policy, "greedy": greedy_policy, "autopilot": autopilot_policy}
+
+def play_game(theme_name, policy, seed, max_ticks):
+    """ Play one headless game, returns (score, length, ticks, death cause) """
+    engine = SnakeEngine(theme_name, seed)
+    while engine.ticks < max_ticks:
+        direction = policy(engine)
+        if direction is not None:
+            engine.snake.change_direction(direction)
+        if not engine.step():
+            break
+    cause = engine.death_cause if engine.game_over else "timeout"
+    return engine.score, len(engine.snake.body), engine.ticks, cause
+
+def _run_chunk(shm_name, num_games, start, stop, games_per_theme, policy_name, seed, max_ticks):
+    """ Worker: play games start..stop and write them into the shared buffer """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        results = np.ndarray((num_games,), dtype=RESULT_DTYPE, buffer=shm.buf)
+        policy = POLICIES[policy_name]
+        for game in range(start, stop):
+            theme_index = game // games_per_theme
+            score, length, ticks, cause = play_game(
+                THEME_NAMES[theme_index], policy, seed + game, max_ticks)
+            results[game] = (theme_index, score, length, ticks, DEATH_CAUSES.index(cause))
+        del results
+    finally:
+        shm.close()
+    return stop - start
+
+def summarize(results):
+    """ Aggregate score/length/death-cause statistics per theme """
+    summary = {}
+    for theme_index, theme_name in enumerate(THEME_NAMES):
+        rows = results[results["theme"] == theme_index]
+        if len(rows) == 0:
+            continue
+        deaths = np.bincount(rows["death"], minlength=len(DEATH_CAUSES))
+        summary[theme_name] = {
+            "games": int(len(rows)),
+            "mean_score": float(rows["score"].mean()),
+            "max_score": int(rows["score"].max()),
+            "mean_length": float(rows["length"].mean()),
+            "mean_ticks": float(rows["ticks"].mean()),
+            "deaths": {cause: int(count) for cause, count in zip(DEATH_CAUSES, deaths) if count}
+        }
+    return summary
+
+def run_rollouts(games_per_theme, policy_name="greedy", workers=None, seed=0, max_ticks=10000):
+    """ Play games_per_theme games on every theme in parallel, returns the summary
+
+    Game number i always uses seed + i, so results do not depend on the
+    number of workers or how the games are scheduled.
+    """
+    if games_per_theme < 1:
+        raise ValueError("games_per_theme must be at least 1")
+    workers = workers or os.cpu_count() or 1
+    num_games = games_per_theme * len(THEME_NAMES)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, num_games * RESULT_DTYPE.itemsize))
+    try:
+        # A few chunks per worker keeps all cores busy when chunks take different time
+        num_chunks = min(num_games, workers * 4)
+        bounds = [num_games * i // num_chunks for i in range(num_chunks + 1)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_run_chunk, shm.name, num_games, start, stop,
+                            games_per_theme, policy_name, seed, max_ticks)
+                for start, stop in zip(bounds, bounds[1:]) if stop > start
+            ]
+            for future in futures:
+                future.result()
+        results = np.ndarray((num_games,), dtype=RESULT_DTYPE, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return summarize(results)
+
+def positive_int(text):
+    """ Parse a count of at least 1 for argparse """
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a number, got {text!r}")
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+def main():
+    parser = argparse.ArgumentParser(description="Run headless Snake games on all cores")
+    parser.add_argument("--games", type=positive_int, default=100, help="games per theme")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="greedy")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-ticks", type=int, default=10000)
+    args = parser.parse_args()
+
+    summary = run_rollouts(args.games, args.policy, args.workers, args.seed, args.max_ticks)
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
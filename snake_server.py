@@ -0,0 +1,630 @@
+"""
+Authoritative multiplayer server: rooms with one snake per player on a shared board
+
+Every room runs a MultiSnakeEngine at the game's tick rate, all rooms on a
+single asyncio event loop. After each tick a room encodes what changed
+once and sends the same bytes to all of its clients. Clients only send
+their turns, and keep a RoomView that the game draws like a local session.
+
+Messages are a payload length (u32) and a type (u8), then the payload,
+all little endian:
+  client -> server
+    JOIN      theme index (u8) + room name (utf-8), the theme is used if
+              the room is new
+    TURN      direction (u8, 0-3 = UP, DOWN, LEFT, RIGHT)
+  server -> client
+    WELCOME   player id (u16)
+    KEYFRAME  tick (u32), theme index (u8), board width and height (u16),
+              then records for the whole room; sent on joining and when
+              a full board starts over
+    DELTA     tick (u32), then records for what changed during the tick
+
+Records start with a tag (u8), cells are x, y (i16 each):
+    MOVE      player id (u16), direction | 4 if the snake grew (u8): the
+              head moved one cell that way and the tail followed
+    SPAWN     player id (u16), direction (u8), length (u32), cells: a
+              snake appeared or has to be replaced as a whole
+    REMOVE    player id (u16), cause (u8): a snake died, cause 0 means
+              the player left and its score goes too
+    SCORE     player id (u16), score (u32)
+    FOOD      cell (-1, -1 when the board is full), type (u8)
+    OBSTACLE  index (u16), type (u8), red, green, blue (u8), cell
+    GOOMBA    index (u16), cell, animation frame (u8)
+    COUNTS    number of obstacles and Goombas (u16 each), comes before
+              their records; the lists are cut or padded to this length
+
+A snake that moved costs four bytes a tick however long it is, so a
+delta is a few dozen bytes whatever the size of the board.
+"""
+
+import argparse
+import asyncio
+import random
+import socket
+import struct
+import sys
+import time
+from collections import deque
+from snake_engine import (
+    GRID_WIDTH, GRID_HEIGHT, MAX_BOARD_SIZE, THEME_NAMES, Direction, Food, Goomba, Obstacle, Snake,
+    MultiSnakeEngine, board_size
+)
+
+FPS = 10  # Ticks per second, the same as the game
+TICK_TIME = 1 / FPS
+RESPAWN_TICKS = 2 * FPS  # Ticks a dead player waits before getting a new snake
+# Bytes in one message: 4 per cell for a keyframe of the biggest board full of
+# snakes, plus room for the food, obstacle, Goomba, spawn and score records
+MAX_MESSAGE = 4 * MAX_BOARD_SIZE ** 2 + (1 << 20)
+MAX_CLIENT_MESSAGE = 256  # Bytes in one message from a client
+MAX_BACKLOG = 1 << 20  # Bytes waiting to be sent to a client, on top of a keyframe, before it is dropped as too slow
+DEFAULT_PORT = 5555
+
+# Message types
+JOIN, TURN, WELCOME, KEYFRAME, DELTA = range(1, 6)
+# Record tags
+MOVE, SPAWN, REMOVE, SCORE, FOOD, OBSTACLE, GOOMBA, COUNTS = range(1, 9)
+
+MESSAGE_HEADER = struct.Struct("<IB")
+WELCOME_MESSAGE = struct.Struct("<H")
+KEYFRAME_HEADER = struct.Struct("<IBHH")
+DELTA_HEADER = struct.Struct("<I")
+MOVE_RECORD = struct.Struct("<BHB")
+SPAWN_RECORD = struct.Struct("<BHBI")
+REMOVE_RECORD = struct.Struct("<BHB")
+SCORE_RECORD = struct.Struct("<BHI")
+FOOD_RECORD = struct.Struct("<BhhB")
+OBSTACLE_RECORD = struct.Struct("<BHBBBBhh")
+GOOMBA_RECORD = struct.Struct("<BHhhB")
+COUNTS_RECORD = struct.Struct("<BHH")
+
+DIRECTIONS = (Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT)
+GREW = 4
+LEFT_ROOM = 0
+CAUSES = (None, "wall", "self", "snake", "obstacle", "goomba")  # Index 0 is LEFT_ROOM
+FOOD_TYPES = ("coin", "mushroom", "bow", "hellokitty")
+OBSTACLE_TYPES = ("palm", "surfboard", "kuromi", "rupee")
+
+class ProtocolError(Exception):
+    """ Raised for messages that don't follow the protocol """
+
+def pack_message(kind, payload=b""):
+    return MESSAGE_HEADER.pack(len(payload), kind) + payload
+
+def join_message(room_name, theme_name):
+    return pack_message(JOIN, bytes((THEME_NAMES.index(theme_name),)) + room_name.encode())
+
+def turn_message(direction):
+    return pack_message(TURN, bytes((DIRECTIONS.index(direction),)))
+
+async def read_message(reader, limit=MAX_MESSAGE):
+    """ Next (type, payload) from an asyncio stream """
+    length, kind = MESSAGE_HEADER.unpack(await reader.readexactly(MESSAGE_HEADER.size))
+    if length > limit:
+        raise ProtocolError(f"Message of {length} bytes is too long")
+    return kind, await reader.readexactly(length)
+
+class MessageReader:
+    """ Splits a byte stream that arrives in arbitrary pieces into messages """
+    def __init__(self, limit=MAX_MESSAGE):
+        self.limit = limit
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """ Add received bytes, returns the (type, payload) of every message they complete """
+        self.buffer += data
+        messages = []
+        offset = 0
+        while len(self.buffer) - offset >= MESSAGE_HEADER.size:
+            length, kind = MESSAGE_HEADER.unpack_from(self.buffer, offset)
+            if length > self.limit:
+                raise ProtocolError(f"Message of {length} bytes is too long")
+            end = offset + MESSAGE_HEADER.size + length
+            if end > len(self.buffer):
+                break
+            messages.append((kind, bytes(self.buffer[offset + MESSAGE_HEADER.size:end])))
+            offset = end
+        del self.buffer[:offset]
+        return messages
+
+def pack_cells(cells):
+    flat = [value for cell in cells for value in cell]
+    return struct.pack(f"<{len(flat)}h", *flat)
+
+class DeltaEncoder:
+    """ Encodes what changed in a room since the last call, as records
+
+    It remembers what the clients were last sent: each snake and its
+    length, the scores, the food, and every obstacle and Goomba. Snakes are
+    compared by length only, since they move exactly one cell per tick.
+    A fresh encoder has sent nothing, so its first records are the whole
+    room, which is how keyframes are made.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.snakes = {}  # Player id -> (Snake, length)
+        self.scores = {}
+        self.food = None
+        self.obstacles = []
+        self.goombas = []
+
+    def keyframe(self):
+        """ The whole room, leaves what this encoder has sent alone """
+        engine = self.engine
+        header = KEYFRAME_HEADER.pack(engine.ticks, THEME_NAMES.index(engine.theme_name), engine.width, engine.height)
+        return header + DeltaEncoder(engine).records()
+
+    def delta(self):
+        """ What changed since the last delta, call once after every tick """
+        return DELTA_HEADER.pack(self.engine.ticks) + self.records()
+
+    def records(self):
+        engine = self.engine
+        parts = []
+
+        removed = set()
+        for player_id in list(self.snakes):
+            if player_id not in engine.snakes or engine.snakes[player_id] is not self.snakes[player_id][0]:
+                del self.snakes[player_id]
+                if player_id not in engine.snakes:
+                    cause = engine.deaths.get(player_id) if player_id in engine.scores else None
+                    parts.append(REMOVE_RECORD.pack(REMOVE, player_id, CAUSES.index(cause)))
+                    removed.add(player_id)
+        for player_id in list(self.scores):
+            if player_id not in engine.scores:
+                del self.scores[player_id]
+                if player_id not in removed:
+                    parts.append(REMOVE_RECORD.pack(REMOVE, player_id, LEFT_ROOM))
+
+        for player_id, snake in engine.snakes.items():
+            known = self.snakes.get(player_id)
+            direction = DIRECTIONS.index(snake.direction)
+            if known is not None:
+                grew = GREW if len(snake.body) > known[1] else 0
+                parts.append(MOVE_RECORD.pack(MOVE, player_id, direction | grew))
+            else:
+                parts.append(SPAWN_RECORD.pack(SPAWN, player_id, direction, len(snake.body)))
+                parts.append(pack_cells(snake.body))
+            self.snakes[player_id] = (snake, len(snake.body))
+        for player_id, score in engine.scores.items():
+            if self.scores.get(player_id) != score:
+                parts.append(SCORE_RECORD.pack(SCORE, player_id, score))
+                self.scores[player_id] = score
+
+        food = (engine.food.position, engine.food.type)
+        if food != self.food:
+            x, y = engine.food.position or (-1, -1)
+            parts.append(FOOD_RECORD.pack(FOOD, x, y, FOOD_TYPES.index(engine.food.type)))
+            self.food = food
+
+        obstacles = [(obstacle.type, obstacle.color, obstacle.position) for obstacle in engine.obstacles]
+        goombas = [(goomba.position, goomba.animation_frame) for goomba in engine.goombas]
+        if len(obstacles) != len(self.obstacles) or len(goombas) != len(self.goombas):
+            parts.append(COUNTS_RECORD.pack(COUNTS, len(obstacles), len(goombas)))
+        for index, obstacle in enumerate(obstacles):
+            if index >= len(self.obstacles) or self.obstacles[index] != obstacle:
+                obstacle_type, (red, green, blue), (x, y) = obstacle
+                parts.append(OBSTACLE_RECORD.pack(OBSTACLE, index, OBSTACLE_TYPES.index(obstacle_type),
+                                                  red, green, blue, x, y))
+        for index, goomba in enumerate(goombas):
+            if index >= len(self.goombas) or self.goombas[index] != goomba:
+                (x, y), frame = goomba
+                parts.append(GOOMBA_RECORD.pack(GOOMBA, index, x, y, frame))
+        self.obstacles = obstacles
+        self.goombas = goombas
+        return b"".join(parts)
+
+class RoomView:
+    """ A client's copy of a room, kept up to date from the server's messages
+
+    It has the attributes the game draws from (snake, food, obstacles,
+    goombas, score, rivals(), width, height, theme_name), so a remote room
+    is shown with the same draw_game() as a local session. Obstacles and
+    Goombas are updated in place, so interpolating between ticks works too.
+    """
+    def __init__(self):
+        self.player_id = None
+        self.theme_name = None
+        self.width = GRID_WIDTH
+        self.height = GRID_HEIGHT
+        self.ticks = 0
+        self.snakes = {}  # Player id -> Snake
+        self.scores = {}
+        self.food = Food()
+        self.obstacles = []
+        self.goombas = []
+        # The player's own snake from its first spawn on, still shown where
+        # it died until it respawns
+        self.snake = None
+
+    @property
+    def score(self):
+        return self.scores.get(self.player_id, 0)
+
+    @property
+    def alive(self):
+        return self.player_id in self.snakes
+
+    def rivals(self):
+        return [snake for player_id, snake in self.snakes.items() if player_id != self.player_id]
+
+    def apply(self, kind, payload):
+        """ Update from one server message """
+        if kind == WELCOME:
+            self.player_id, = WELCOME_MESSAGE.unpack_from(payload)
+        elif kind == KEYFRAME:
+            self.ticks, theme_index, self.width, self.height = KEYFRAME_HEADER.unpack_from(payload)
+            if theme_index >= len(THEME_NAMES):
+                raise ProtocolError(f"Unknown theme index {theme_index}")
+            self.theme_name = THEME_NAMES[theme_index]
+            self.snakes = {}
+            self.scores = {}
+            self.obstacles = []
+            self.goombas = []
+            self.apply_records(payload, KEYFRAME_HEADER.size)
+        elif kind == DELTA:
+            self.ticks, = DELTA_HEADER.unpack_from(payload)
+            self.apply_records(payload, DELTA_HEADER.size)
+
+    def apply_records(self, data, offset):
+        try:
+            while offset < len(data):
+                tag = data[offset]
+                if tag == MOVE:
+                    _, player_id, code = MOVE_RECORD.unpack_from(data, offset)
+                    offset += MOVE_RECORD.size
+                    snake = self.snakes[player_id]
+                    snake.direction = DIRECTIONS[code & 3]
+                    x, y = snake.body[0]
+                    dx, dy = snake.direction.value
+                    snake.body.appendleft((x + dx, y + dy))
+                    if not code & GREW:
+                        snake.body.pop()
+                elif tag == SPAWN:
+                    _, player_id, direction, length = SPAWN_RECORD.unpack_from(data, offset)
+                    offset += SPAWN_RECORD.size
+                    values = struct.unpack_from(f"<{2 * length}h", data, offset)
+                    offset += 4 * length
+                    snake = Snake(self.width, self.height)
+                    snake.body = deque(zip(values[0::2], values[1::2]))
+                    snake.direction = DIRECTIONS[direction]
+                    self.snakes[player_id] = snake
+                    if player_id == self.player_id:
+                        self.snake = snake
+                elif tag == REMOVE:
+                    _, player_id, cause = REMOVE_RECORD.unpack_from(data, offset)
+                    offset += REMOVE_RECORD.size
+                    self.snakes.pop(player_id, None)
+                    if cause == LEFT_ROOM:
+                        self.scores.pop(player_id, None)
+                elif tag == SCORE:
+                    _, player_id, score = SCORE_RECORD.unpack_from(data, offset)
+                    offset += SCORE_RECORD.size
+                    self.scores[player_id] = score
+                elif tag == FOOD:
+                    _, x, y, food_type = FOOD_RECORD.unpack_from(data, offset)
+                    offset += FOOD_RECORD.size
+                    self.food = Food(FOOD_TYPES[food_type], width=self.width, height=self.height)
+                    self.food.position = None if x < 0 else (x, y)
+                elif tag == COUNTS:
+                    _, num_obstacles, num_goombas = COUNTS_RECORD.unpack_from(data, offset)
+                    offset += COUNTS_RECORD.size
+                    del self.obstacles[num_obstacles:]
+                    while len(self.obstacles) < num_obstacles:
+                        self.obstacles.append(Obstacle("palm", (0, 0, 0), width=self.width, height=self.height))
+                    del self.goombas[num_goombas:]
+                    while len(self.goombas) < num_goombas:
+                        self.goombas.append(Goomba((0, 0), width=self.width, height=self.height))
+                elif tag == OBSTACLE:
+                    _, index, obstacle_type, red, green, blue, x, y = OBSTACLE_RECORD.unpack_from(data, offset)
+                    offset += OBSTACLE_RECORD.size
+                    obstacle = self.obstacles[index]
+                    obstacle.type = OBSTACLE_TYPES[obstacle_type]
+                    obstacle.color = (red, green, blue)
+                    obstacle.position = (x, y)
+                elif tag == GOOMBA:
+                    _, index, x, y, frame = GOOMBA_RECORD.unpack_from(data, offset)
+                    offset += GOOMBA_RECORD.size
+                    goomba = self.goombas[index]
+                    goomba.position = (x, y)
+                    goomba.animation_frame = frame
+                else:
+                    raise ProtocolError(f"Unknown record tag {tag}")
+        except (struct.error, IndexError, KeyError) as error:
+            raise ProtocolError(f"Malformed record: {error}")
+
+class RemoteRoom:
+    """ Connection to a server room for a frame based game loop
+
+    The socket never blocks after joining: receive() returns whatever
+    messages have arrived since the last call, for the caller to apply.
+    Turns are queued and sent as fast as the socket takes them, on every
+    turn() and receive().
+    """
+    def __init__(self, host, port, room_name, theme_name):
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.sendall(join_message(room_name, theme_name))
+        self.socket.setblocking(False)
+        self.reader = MessageReader()
+        self.view = RoomView()
+        self.outgoing = bytearray()  # Bytes the socket hasn't taken yet
+
+    def flush(self):
+        """ Send as much of the queued bytes as the socket takes without blocking """
+        while self.outgoing:
+            try:
+                sent = self.socket.send(self.outgoing)
+            except BlockingIOError:
+                return
+            del self.outgoing[:sent]
+
+    def receive(self):
+        """ Messages that have arrived, raises ConnectionError when the server has gone """
+        self.flush()
+        messages = []
+        while True:
+            try:
+                data = self.socket.recv(65536)
+            except BlockingIOError:
+                return messages
+            if not data:
+                raise ConnectionError("Server closed the connection")
+            messages.extend(self.reader.feed(data))
+
+    def turn(self, direction):
+        self.outgoing += turn_message(direction)
+        self.flush()
+
+    def close(self):
+        self.socket.close()
+
+class Room:
+    """ One shared board and the clients playing on it """
+    def __init__(self, name, theme_name, width=GRID_WIDTH, height=GRID_HEIGHT):
+        self.name = name
+        self.engine = MultiSnakeEngine(theme_name, width=width, height=height)
+        self.encoder = DeltaEncoder(self.engine)
+        self.clients = {}  # Player id -> StreamWriter
+        self.joining = {}  # Player id -> StreamWriter, for players that haven't been sent the room yet
+        self.respawns = {}  # Player id -> tick to come back at
+        self.next_id = 1
+        self.keyframe_size = 0  # Bytes of the last keyframe, which may still be on its way to a client
+
+    def join(self, writer):
+        """ Add a player, returns its player id
+
+        Its snake plays from the next tick, after which it is sent the room.
+        Keyframes are only made right after a delta, so the newcomer starts
+        from exactly what everyone else has been sent.
+        """
+        while self.next_id in self.clients or self.next_id in self.joining:
+            self.next_id = self.next_id % 0xFFFF + 1
+        player_id = self.next_id
+        self.next_id = self.next_id % 0xFFFF + 1
+        self.joining[player_id] = writer
+        if self.engine.add_player(player_id) is None:
+            self.respawns[player_id] = self.engine.ticks + RESPAWN_TICKS
+        return player_id
+
+    def leave(self, player_id):
+        self.clients.pop(player_id, None)
+        self.joining.pop(player_id, None)
+        self.respawns.pop(player_id, None)
+        self.engine.remove_player(player_id)
+
+    def turn(self, player_id, direction):
+        snake = self.engine.snakes.get(player_id)
+        if snake is not None and direction < len(DIRECTIONS):
+            snake.queue_direction(DIRECTIONS[direction])
+
+    def tick(self):
+        """ Advance the room one tick and send the delta to everyone in it """
+        engine = self.engine
+        for player_id, tick in list(self.respawns.items()):
+            if engine.ticks >= tick:
+                del self.respawns[player_id]
+                if engine.add_player(player_id) is None:
+                    self.respawns[player_id] = engine.ticks + RESPAWN_TICKS
+        engine.step()
+        for player_id in engine.deaths:
+            self.respawns[player_id] = engine.ticks + RESPAWN_TICKS
+
+        if engine.game_over:
+            # The board is full, start over with everyone on a new one
+            engine.reset()
+            self.respawns.clear()
+            for player_id in list(self.clients) + list(self.joining):
+                if engine.add_player(player_id) is None:
+                    self.respawns[player_id] = engine.ticks + RESPAWN_TICKS
+            self.encoder = DeltaEncoder(engine)
+            self.encoder.delta()
+            self.broadcast(self.keyframe())
+        else:
+            self.broadcast(pack_message(DELTA, self.encoder.delta()))
+
+        if self.joining:
+            keyframe = self.keyframe()
+            for player_id, writer in self.joining.items():
+                writer.write(pack_message(WELCOME, WELCOME_MESSAGE.pack(player_id)) + keyframe)
+            self.clients.update(self.joining)
+            self.joining.clear()
+
+    def keyframe(self):
+        message = pack_message(KEYFRAME, self.encoder.keyframe())
+        self.keyframe_size = len(message)
+        return message
+
+    def broadcast(self, message):
+        for player_id, writer in list(self.clients.items()):
+            if writer.transport.get_write_buffer_size() > MAX_BACKLOG + self.keyframe_size:
+                # Too far behind to catch up, its connection handler cleans up
+                writer.transport.abort()
+                del self.clients[player_id]
+            else:
+                writer.write(message)
+
+class SnakeServer:
+    """ Rooms by name, ticked together by one task on the event loop """
+    def __init__(self, width=GRID_WIDTH, height=GRID_HEIGHT):
+        self.width = width
+        self.height = height
+        self.rooms = {}
+        self.tick_times = deque(maxlen=10000)  # Seconds spent ticking all rooms, for stats
+        self.late_ticks = 0
+
+    async def handle(self, reader, writer):
+        """ Connection handler for asyncio.start_server """
+        room = None
+        player_id = None
+        try:
+            while True:
+                kind, payload = await read_message(reader, MAX_CLIENT_MESSAGE)
+                if kind == JOIN and room is None:
+                    if not payload or payload[0] >= len(THEME_NAMES):
+                        raise ProtocolError("Invalid join")
+                    name = payload[1:].decode(errors="replace")
+                    room = self.rooms.get(name)
+                    if room is None:
+                        room = self.rooms[name] = Room(name, THEME_NAMES[payload[0]], self.width, self.height)
+                    player_id = room.join(writer)
+                elif kind == TURN and room is not None and payload:
+                    room.turn(player_id, payload[0])
+        except (asyncio.IncompleteReadError, ConnectionError, ProtocolError):
+            pass
+        finally:
+            if room is not None:
+                room.leave(player_id)
+                if not room.clients and not room.joining and self.rooms.get(room.name) is room:
+                    del self.rooms[room.name]
+            writer.close()
+
+    async def run(self):
+        """ Tick every room at FPS until cancelled, without drifting """
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            start = time.perf_counter()
+            for room in list(self.rooms.values()):
+                room.tick()
+            self.tick_times.append(time.perf_counter() - start)
+            next_tick += TICK_TIME
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # Overloaded, skip what was missed instead of ticking in a burst
+                self.late_ticks += 1
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def close(self):
+        """ Disconnect every client, after what was already sent """
+        for room in self.rooms.values():
+            for writer in list(room.clients.values()) + list(room.joining.values()):
+                writer.close()
+
+async def serve(host, port, width, height):
+    server = SnakeServer(width, height)
+    listener = await asyncio.start_server(server.handle, host, port)
+    print(f"Serving Snake rooms on {host}:{port}")
+    async with listener:
+        await server.run()
+
+def state(room):
+    """ What a RoomView must agree on with the engine of its room """
+    return (room.ticks,
+            {player_id: tuple(snake.body) for player_id, snake in room.snakes.items()},
+            dict(room.scores),
+            (room.food.position, room.food.type),
+            [(obstacle.type, tuple(obstacle.color), obstacle.position) for obstacle in room.obstacles],
+            [(goomba.position, goomba.animation_frame) for goomba in room.goombas])
+
+async def loopback_client(port, room_name, theme_name, seed, stats):
+    """ Client that turns at random and keeps a RoomView, returns (room name, view) at disconnect """
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(join_message(room_name, theme_name))
+    view = RoomView()
+    try:
+        while True:
+            kind, payload = await read_message(reader)
+            view.apply(kind, payload)
+            stats[kind] = stats.get(kind, 0) + MESSAGE_HEADER.size + len(payload)
+            if kind == DELTA and view.alive and rng.random() < 0.2:
+                writer.write(turn_message(rng.choice(DIRECTIONS)))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    writer.close()
+    return room_name, view
+
+async def loopback(num_rooms, clients_per_room, seconds, width, height):
+    """ Run a server and its clients in this process, returns the number of views out of sync """
+    server = SnakeServer(width, height)
+    listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    ticker = asyncio.create_task(server.run())
+
+    stats = {}
+    clients = []
+    for room in range(num_rooms):
+        for client in range(clients_per_room):
+            theme_name = THEME_NAMES[room % len(THEME_NAMES)]
+            clients.append(asyncio.create_task(
+                loopback_client(port, f"room-{room}", theme_name, room * clients_per_room + client, stats)))
+            await asyncio.sleep(0)
+    await asyncio.sleep(seconds)
+
+    ticker.cancel()
+    expected = {name: state(room.engine) for name, room in server.rooms.items()}
+    ticks = max((room.engine.ticks for room in server.rooms.values()), default=0)
+    server.close()
+    views = await asyncio.gather(*clients)
+    listener.close()
+    await listener.wait_closed()
+
+    out_of_sync = sum(1 for name, view in views if state(view) != expected.get(name))
+    tick_times = sorted(server.tick_times)
+    def percentile(q):
+        return tick_times[min(len(tick_times) - 1, len(tick_times) * q // 100)] * 1000 if tick_times else 0.0
+    delta_bytes = stats.get(DELTA, 0) / max(1, len(views) * ticks)
+    print(f"Rooms: {num_rooms}, clients: {len(views)}, ticks: {ticks}")
+    print(f"Tick of all rooms: p50 {percentile(50):.2f} ms  p95 {percentile(95):.2f} ms  "
+          f"p99 {percentile(99):.2f} ms  (budget {TICK_TIME * 1000:.0f} ms, {server.late_ticks} late)")
+    print(f"Received per client: {delta_bytes:.1f} bytes/tick of deltas, "
+          f"{stats.get(KEYFRAME, 0) / max(1, len(views)):.0f} bytes of keyframes")
+    print(f"Views out of sync with the server: {out_of_sync}")
+    return out_of_sync
+
+def main():
+    parser = argparse.ArgumentParser(description="Multiplayer server for Snake")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port to listen on (default {DEFAULT_PORT})")
+    parser.add_argument("--board", metavar="WxH", type=board_size, default=(GRID_WIDTH, GRID_HEIGHT),
+                        help=f"board size of every room, default {GRID_WIDTH}x{GRID_HEIGHT}")
+    parser.add_argument("--loopback", metavar="ROOMS", type=int,
+                        help="instead of serving, load test with ROOMS rooms of local clients and check they stay in sync")
+    parser.add_argument("--clients", type=int, default=3, help="clients per room for --loopback (default 3)")
+    parser.add_argument("--seconds", type=float, default=10, help="how long --loopback runs (default 10)")
+    args = parser.parse_args()
+
+    width, height = args.board
+    if args.loopback:
+        try:
+            import resource
+            # Two sockets per client in this process
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            wanted = 2 * args.loopback * args.clients + 64
+            if soft != resource.RLIM_INFINITY and soft < wanted:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (wanted if hard == resource.RLIM_INFINITY
+                                                            else min(wanted, hard), hard))
+        except (ImportError, ValueError, OSError):
+            pass
+        out_of_sync = asyncio.run(loopback(args.loopback, args.clients, args.seconds, width, height))
+        sys.exit(1 if out_of_sync else 0)
+    try:
+        asyncio.run(serve(args.host, args.port, width, height))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+The autopilot playing through Game.update(), as in --autopilot mode
+"""
+
+import os
+import unittest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+from snake_engine import GOOMBA_CELL, MARIO, Goomba
+from snake_game import Game
+
+class AutopilotGameTest(unittest.TestCase):
+    def test_avoids_goomba_on_its_path(self):
+        game = Game(prefetch=False, autopilot=True)
+        game.current_theme = next(theme for theme in game.themes if theme.name == MARIO)
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                self.play_past_goomba(game, seed)
+
+    def play_past_goomba(self, game, seed):
+        """ Put a Goomba on the autopilot's path during a tick and follow the path past it """
+        game.reset_game()
+        engine = game.engine
+        engine.reset(MARIO, seed)
+        game.remember_positions()
+        game.game_state = "playing"
+        game.update()  # Plans the path to the food
+
+        # The Goomba turns up during the next tick on a free cell of the path, like one walking onto it
+        path = list(game.autopilot.path)
+        cell = next((cell for cell in path[2:] if engine.free_cells.covered[cell[1] * engine.width + cell[0]] == 0
+                     and cell != engine.food.position), None)
+        if cell is None:
+            self.skipTest("the food is right next to the snake")
+        update_goombas = engine.update_goombas
+        def goomba_arrives():
+            update_goombas()
+            engine.goombas.append(Goomba(cell, width=engine.width, height=engine.height))
+            engine.free_cells.occupy(cell, GOOMBA_CELL)
+            engine.update_goombas = update_goombas
+        engine.update_goombas = goomba_arrives
+
+        heads = []
+        for i in range(len(path) + 10):
+            game.update()
+            if game.game_state != "playing":
+                break
+            heads.append(engine.snake.body[0])
+        self.assertNotIn(cell, heads)
+        self.assertNotEqual(engine.death_cause, "goomba")
+
+if __name__ == "__main__":
+    unittest.main()